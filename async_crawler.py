@@ -0,0 +1,245 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+from cache import make_cache_key, normalize_url
+from group_index import record_supergroup_table
+from metrics import stage
+from fetch import POOL_SIZE, fetch_page, submit_common_supergroup_form
+from new_scrape_method import (get_supergroup_info, get_wyckoff_splitting_info, parse_supergroup_table,
+                               parse_supergroup_info, parse_wyckoff_position_splitting_info, parse_wyckoff_splitting_info)
+
+VERBOSE=False
+
+# Maximum number of requests in flight to the same host at any time
+MAX_CONCURRENCY_PER_HOST = 8
+
+#################################################################################################################################
+
+
+def _memoize(memo, results):
+    # Stores the results of a level, keyed by URL, in a memo and its persistent stores
+    for url, rows in results.items():
+        memo.set(normalize_url(url), rows)
+
+
+class HostLimiter:
+    """
+    Bounds the number of concurrent requests per host with one asyncio.Semaphore per host.
+
+    Args:
+        limit (int): The maximum number of concurrent requests to a single host.
+    """
+
+    def __init__(self, limit=MAX_CONCURRENCY_PER_HOST):
+        self.limit = limit
+        self._semaphores = {}
+
+    def __call__(self, url):
+        host = urlsplit(url).netloc
+        if host not in self._semaphores:
+            self._semaphores[host] = asyncio.Semaphore(self.limit)
+        return self._semaphores[host]
+
+
+class AsyncCrawler:
+    """
+    Expands the common supergroups tree (table -> supergroup pages -> Wyckoff splitting pages
+    -> position splitting forms) breadth-first, fetching every page of a level concurrently.
+
+    The blocking fetches, parses and memo lookups run in a thread pool, the fetches over the
+    shared pooled session from fetch.py, so the event loop never waits for the network, a
+    parser or a SQLite store. An asyncio.Semaphore per host keeps the number of requests in
+    flight bounded.
+    Each URL is only fetched once per crawl, even if several rows link to it.
+
+    Args:
+        max_concurrency_per_host (int, optional): The maximum number of requests in flight per host.
+        verbose (bool, optional): Whether to print verbose output.
+    """
+
+    def __init__(self, max_concurrency_per_host=MAX_CONCURRENCY_PER_HOST, verbose=VERBOSE):
+        self.max_concurrency_per_host = max_concurrency_per_host
+        self.verbose = verbose
+        self._limiter = None
+        self._executor = None
+        self._in_flight = {}
+
+    async def __aenter__(self):
+        # Entering the crawler shares one limiter, thread pool and set of in-flight pages
+        # between several crawl() calls
+        self._limiter = HostLimiter(self.max_concurrency_per_host)
+        self._executor = ThreadPoolExecutor(max_workers=max(self.max_concurrency_per_host, POOL_SIZE))
+        self._in_flight = {}
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self._executor.shutdown(wait=False)
+        self._limiter = None
+        self._executor = None
+        self._in_flight = {}
+
+    async def _run(self, function, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, function, *args)
+
+    async def fetch_and_parse(self, url, parser, data=None):
+        """
+        Fetches a page under the per-host limit and parses it in the thread pool.
+
+        Args:
+            url (str): The URL to fetch.
+            parser (callable): Called as parser(html, url) to turn the page into results.
+            data (dict, optional): Form fields to POST instead of a GET.
+
+        Returns:
+            The parsed results.
+        """
+        async with self._limiter(url):
+            html, final_url = await self._run(fetch_page, url, data, None, self.verbose)
+        return await self._run(parser, html, final_url)
+
+    async def gather_unique(self, urls, parser, memo=None):
+        """
+        Fetches and parses every distinct URL of one level of the tree concurrently.
+
+        Args:
+            urls (iterable): The URLs of the level, possibly with repeats.
+            parser (callable): The parser for the pages of this level.
+            memo (memo.MemoCache, optional): Results already parsed in this process. URLs found
+                in it are not fetched again.
+
+        Returns:
+            tuple: The freshly parsed results and the memoized results, both keyed by URL.
+        """
+        unique_urls = list(dict.fromkeys(url for url in urls if url))
+
+        memoized = {}
+        if memo is not None:
+            # The memo may look up its persistent stores in SQLite, so it is kept off the event loop
+            results = await asyncio.gather(*(self._run(memo.get, normalize_url(url)) for url in unique_urls))
+            memoized = {url: result for url, result in zip(unique_urls, results) if result is not None}
+            unique_urls = [url for url in unique_urls if url not in memoized]
+
+        if self.verbose:
+            print("Fetching", len(unique_urls), "pages,", len(memoized), "already parsed")
+        results = await asyncio.gather(*(self._fetch_and_parse_once(url, parser) for url in unique_urls))
+        return dict(zip(unique_urls, results)), memoized
+
+    async def gather_forms(self, form_requests, parser):
+        """
+        Submits every distinct form request of one level of the tree concurrently.
+
+        Args:
+            form_requests (iterable): The (url, form data) requests of the level, possibly with repeats.
+            parser (callable): The parser for the pages returned by the forms.
+
+        Returns:
+            dict: The parsed results keyed by the cache key of each request (see cache.make_cache_key).
+        """
+        unique_requests = {}
+        for url, data in form_requests:
+            if url:
+                unique_requests.setdefault(make_cache_key(url, data), (url, data))
+
+        if self.verbose:
+            print("Submitting", len(unique_requests), "forms")
+        results = await asyncio.gather(*(self._fetch_and_parse_once(url, parser, data)
+                                         for url, data in unique_requests.values()))
+        return dict(zip(unique_requests, results))
+
+    def _fetch_and_parse_once(self, url, parser, data=None):
+        # Concurrent crawls asking for the same page await a single fetch
+        key = normalize_url(url) if data is None else make_cache_key(url, data)
+        if key not in self._in_flight:
+            future = asyncio.ensure_future(self.fetch_and_parse(url, parser, data))
+            future.add_done_callback(lambda _: self._in_flight.pop(key, None))
+            self._in_flight[key] = future
+        return self._in_flight[key]
+
+    async def crawl(self, spg_1, z_1, spg_2, z_2, k_index):
+        """
+        Retrieves the common supergroups of two spacegroups and expands every row of the table.
+
+        Parameters:
+        spg_1 (int): The spacegroup number of the first spacegroup.
+        z_1 (int): The Z number of the first spacegroup.
+        spg_2 (int): The spacegroup number of the second spacegroup.
+        z_2 (int): The Z number of the second spacegroup.
+        k_index (int): The index of the maxik option to select.
+
+        Returns:
+        list: A list of dictionaries with the same nested shape as
+              main.get_common_supergroups_of_two_spacegroups_without_browser.
+        """
+        if self._executor is None:
+            async with self:
+                return await self.crawl(spg_1, z_1, spg_2, z_2, k_index)
+
+        html, url = await self._run(submit_common_supergroup_form, spg_1, z_1, spg_2, z_2, k_index, None, self.verbose)
+        all_rows_data = await self._run(parse_supergroup_table, html, url, self.verbose)
+        await self._run(record_supergroup_table, spg_1, z_1, spg_2, z_2, all_rows_data)
+
+        # The stages time the wall time of each level, every page of which is fetched concurrently
+
+        # Level 1: every supergroup page linked from the table
+        supergroup_urls = [entry[branch] for entry in all_rows_data for branch in ('G > H1', 'G > H2')]
+        with stage("crawl_supergroup_info"):
+            new_supergroup_infos, supergroup_infos = await self.gather_unique(
+                supergroup_urls, parse_supergroup_info, memo=get_supergroup_info.memo)
+
+        # Level 2: every Wyckoff splitting page linked from the newly parsed supergroup pages
+        wyckoff_urls = [row["Wyckoff splitting url"] for rows in new_supergroup_infos.values() for row in rows]
+        with stage("crawl_wyckoff_splitting_info"):
+            new_wyckoff_infos, wyckoff_infos = await self.gather_unique(
+                wyckoff_urls, parse_wyckoff_splitting_info, memo=get_wyckoff_splitting_info.memo)
+
+        # Level 3: every position splitting form of the newly parsed Wyckoff splitting pages
+        form_requests = [(row["Wyckoff position splitting url"], row["Wyckoff position splitting form"])
+                         for rows in new_wyckoff_infos.values() for row in rows]
+        with stage("crawl_position_splitting"):
+            position_splitting_infos = await self.gather_forms(form_requests, parse_wyckoff_position_splitting_info)
+        for rows in new_wyckoff_infos.values():
+            for row_dict in rows:
+                if row_dict["Wyckoff position splitting url"]:
+                    row_dict["Wyckoff Position Splitting Info"] = position_splitting_infos[make_cache_key(
+                        row_dict["Wyckoff position splitting url"], row_dict["Wyckoff position splitting form"])]
+
+        # Share the new results with the sequential scraper's memos, whose stores are written in the thread pool
+        await self._run(_memoize, get_wyckoff_splitting_info.memo, new_wyckoff_infos)
+        wyckoff_infos.update(new_wyckoff_infos)
+
+        # Reassemble the results into the nested shape of the sequential scraper
+        for rows in new_supergroup_infos.values():
+            for row_dict in rows:
+                row_dict["Wyckoff splitting info"] = wyckoff_infos.get(row_dict["Wyckoff splitting url"])
+        await self._run(_memoize, get_supergroup_info.memo, new_supergroup_infos)
+        supergroup_infos.update(new_supergroup_infos)
+
+        for entry in all_rows_data:
+            if entry['G > H1']:
+                entry['G > H1 Supergroup Info'] = supergroup_infos[entry['G > H1']]
+            if entry['G > H2']:
+                entry['G > H2 Supergroup Info'] = supergroup_infos[entry['G > H2']]
+
+        return all_rows_data
+
+
+def crawl_common_supergroups(spg_1, z_1, spg_2, z_2, k_index, max_concurrency_per_host=MAX_CONCURRENCY_PER_HOST, verbose=VERBOSE):
+    """
+    Runs AsyncCrawler.crawl to completion from synchronous code.
+
+    Parameters:
+    spg_1 (int): The spacegroup number of the first spacegroup.
+    z_1 (int): The Z number of the first spacegroup.
+    spg_2 (int): The spacegroup number of the second spacegroup.
+    z_2 (int): The Z number of the second spacegroup.
+    k_index (int): The index of the maxik option to select.
+    max_concurrency_per_host (int): The maximum number of requests in flight per host.
+    verbose (bool): Whether to print verbose output. Default is VERBOSE.
+
+    Returns:
+    list: A list of dictionaries containing the data of the common supergroups.
+    """
+    crawler = AsyncCrawler(max_concurrency_per_host=max_concurrency_per_host, verbose=verbose)
+    return asyncio.run(crawler.crawl(spg_1, z_1, spg_2, z_2, k_index))
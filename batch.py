@@ -0,0 +1,415 @@
+import argparse
+import asyncio
+import csv
+import queue
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+
+from async_crawler import AsyncCrawler
+from canonical import derive_result, plan_queries
+from driver_pool import DriverPool, set_driver_pool
+from group_index import GroupIndex, get_group_index, set_group_index
+from journal import Journal, pair_key
+from main import get_common_supergroups_of_two_spacegroups
+from memo import set_persistent_store
+from metrics import configure_json_logging, stage, start_metrics_server, time_breakdown, write_prometheus
+from models import compact_results
+from pipeline import Pipeline
+from refresh import refresh
+from work_queue import POLL_INTERVAL, WorkQueue
+from writers import open_sink
+
+VERBOSE=False
+
+MODES = ("thread", "process", "async", "pipeline")
+DEFAULT_WORKERS = 8
+
+PAIR_FIELDS = ("spg_1", "z_1", "spg_2", "z_2", "k_index")
+
+#################################################################################################################################
+
+
+def read_pairs(path):
+    """
+    Reads the queries of a batch from a CSV file.
+
+    The file has one query per line with the columns spg_1, z_1, spg_2, z_2, k_index.
+    A header line with these names is optional.
+
+    Args:
+        path (str): The path of the CSV file.
+
+    Returns:
+        list: The queries as (spg_1, z_1, spg_2, z_2, k_index) tuples of ints.
+    """
+    pairs = []
+    with open(path, newline="") as file:
+        for row in csv.reader(file):
+            if not row or row[0].strip().startswith("#"):
+                continue
+            if row[0].strip() == PAIR_FIELDS[0]:
+                continue
+            pairs.append(parse_pair(row))
+    return pairs
+
+
+def parse_pair(values):
+    """
+    Converts the five values of a query to a (spg_1, z_1, spg_2, z_2, k_index) tuple.
+
+    Args:
+        values (str or sequence): Either a comma separated string or a sequence of five values.
+
+    Returns:
+        tuple: The query as a tuple of ints.
+    """
+    if isinstance(values, str):
+        values = values.split(",")
+    values = [str(value).strip() for value in values]
+    if len(values) != len(PAIR_FIELDS):
+        raise ValueError(f"Expected {len(PAIR_FIELDS)} values ({', '.join(PAIR_FIELDS)}), got {values}")
+    return tuple(int(value) for value in values)
+
+
+def dedupe_pairs(pairs):
+    """
+    Removes repeated queries while keeping the order of their first occurrence.
+
+    Args:
+        pairs (iterable): The (spg_1, z_1, spg_2, z_2, k_index) queries.
+
+    Returns:
+        list: The distinct queries.
+    """
+    return list(dict.fromkeys(tuple(pair) for pair in pairs))
+
+
+def query_pair(pair, verbose=VERBOSE, use_selenium=False, offline=False):
+    """
+    Runs a single query of a batch.
+
+    Args:
+        pair (tuple): The (spg_1, z_1, spg_2, z_2, k_index) query.
+        verbose (bool, optional): Whether to print verbose output.
+        use_selenium (bool, optional): Whether to scrape with a driver leased from the shared
+            driver pool instead of plain HTTP.
+        offline (bool, optional): Whether to compute the query from the group index set with
+            group_index.set_group_index instead of the server. Only the table is computed.
+
+    Returns:
+        list: The common supergroups of the query.
+    """
+    with stage("query", pair=pair):
+        return get_common_supergroups_of_two_spacegroups(*pair, verbose=verbose, use_selenium=use_selenium, offline=offline)
+
+
+def _run_in_executor(executor, pairs, verbose, use_selenium, offline):
+    futures = {executor.submit(query_pair, pair, verbose, use_selenium, offline): pair for pair in pairs}
+    for future in as_completed(futures):
+        pair = futures[future]
+        try:
+            yield pair, future.result(), None
+        except Exception as error:
+            yield pair, None, error
+
+
+def _run_async(pairs, workers, verbose):
+    # The event loop runs in a background thread and hands finished queries over a queue,
+    # so results can be consumed from a plain generator as they complete
+    results = queue.Queue()
+    done = object()
+
+    async def crawl_all():
+        async with AsyncCrawler(max_concurrency_per_host=workers, verbose=verbose) as crawler:
+            async def crawl_one(pair):
+                try:
+                    results.put((pair, await crawler.crawl(*pair), None))
+                except Exception as error:
+                    results.put((pair, None, error))
+
+            await asyncio.gather(*(crawl_one(pair) for pair in pairs))
+
+    def run_loop():
+        try:
+            asyncio.run(crawl_all())
+        finally:
+            results.put(done)
+
+    thread = threading.Thread(target=run_loop, daemon=True)
+    thread.start()
+    while True:
+        item = results.get()
+        if item is done:
+            break
+        yield item
+    thread.join()
+
+
+def _run_pipeline(pairs, workers, verbose):
+    # Every query is crawled through one pipeline, whose fetchers and parse processes are shared
+    with Pipeline(verbose=verbose) as pipeline, ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(pipeline.crawl, *pair): pair for pair in pairs}
+        for future in as_completed(futures):
+            pair = futures[future]
+            try:
+                yield pair, future.result(), None
+            except Exception as error:
+                yield pair, None, error
+
+
+def _run_queue(work_queue, pairs, workers, verbose, use_selenium, offline):
+    # Every thread pulls queries from the queue shared with the other hosts until none is left
+    # unfinished. The queue is also the store of the sub-pages, so each is fetched by one worker only.
+    work_queue.add_pairs(pairs)
+    results = queue.Queue()
+    done = object()
+
+    def work():
+        try:
+            while True:
+                pair = work_queue.claim_pair()
+                if pair is None:
+                    if not work_queue.unfinished_pairs():
+                        return
+                    # The remaining queries are leased by other workers, which may die before completing them
+                    time.sleep(POLL_INTERVAL)
+                    continue
+                try:
+                    result = query_pair(pair, verbose, use_selenium, offline)
+                except Exception as error:
+                    work_queue.fail_pair(pair, error)
+                    results.put((pair, None, error))
+                else:
+                    work_queue.complete_pair(pair, result)
+                    results.put((pair, result, None))
+        finally:
+            results.put(done)
+
+    set_persistent_store(work_queue, role="queue")
+    try:
+        with work_queue.heartbeats():
+            threads = [threading.Thread(target=work, daemon=True) for _ in range(workers)]
+            for thread in threads:
+                thread.start()
+            n_running = len(threads)
+            while n_running:
+                item = results.get()
+                if item is done:
+                    n_running -= 1
+                    continue
+                yield item
+    finally:
+        set_persistent_store(None, role="queue")
+
+
+def _init_worker(journal, index):
+    set_persistent_store(journal)
+    set_group_index(index)
+
+
+def _run(pairs, workers, mode, journal, verbose, use_selenium, offline, work_queue):
+    if work_queue is not None:
+        yield from _run_queue(work_queue, pairs, workers, verbose, use_selenium, offline)
+        return
+    if mode == "async":
+        yield from _run_async(pairs, workers, verbose)
+        return
+    if mode == "pipeline":
+        yield from _run_pipeline(pairs, workers, verbose)
+        return
+
+    if mode == "thread":
+        executor = ThreadPoolExecutor(max_workers=workers)
+    else:
+        # Worker processes record the sub-pages they complete in the journal and group index themselves
+        executor = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(journal, get_group_index()))
+    with executor:
+        yield from _run_in_executor(executor, pairs, verbose, use_selenium, offline)
+
+
+def _run_planned(pairs, *run_args):
+    # Runs each pair of groups once, in canonical order at the largest k_index requested, and
+    # derives every requested query from its result. Queries added to a work queue by other
+    # hosts are yielded as they are.
+    plan = plan_queries(pairs)
+    for query, result, error in _run(list(plan), *run_args):
+        for pair in plan.get(query) or [query]:
+            yield pair, None if error is not None else derive_result(result, query, pair), error
+
+
+def run_batch(pairs, workers=DEFAULT_WORKERS, mode="thread", journal=None, verbose=VERBOSE, use_selenium=False, offline=False,
+              compact=False, work_queue=None):
+    """
+    Runs many common supergroup queries concurrently and yields each result as soon as it completes.
+
+    Repeated queries are only run once, and so are queries that only differ by the order of
+    their groups or by their k_index: the pair of groups is queried once in canonical order
+    with the largest k_index, and the other queries are derived from its result (see
+    canonical.plan_queries). All modes share the on-disk response cache; the
+    thread and async modes also share one pooled HTTP session and the in-process memos.
+
+    When a journal is given, every completed supergroup or Wyckoff splitting page is recorded
+    in it as soon as it finishes, and every completed query once the caller asks for the next
+    result, i.e. once it is done with this one (e.g. has written it to the output). Running the
+    batch again with the same journal skips the queries already completed and reuses the
+    recorded pages, so an interrupted sweep resumes where it stopped without losing a result
+    that was yielded but not written. Failed queries are recorded and retried.
+
+    With a work_queue, the queries are added to the queue and this process becomes one of its
+    workers: workers threads pull queries from it until none is left, including the queries
+    added by workers on other hosts, and yield the ones they completed. Supergroup and Wyckoff
+    splitting pages are claimed in the queue before being fetched, so a page is fetched by one
+    worker and read from the queue by the others.
+
+    With use_selenium, every query drives Chrome with a driver leased from the shared driver
+    pool (see driver_pool.get_driver_pool), which should be sized to the number of workers.
+    Each worker process of the process mode has its own pool.
+
+    Args:
+        pairs (iterable): The (spg_1, z_1, spg_2, z_2, k_index) queries.
+        workers (int, optional): The number of worker threads or processes, of requests in
+            flight per host in async mode, or of queries crawled at once in pipeline mode.
+            Defaults to DEFAULT_WORKERS.
+        mode (str, optional): One of "thread", "process", "async" or "pipeline" (see
+            pipeline.Pipeline). Defaults to "thread".
+        journal (journal.Journal, optional): The journal recording the progress of the batch.
+        verbose (bool, optional): Whether to print verbose output.
+        use_selenium (bool, optional): Whether to scrape through Chrome. Only in the thread and process modes.
+        offline (bool, optional): Whether to compute every query from the group index set with
+            group_index.set_group_index, without contacting the server. Only in the thread and process modes.
+        compact (bool, optional): Whether to yield the results as models.CommonSupergroup objects,
+            which take much less memory than the dictionaries when many results are kept.
+        work_queue (work_queue.WorkQueue, optional): The queue shared with workers on other hosts.
+            Only in the thread mode.
+
+    Yields:
+        tuple: (pair, result, error) for every query that was not already completed, in
+               completion order. result is None and error holds the exception when the query failed.
+    """
+    if mode not in MODES:
+        raise ValueError(f"Unknown mode {mode!r}, expected one of {MODES}")
+    if use_selenium and mode in ("async", "pipeline"):
+        raise ValueError(f"The {mode} mode does not support use_selenium, use the thread or process mode")
+    if offline and (use_selenium or mode in ("async", "pipeline")):
+        raise ValueError("offline only runs in the thread or process mode, without use_selenium")
+    if work_queue is not None and mode != "thread":
+        raise ValueError("A work queue is only pulled from in the thread mode")
+    pairs = dedupe_pairs(pairs)
+
+    if journal is None:
+        for pair, result, error in _run_planned(pairs, workers, mode, journal, verbose, use_selenium, offline, work_queue):
+            yield pair, compact_results(result) if compact and result is not None else result, error
+        return
+
+    completed = journal.completed_pairs()
+    if verbose:
+        print("Skipping", sum(pair_key(pair) in completed for pair in pairs), "queries completed in a previous run")
+    pairs = [pair for pair in pairs if pair_key(pair) not in completed]
+
+    set_persistent_store(journal)
+    try:
+        for pair, result, error in _run_planned(pairs, workers, mode, journal, verbose, use_selenium, offline, work_queue):
+            if error is not None:
+                journal.record_failure(pair, error)
+                yield pair, result, error
+                continue
+            if compact:
+                result = compact_results(result)
+            yield pair, result, error
+            # Only reached when the caller asks for the next result, so a run killed while the
+            # caller handles this one runs the query again when resumed
+            journal.record_pair(pair, result)
+    finally:
+        set_persistent_store(None)
+
+
+def main(argv=None):
+    """
+    Command line entry point: runs a batch of queries read from a CSV file and/or --pair options.
+
+    Args:
+        argv (list, optional): The arguments. Defaults to sys.argv[1:].
+    """
+    parser = argparse.ArgumentParser(description="Run many common supergroup queries against the Bilbao Crystallographic Server.")
+    parser.add_argument("csv", nargs="?", help="CSV file with the columns spg_1, z_1, spg_2, z_2, k_index")
+    parser.add_argument("--pair", action="append", default=[], help="A single query as spg_1,z_1,spg_2,z_2,k_index (repeatable)")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="Number of workers")
+    parser.add_argument("--mode", choices=MODES, default="thread", help="How the queries are run concurrently")
+    parser.add_argument("--journal", help="SQLite journal recording progress; rerun with the same journal to resume")
+    parser.add_argument("--index", help="SQLite group index (see group_index.py) answering the pages it holds and recording the others")
+    parser.add_argument("--refresh", action="store_true", help="Revalidate the pages recorded in --journal and --index first, and run again the queries they changed")
+    parser.add_argument("--offline", action="store_true", help="Compute the queries from the group index given with --index, without contacting the server")
+    parser.add_argument("--queue", help="SQLite work queue on a disk shared with workers on other hosts (see work_queue.py); "
+                                        "the queries given are added to it and this process works on it until it is empty")
+    parser.add_argument("--output", help="Stream the results to this file (.jsonl, or .parquet with pyarrow) instead of printing them")
+    parser.add_argument("--selenium", action="store_true", help="Scrape through a pool of headless Chrome drivers, one per worker")
+    parser.add_argument("--metrics-file", help="Write Prometheus metrics to this file after every query (e.g. for node_exporter)")
+    parser.add_argument("--metrics-port", type=int, help="Serve Prometheus metrics at http://localhost:PORT/metrics")
+    parser.add_argument("--log-json", nargs="?", const="", help="Log fetch and stage events as JSON lines to this file (stderr if no file is given)")
+    parser.add_argument("--verbose", action="store_true", help="Print verbose output")
+    args = parser.parse_args(argv)
+
+    pairs = read_pairs(args.csv) if args.csv else []
+    pairs += [parse_pair(pair) for pair in args.pair]
+    if not pairs and not args.queue:
+        parser.error("no queries given, pass a CSV file or --pair")
+    if args.offline and not args.index:
+        parser.error("--offline needs the group index given with --index")
+    if args.refresh and not args.journal and not args.index:
+        parser.error("--refresh needs a journal or group index to refresh")
+
+    if args.log_json is not None:
+        configure_json_logging(args.log_json or None)
+    if args.metrics_port:
+        start_metrics_server(args.metrics_port)
+
+    if args.index:
+        set_group_index(GroupIndex(args.index))
+    if args.selenium and args.mode == "thread":
+        set_driver_pool(DriverPool(size=args.workers, verbose=args.verbose))
+
+    start_time = time.time()
+    n_failed = 0
+    journal = Journal(args.journal) if args.journal else None
+    if args.refresh:
+        summary = refresh(journal=journal, index=get_group_index(), verbose=args.verbose)
+        print(len(summary["changed_pages"]), "pages changed,", len(summary["stale_pairs"]), "queries to run again")
+    # When resuming from a journal, the results of the previous run are already in the output file,
+    # unless it cannot be appended to (Parquet) and they have to be written again
+    sink = open_sink(args.output, append=journal is not None) if args.output else None
+    try:
+        if sink is not None and journal is not None and not sink.appending:
+            for pair, result in journal.completed_results():
+                sink.write(pair, result)
+        for pair, result, error in run_batch(pairs, workers=args.workers, mode=args.mode, journal=journal, verbose=args.verbose,
+                                             use_selenium=args.selenium, offline=args.offline,
+                                             work_queue=WorkQueue(args.queue) if args.queue else None):
+            print("-"*200)
+            if args.metrics_file:
+                write_prometheus(args.metrics_file)
+            if error is not None:
+                n_failed += 1
+                print(pair, "failed:", repr(error))
+                continue
+            print(pair, len(result), "common supergroups")
+            if sink is not None:
+                sink.write(pair, result)
+                continue
+            for entry in result:
+                print(entry)
+                print("\n")
+    finally:
+        if sink is not None:
+            sink.close()
+
+    if args.metrics_file:
+        write_prometheus(args.metrics_file)
+    print("-"*200)
+    print("Execution time:", time.time() - start_time, "seconds,", n_failed, "failed queries")
+    print("Time breakdown:", time_breakdown())
+
+
+if __name__ == "__main__":
+
+    main()
@@ -0,0 +1,341 @@
+import argparse
+import copy
+import json
+import os
+import statistics
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+from bs4 import BeautifulSoup
+
+import fetch
+import memo
+import new_scrape_method
+from throttle import HostPolicy, set_host_policy
+
+VERBOSE=False
+
+# The saved pages, next to this file so the benchmarks run from any directory
+FIXTURE_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+DEFAULT_REPEAT = 5
+DEFAULT_ROWS = 1000
+# Smaller defaults for the benchmarks run along with the rest of the tests
+TEST_REPEAT = 3
+TEST_ROWS = 200
+
+# The query answered by the fixtures in data/
+FIXTURE_QUERY = (213, 2, 214, 2, 2)
+
+POSITION_SPLITTING_PATH = "/cgi-bin/cryst/programs/nph-wpsplit"
+
+# The stub server is not rate limited, so the benchmarks measure the scraper and not the throttle
+STUB_RATE = 1e6
+
+#################################################################################################################################
+# Pages served by the stub server
+
+
+def load_fixture(name, directory=FIXTURE_DIRECTORY):
+    """
+    Reads one of the saved pages.
+
+    Args:
+        name (str): The file name, e.g. "supergroup_webpage.html".
+        directory (str, optional): The directory holding the saved pages.
+
+    Returns:
+        str: The content of the page.
+    """
+    with open(os.path.join(directory, name), encoding="iso-8859-1") as file:
+        return file.read()
+
+
+def enlarge_table(html, selector, n_rows, n_header_rows=1, unique_links=False):
+    """
+    Builds a synthetic variant of a saved page whose table has n_rows data rows,
+    by repeating the rows it already has.
+
+    Args:
+        html (str): The saved page.
+        selector (str): The CSS selector of the table.
+        n_rows (int): The number of data rows wanted.
+        n_header_rows (int, optional): The number of header rows at the top of the table.
+        unique_links (bool, optional): Whether to make the links of every copied row distinct,
+            so that a crawl has to fetch one page per row.
+
+    Returns:
+        str: The enlarged page.
+    """
+    soup = BeautifulSoup(html, "html.parser")
+    table = soup.select_one(selector)
+    rows = new_scrape_method.get_table_rows(table)
+    header_rows, data_rows = rows[:n_header_rows], rows[n_header_rows:]
+    parent = data_rows[0].parent
+    for row in data_rows:
+        row.extract()
+    for i_row in range(n_rows):
+        row = copy.copy(data_rows[i_row % len(data_rows)])
+        if unique_links:
+            for link in row.find_all("a", href=True):
+                if "?" in link["href"]:
+                    link["href"] += f"&copy={i_row}"
+        parent.append(row)
+    return str(soup)
+
+
+def synthetic_wyckoff_splitting_page(n_rows=8):
+    """
+    Builds a Wyckoff splitting page (nph-allwpsplit) with n_rows Wyckoff positions,
+    each with a form requesting its position splitting.
+
+    Args:
+        n_rows (int, optional): The number of Wyckoff positions.
+
+    Returns:
+        str: The page.
+    """
+    rows = []
+    for i_row in range(n_rows):
+        rows.append(
+            f"<tr><td>{i_row + 1}</td><td>{8 * (i_row + 1)}a</td><td>4a 4b</td>"
+            f"<td><form method=\"post\" action=\"{POSITION_SPLITTING_PATH}\">"
+            f"<input type=\"hidden\" name=\"super\" value=\"230\"><input type=\"hidden\" name=\"sub\" value=\"213\">"
+            f"<input type=\"hidden\" name=\"wp\" value=\"{i_row + 1}\">"
+            f"<input type=\"submit\" value=\"Relations\"></form></td></tr>"
+        )
+    return (
+        "<html><body><table border=\"5\" width=\"60%\">"
+        "<tr><th colspan=\"4\">Wyckoff positions</th></tr>"
+        "<tr><th>N</th><th>Group</th><th>Subgroup</th><th>More</th></tr>"
+        + "".join(rows)
+        + "</table></body></html>"
+    )
+
+
+def synthetic_position_splitting_page(n_rows=8):
+    """
+    Builds a position splitting page: rows of 5 columns start a subgroup orbit,
+    rows of 4 columns continue it.
+
+    Args:
+        n_rows (int, optional): The number of rows.
+
+    Returns:
+        str: The page.
+    """
+    rows = []
+    for i_row in range(n_rows):
+        name = f"<td>4a</td>" if i_row % 2 == 0 else ""
+        rows.append(f"<tr><td>{i_row + 1}</td><td>(x,y,z)</td><td>(x,y,z)</td>{name}<td>(x+1/2,y,z)</td></tr>")
+    return (
+        "<html><body><table border=\"\">"
+        "<tr><th colspan=\"5\">Splitting</th></tr>"
+        "<tr><th>N</th><th>Group basis</th><th>Subgroup basis</th><th>Subgroup</th><th>Representative</th></tr>"
+        + "".join(rows)
+        + "</table></body></html>"
+    )
+
+
+def build_pages(n_rows=None, unique_links=False):
+    """
+    Returns the pages served by the stub server for each CGI path.
+
+    Args:
+        n_rows (int, optional): If given, the tables are enlarged to this many rows.
+        unique_links (bool, optional): Whether the enlarged common supergroups table links to distinct pages.
+
+    Returns:
+        dict: The page content keyed by URL path.
+    """
+    table_page = load_fixture("supergroup_webpage.html")
+    supergroup_page = load_fixture("supergroup_of_same_type.html")
+    wyckoff_page = synthetic_wyckoff_splitting_page()
+    if n_rows:
+        table_page = enlarge_table(table_page, 'table[border="0"][cellpadding="3"]', n_rows, n_header_rows=2,
+                                   unique_links=unique_links)
+        supergroup_page = enlarge_table(supergroup_page, 'table[border=""]', n_rows)
+        wyckoff_page = synthetic_wyckoff_splitting_page(n_rows)
+    return {
+        fetch.COMMONSUPER_FORM_PATH: load_fixture("target_webpage.html"),
+        fetch.COMMONSUPER_PATH: table_page,
+        "/cgi-bin/cryst/programs/nph-show_all_super": supergroup_page,
+        "/cgi-bin/cryst/programs/nph-allwpsplit": wyckoff_page,
+        POSITION_SPLITTING_PATH: synthetic_position_splitting_page(),
+    }
+
+
+class StubServer:
+    """
+    Local HTTP server replaying saved pages in place of www.cryst.ehu.es.
+
+    While the server is entered, fetch.BASE_URL points at it, so the scrapers talk to it
+    without any other change, and requests to it are not rate limited. Every GET or POST to a known path returns its page,
+    whatever the query string or form fields. The method, path and form fields of every request are kept in requests.
+
+    Args:
+        pages (dict): The page content keyed by URL path (see build_pages).
+        latency (float, optional): Seconds to wait before answering, to simulate the network.
+    """
+
+    def __init__(self, pages, latency=0.0):
+        self.pages = {path: content.encode("iso-8859-1", errors="replace") for path, content in pages.items()}
+        self.latency = latency
+        self.n_requests = 0
+        self.requests = []
+        self._server = None
+        self._thread = None
+        self._base_url = None
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def _reply(self):
+                stub.n_requests += 1
+                length = int(self.headers.get("Content-Length") or 0)
+                body = self.rfile.read(length).decode("iso-8859-1") if length else ""
+                stub.requests.append((self.command, urlsplit(self.path).path, dict(parse_qsl(body))))
+                content = stub.pages.get(urlsplit(self.path).path)
+                if stub.latency:
+                    time.sleep(stub.latency)
+                if content is None:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", "text/html; charset=iso-8859-1")
+                self.send_header("Content-Length", str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+
+            do_GET = _reply
+            do_POST = _reply
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def __enter__(self):
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        self._base_url = fetch.BASE_URL
+        fetch.BASE_URL = self.url
+        set_host_policy(self.url, HostPolicy(rate=STUB_RATE, max_rate=STUB_RATE, burst=STUB_RATE))
+        return self
+
+    def __exit__(self, *exc_info):
+        set_host_policy(self.url, None)
+        fetch.BASE_URL = self._base_url
+        self._server.shutdown()
+        self._server.server_close()
+
+#################################################################################################################################
+# Measurements
+
+
+def measure(name, function, repeat=DEFAULT_REPEAT, n_items=1, setup=None, verbose=VERBOSE):
+    """
+    Times a function over several runs.
+
+    Args:
+        name (str): The name of the measurement.
+        function (callable): The function to time, called without arguments.
+        repeat (int, optional): The number of timed runs.
+        n_items (int, optional): The number of items (rows, pages, queries) processed per run,
+            used to report a throughput.
+        setup (callable, optional): Called before every run, outside the timing.
+        verbose (bool, optional): Whether to print the measurement.
+
+    Returns:
+        dict: The name, best and median time in seconds and the throughput in items per second.
+    """
+    times = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start_time = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start_time)
+    result = {
+        "name": name,
+        "min": min(times),
+        "median": statistics.median(times),
+        "items_per_second": n_items / min(times) if min(times) > 0 else float("inf"),
+    }
+    if verbose:
+        print(f"{name:<55} min {result['min'] * 1000:10.2f} ms   median {result['median'] * 1000:10.2f} ms"
+              f"   {result['items_per_second']:12.1f} items/s")
+    return result
+
+
+def reset_state():
+    """
+    Drops the response cache and the memos so that every run does the full work.
+    """
+    fetch.set_cache(None)
+    memo.clear_memos()
+
+
+def compare(results, baseline_path, tolerance):
+    """
+    Compares measurements with a saved baseline.
+
+    Args:
+        results (list): The new measurements.
+        baseline_path (str): The JSON file written by a previous run with --save.
+        tolerance (float): The allowed relative slowdown of the best time, e.g. 0.2 for 20%.
+
+    Returns:
+        list: The names of the measurements that got slower than allowed.
+    """
+    with open(baseline_path) as file:
+        baseline = {result["name"]: result for result in json.load(file)}
+    regressions = []
+    for result in results:
+        previous = baseline.get(result["name"])
+        if previous is not None and result["min"] > previous["min"] * (1 + tolerance):
+            regressions.append(result["name"])
+    return regressions
+
+
+def main():
+    """
+    Runs the benchmark cases of tests/test_benchmarks.py offline against the stub server,
+    optionally checking them against a baseline.
+    """
+    parser = argparse.ArgumentParser(description="Offline benchmarks replaying the saved pages from a local stub server.")
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT, help="Number of timed runs per measurement")
+    parser.add_argument("--rows", type=int, default=DEFAULT_ROWS, help="Number of rows of the enlarged synthetic pages")
+    parser.add_argument("--latency", type=float, default=0.0, help="Simulated network latency of the stub server in seconds")
+    parser.add_argument("--selenium", action="store_true", help="Also benchmark the Selenium path (needs Chrome)")
+    parser.add_argument("--save", help="Write the measurements to this JSON file")
+    parser.add_argument("--compare", help="Compare the measurements with a JSON file written by --save")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed relative slowdown when comparing")
+    args = parser.parse_args()
+
+    import pytest
+
+    options = ["--bench-repeat", str(args.repeat), "--bench-rows", str(args.rows), "--bench-latency", str(args.latency),
+               "--bench-tolerance", str(args.tolerance)]
+    if args.selenium:
+        options.append("--bench-selenium")
+    if args.save:
+        options += ["--bench-save", args.save]
+    if args.compare:
+        options += ["--bench-compare", args.compare]
+    tests = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tests", "test_benchmarks.py")
+    raise SystemExit(pytest.main(["-q", "-m", "benchmark", tests] + options))
+
+
+if __name__ == "__main__":
+
+    main()
@@ -0,0 +1,251 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+VERBOSE=False
+
+CACHE_PATH = os.environ.get("BILBAO_CACHE_PATH", ".bilbao_cache.sqlite")
+
+# The Bilbao pages are effectively static, so entries are kept for a long time
+DEFAULT_TTL = 30 * 24 * 3600  # seconds
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+# Number of least recently used entries read at a time when evicting
+EVICTION_BATCH = 64
+
+# Keeps the total size of the stored content up to date on every change of the responses table,
+# in the transaction of the change, so the size limit is checked without summing the table
+_SIZE_TRIGGERS = (
+    "CREATE TRIGGER IF NOT EXISTS responses_size_insert AFTER INSERT ON responses"
+    " BEGIN UPDATE cache_meta SET value = value + NEW.size WHERE name = 'total_size'; END",
+    "CREATE TRIGGER IF NOT EXISTS responses_size_update AFTER UPDATE OF size ON responses"
+    " BEGIN UPDATE cache_meta SET value = value + NEW.size - OLD.size WHERE name = 'total_size'; END",
+    "CREATE TRIGGER IF NOT EXISTS responses_size_delete AFTER DELETE ON responses"
+    " BEGIN UPDATE cache_meta SET value = value - OLD.size WHERE name = 'total_size'; END",
+)
+
+#################################################################################################################################
+
+
+def normalize_url(url):
+    """
+    Normalizes a URL so that equivalent spellings map to the same cache entry.
+
+    The scheme and host are lowercased, the fragment is dropped and the query
+    parameters are sorted.
+
+    Args:
+        url (str): The URL to normalize.
+
+    Returns:
+        str: The normalized URL.
+    """
+    parts = urlsplit(url)
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path or "/", query, ""))
+
+
+def make_cache_key(url, data=None):
+    """
+    Builds the cache key of a request from its normalized URL and, for form POSTs, its payload.
+
+    Args:
+        url (str): The URL of the request.
+        data (dict, optional): The form fields of a POST request.
+
+    Returns:
+        str: The hex SHA-256 digest identifying the request.
+    """
+    method = "GET" if data is None else "POST"
+    payload = "" if data is None else urlencode(sorted((str(k), str(v)) for k, v in data.items()))
+    return hashlib.sha256("\n".join((method, normalize_url(url), payload)).encode("utf-8")).hexdigest()
+
+
+def content_hash(content):
+    """
+    Returns the hex SHA-256 digest of a response content, used to detect changed pages.
+    """
+    return hashlib.sha256(content).hexdigest()
+
+
+class ResponseCache:
+    """
+    Persistent cache of raw HTTP responses stored in a SQLite database.
+
+    Entries expire after ttl seconds, and once the stored content exceeds max_bytes
+    the least recently used entries are evicted. The total size of the stored content is
+    kept in the database by triggers, so checking the limit does not read the whole table.
+    The database is opened in WAL mode so several processes of a batch run can share it.
+
+    Args:
+        path (str, optional): The path of the SQLite database. Defaults to CACHE_PATH.
+        ttl (float, optional): The lifetime of an entry in seconds. None keeps entries forever.
+        max_bytes (int, optional): The maximum total size of the stored content.
+    """
+
+    def __init__(self, path=CACHE_PATH, ttl=DEFAULT_TTL, max_bytes=DEFAULT_MAX_BYTES):
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._connection = None
+        self._pid = None
+
+    def _connect(self):
+        # Connections cannot be shared with forked worker processes, so reopen after a fork
+        if self._connection is None or self._pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=60, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            # The schema is set up in one write transaction, so no other process stores a
+            # response between the creation of the size triggers and the first total
+            connection.execute("BEGIN IMMEDIATE")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                " key TEXT PRIMARY KEY,"
+                " url TEXT NOT NULL,"
+                " content BLOB NOT NULL,"
+                " content_hash TEXT NOT NULL,"
+                " size INTEGER NOT NULL,"
+                " stored_at REAL NOT NULL,"
+                " last_access REAL NOT NULL)"
+            )
+            connection.execute("CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access)")
+            # Validators of the response, added after the first release of the cache
+            columns = {row[1] for row in connection.execute("PRAGMA table_info(responses)")}
+            for column in ("etag", "last_modified"):
+                if column not in columns:
+                    connection.execute(f"ALTER TABLE responses ADD COLUMN {column} TEXT")
+            # The total size, added after the first release of the cache, is computed once for existing databases
+            connection.execute("CREATE TABLE IF NOT EXISTS cache_meta (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+            if connection.execute("SELECT 1 FROM cache_meta WHERE name = 'total_size'").fetchone() is None:
+                connection.execute("INSERT INTO cache_meta (name, value) SELECT 'total_size', COALESCE(SUM(size), 0) FROM responses")
+            for trigger in _SIZE_TRIGGERS:
+                connection.execute(trigger)
+            connection.commit()
+            self._connection = connection
+            self._pid = os.getpid()
+        return self._connection
+
+    def get(self, key):
+        """
+        Looks up a response and marks it as recently used.
+
+        Args:
+            key (str): The cache key from make_cache_key.
+
+        Returns:
+            tuple or None: The content (bytes) and final URL, or None on a miss or an expired entry.
+        """
+        with self._lock:
+            connection = self._connect()
+            row = connection.execute("SELECT content, url, stored_at FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            content, url, stored_at = row
+            now = time.time()
+            if self.ttl is not None and now - stored_at > self.ttl:
+                connection.execute("DELETE FROM responses WHERE key = ?", (key,))
+                connection.commit()
+                return None
+            connection.execute("UPDATE responses SET last_access = ? WHERE key = ?", (now, key))
+            connection.commit()
+            return bytes(content), url
+
+    def get_entry(self, key):
+        """
+        Returns the metadata of a stored response, even if it has expired, so it can be revalidated.
+
+        Args:
+            key (str): The cache key from make_cache_key.
+
+        Returns:
+            dict or None: With the keys "url", "content_hash", "etag", "last_modified" and
+                          "stored_at", or None if the response is not stored.
+        """
+        with self._lock:
+            row = self._connect().execute(
+                "SELECT url, content_hash, etag, last_modified, stored_at FROM responses WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        return dict(zip(("url", "content_hash", "etag", "last_modified", "stored_at"), row))
+
+    def touch(self, key):
+        """
+        Marks a stored response as fresh again, after the server confirmed it did not change.
+
+        Args:
+            key (str): The cache key from make_cache_key.
+        """
+        now = time.time()
+        with self._lock:
+            connection = self._connect()
+            connection.execute("UPDATE responses SET stored_at = ?, last_access = ? WHERE key = ?", (now, now, key))
+            connection.commit()
+
+    def set(self, key, content, url, etag=None, last_modified=None):
+        """
+        Stores a response, then evicts least recently used entries if the cache is over its size limit.
+
+        Args:
+            key (str): The cache key from make_cache_key.
+            content (bytes): The raw response content.
+            url (str): The final URL of the response.
+            etag (str, optional): The ETag header of the response.
+            last_modified (str, optional): The Last-Modified header of the response.
+        """
+        now = time.time()
+        digest = content_hash(content)
+        with self._lock:
+            connection = self._connect()
+            # An upsert rather than INSERT OR REPLACE, whose implicit delete would not fire the size trigger
+            connection.execute(
+                "INSERT INTO responses (key, url, content, content_hash, size, stored_at, last_access, etag, last_modified)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)"
+                " ON CONFLICT (key) DO UPDATE SET url = excluded.url, content = excluded.content,"
+                " content_hash = excluded.content_hash, size = excluded.size, stored_at = excluded.stored_at,"
+                " last_access = excluded.last_access, etag = excluded.etag, last_modified = excluded.last_modified",
+                (key, url, sqlite3.Binary(content), digest, len(content), now, now, etag, last_modified),
+            )
+            self._evict(connection)
+            connection.commit()
+
+    def _evict(self, connection):
+        if self.max_bytes is None:
+            return
+        total = self._total_size(connection)
+        while total > self.max_bytes:
+            rows = connection.execute("SELECT key, size FROM responses ORDER BY last_access LIMIT ?", (EVICTION_BATCH,)).fetchall()
+            if not rows:
+                break
+            for key, size in rows:
+                connection.execute("DELETE FROM responses WHERE key = ?", (key,))
+                total -= size
+                if total <= self.max_bytes:
+                    break
+
+    def _total_size(self, connection):
+        return connection.execute("SELECT value FROM cache_meta WHERE name = 'total_size'").fetchone()[0]
+
+    def clear(self):
+        """
+        Removes every entry from the cache.
+        """
+        with self._lock:
+            connection = self._connect()
+            connection.execute("DELETE FROM responses")
+            connection.commit()
+
+    def stats(self):
+        """
+        Returns the number of entries and the total size of the stored content.
+
+        Returns:
+            dict: With the keys "entries" and "bytes".
+        """
+        with self._lock:
+            connection = self._connect()
+            entries = connection.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+            total = self._total_size(connection)
+        return {"entries": entries, "bytes": total}
@@ -0,0 +1,152 @@
+import functools
+import inspect
+
+VERBOSE=False
+
+# Columns of the common supergroups table describing H1 and their H2 counterparts
+MIRRORED_COLUMNS = (('i1', 'i2'), ('it1', 'it2'), ('ik1', 'ik2'), ('G > H1', 'G > H2'),
+                    ('G > H1 Supergroup Info', 'G > H2 Supergroup Info'))
+MIRRORED_BRANCHES = {"H1": "H2", "H2": "H1"}
+
+#################################################################################################################################
+
+
+def canonical_pair(pair):
+    """
+    Puts a query in canonical order, the group with the smaller (number, Z) first.
+
+    The common supergroups of (G1, G2) and (G2, G1) are the same; only the H1 and H2
+    columns of the table are swapped (see mirror_result).
+
+    Args:
+        pair (tuple): The (spg_1, z_1, spg_2, z_2, k_index) query.
+
+    Returns:
+        tuple: The canonical query, and whether its groups were swapped.
+    """
+    spg_1, z_1, spg_2, z_2, k_index = pair
+    if (spg_2, z_2) < (spg_1, z_1):
+        return (spg_2, z_2, spg_1, z_1, k_index), True
+    return tuple(pair), False
+
+
+def _renumber(all_rows_data):
+    return [dict(entry, N=str(n)) for n, entry in enumerate(all_rows_data, start=1)]
+
+
+def mirror_result(all_rows_data):
+    """
+    Turns the result of a query into the result of the query with its two groups swapped.
+
+    The H1 and H2 columns (indices, links and supergroup info) of every row are exchanged;
+    the rows keep the order the server gave them for the canonical query. The pages linked
+    from the rows are shared, not copied.
+
+    Args:
+        all_rows_data (list): The dictionaries returned by get_common_supergroups_of_two_spacegroups.
+
+    Returns:
+        list: New dictionaries, one per row.
+    """
+    mirrored = []
+    for entry in all_rows_data:
+        entry = dict(entry)
+        for left, right in MIRRORED_COLUMNS:
+            # The supergroup info keys are only present for the branches that were scraped
+            values = {key: entry.pop(key) for key in (left, right) if key in entry}
+            if left in values:
+                entry[right] = values[left]
+            if right in values:
+                entry[left] = values[right]
+        mirrored.append(entry)
+    return mirrored
+
+
+def _parse_index(value):
+    # The index cells are numbers, but a malformed row may leave them empty
+    text = str(value).strip()
+    return int(text) if text.isdigit() else None
+
+
+def restrict_k_index(all_rows_data, k_index):
+    """
+    Turns the result of a query into the result of the same query with a smaller k_index,
+    keeping the rows whose ik1 and ik2 are both at most k_index.
+
+    Rows whose ik1 or ik2 is not an integer cannot be placed under any k_index and are
+    dropped, like group_index.GroupIndex.record_supergroup_table does.
+
+    Args:
+        all_rows_data (list): The dictionaries returned by get_common_supergroups_of_two_spacegroups.
+        k_index (int): The smaller k_index.
+
+    Returns:
+        list: New dictionaries, one per row kept.
+    """
+    kept = []
+    for entry in all_rows_data:
+        ik_1, ik_2 = _parse_index(entry.get('ik1', '')), _parse_index(entry.get('ik2', ''))
+        if ik_1 is not None and ik_2 is not None and ik_1 <= k_index and ik_2 <= k_index:
+            kept.append(entry)
+    return _renumber(kept)
+
+
+def derive_result(result, query, pair):
+    """
+    Derives the result of a query from the result of its canonical form with a k_index at least as large.
+
+    Args:
+        result (list): The result of query.
+        query (tuple): The query that was run, as returned by plan_queries.
+        pair (tuple): The query requested.
+
+    Returns:
+        list: The result of pair; result itself when pair is query.
+    """
+    if pair[4] < query[4]:
+        result = restrict_k_index(result, pair[4])
+    if canonical_pair(pair)[1]:
+        result = mirror_result(result)
+    return result
+
+
+def plan_queries(pairs):
+    """
+    Groups queries so that each pair of groups is queried once, in canonical order and with
+    the largest k_index requested for it. The other queries are derived with derive_result.
+
+    Args:
+        pairs (iterable): The (spg_1, z_1, spg_2, z_2, k_index) queries.
+
+    Returns:
+        dict: The requested queries, keyed by the query to run for them, in the order of their first occurrence.
+    """
+    groups = {}
+    for pair in pairs:
+        groups.setdefault(canonical_pair(pair)[0][:4], []).append(tuple(pair))
+    return {groups_key + (max(pair[4] for pair in requested),): requested for groups_key, requested in groups.items()}
+
+
+def symmetric_query(function):
+    """
+    Decorator running a common supergroups query in canonical order and mirroring its result
+    back, so that (G1, G2) and (G2, G1) share the cached table and pages.
+
+    The decorated function takes (spg_1, z_1, spg_2, z_2, k_index) as its first parameters;
+    a branches argument, given by position or keyword, is mirrored as well.
+    """
+    signature = inspect.signature(function)
+    query_parameters = list(signature.parameters)[:5]
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        bound = signature.bind(*args, **kwargs)
+        query, swapped = canonical_pair(tuple(bound.arguments[name] for name in query_parameters))
+        if not swapped:
+            return function(*args, **kwargs)
+        bound.arguments.update(zip(query_parameters, query))
+        if "branches" in bound.arguments:
+            bound.arguments["branches"] = tuple(MIRRORED_BRANCHES.get(branch, branch) for branch in bound.arguments["branches"])
+        return mirror_result(function(*bound.args, **bound.kwargs))
+
+    return wrapper
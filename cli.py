@@ -0,0 +1,110 @@
+import argparse
+import json
+import sys
+
+# Only the standard library is imported here. Each command imports what it needs when it
+# runs, so `--help`, `cache` and cached queries start without loading Selenium, and bs4 or
+# numpy are only loaded once a page has to be parsed.
+
+VERBOSE=False
+
+#################################################################################################################################
+
+
+def run_query(args):
+    """
+    Runs one query and prints every row of the common supergroups table as a JSON line,
+    or streams the result to --output.
+    """
+    import fetch
+    import new_scrape_method
+    from cache import ResponseCache
+    from group_index import GroupIndex, set_group_index
+    from main import get_common_supergroups_of_two_spacegroups
+    from writers import open_sink, to_jsonable
+
+    if args.no_cache:
+        fetch.set_cache(None)
+    elif args.cache:
+        fetch.set_cache(ResponseCache(args.cache))
+    if args.index:
+        set_group_index(GroupIndex(args.index))
+    if args.parser:
+        new_scrape_method.set_parser_backend(args.parser)
+
+    pair = (args.spg_1, args.z_1, args.spg_2, args.z_2, args.k_index)
+    result = get_common_supergroups_of_two_spacegroups(*pair, verbose=args.verbose, use_selenium=args.selenium,
+                                                       offline=args.offline, depth=args.depth,
+                                                       branches=tuple(args.branch or new_scrape_method.BRANCHES))
+    if args.output:
+        with open_sink(args.output) as sink:
+            sink.write(pair, result)
+        return
+    for entry in result:
+        print(json.dumps(to_jsonable(entry)))
+
+
+def run_cache(args):
+    """
+    Prints the size of the response cache, or empties it.
+    """
+    from cache import CACHE_PATH, ResponseCache
+
+    cache = ResponseCache(args.cache or CACHE_PATH)
+    if args.action == "clear":
+        cache.clear()
+        print("Cleared", cache.path)
+        return
+    print(json.dumps(dict(cache.stats(), path=cache.path)))
+
+
+def main(argv=None):
+    """
+    Command line entry point with the subcommands query, batch and cache.
+
+    Args:
+        argv (list, optional): The arguments. Defaults to sys.argv[1:].
+    """
+    argv = sys.argv[1:] if argv is None else argv
+    parser = argparse.ArgumentParser(description="Query the common supergroups of space groups on the Bilbao Crystallographic Server.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    query_parser = subparsers.add_parser("query", help="Run one query and print its rows as JSON lines")
+    for name in ("spg_1", "z_1", "spg_2", "z_2", "k_index"):
+        query_parser.add_argument(name, type=int)
+    query_parser.add_argument("--depth", type=int, choices=range(4),
+                              help="Levels below the table to retrieve: 0 the table only, 1 supergroup pages, "
+                                   "2 Wyckoff splitting pages, 3 position splitting (default, or 0 with --offline)")
+    query_parser.add_argument("--branch", action="append", choices=("H1", "H2"), help="Only follow the G > H1 or G > H2 links (repeatable)")
+    query_parser.add_argument("--offline", action="store_true", help="Compute the table from the group index given with --index")
+    query_parser.add_argument("--index", help="SQLite group index (see group_index.py)")
+    query_parser.add_argument("--selenium", action="store_true", help="Scrape through headless Chrome")
+    query_parser.add_argument("--parser", choices=("bs4", "lxml"), help="HTML parser backend")
+    query_parser.add_argument("--output", help="Write the result to this file (.jsonl, or .parquet with pyarrow) instead of printing it")
+    query_parser.add_argument("--cache", help="Path of the response cache")
+    query_parser.add_argument("--no-cache", action="store_true", help="Do not read or write the response cache")
+    query_parser.add_argument("--verbose", action="store_true", help="Print verbose output")
+
+    # The arguments of batch are parsed by batch.main, so they are documented by `batch --help`
+    batch_parser = subparsers.add_parser("batch", help="Run many queries, see `batch --help`", add_help=False)
+    batch_parser.add_argument("args", nargs=argparse.REMAINDER)
+
+    cache_parser = subparsers.add_parser("cache", help="Inspect or clear the response cache")
+    cache_parser.add_argument("action", choices=("stats", "clear"))
+    cache_parser.add_argument("--cache", help="Path of the response cache")
+
+    args = parser.parse_args(argv)
+    if args.command == "query":
+        if args.offline and not args.index:
+            query_parser.error("--offline needs the group index given with --index")
+        run_query(args)
+    elif args.command == "batch":
+        import batch
+        batch.main(args.args)
+    else:
+        run_cache(args)
+
+
+if __name__ == "__main__":
+
+    main()
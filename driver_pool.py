@@ -0,0 +1,316 @@
+import atexit
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from metrics import BROWSER_SECONDS, THROTTLE_WAIT_SECONDS
+from throttle import get_host_policy, host_of, retry_delay
+
+VERBOSE=False
+
+# Number of Chrome instances kept alive by the shared pool
+DRIVER_POOL_SIZE = int(os.environ.get("DRIVER_POOL_SIZE", 4))
+# A driver is quit and replaced after this many leases, to bound the memory Chrome leaks over time
+MAX_USES = 50
+HEADLESS = True
+# Seconds before a page load is abandoned, and number of times a timed out load is retried
+PAGE_LOAD_TIMEOUT = 60
+PAGE_LOAD_RETRIES = 2
+
+_POOL = None
+_POOL_LOCK = threading.Lock()
+
+#################################################################################################################################
+
+
+def find_chromedriver():
+    """
+    Returns the chromedriver to use: the CHROMEDRIVER_PATH environment variable if set, otherwise
+    a chromedriver (or chromedriver.exe) in the working directory as described in the README.
+
+    Returns:
+        str or None: The path, or None to let Selenium locate a driver itself.
+    """
+    path = os.environ.get("CHROMEDRIVER_PATH")
+    if path:
+        return path
+    for name in ("chromedriver.exe", "chromedriver"):
+        if os.path.isfile(name):
+            return os.path.abspath(name)
+    return None
+
+
+def create_driver(headless=HEADLESS, chromedriver_path=None):
+    """
+    Starts a Chrome WebDriver.
+
+    Args:
+        headless (bool, optional): Whether to run Chrome without a window. Defaults to HEADLESS.
+        chromedriver_path (str, optional): The chromedriver executable. Defaults to find_chromedriver().
+
+    Returns:
+        webdriver.Chrome: The new driver.
+    """
+    from selenium import webdriver
+    from selenium.webdriver.chrome.service import Service
+
+    options = webdriver.ChromeOptions()
+    if headless:
+        options.add_argument("--headless=new")
+    options.add_argument("--disable-gpu")
+    options.add_argument("--no-sandbox")
+    options.add_argument("--disable-dev-shm-usage")
+
+    chromedriver_path = chromedriver_path or find_chromedriver()
+    service = Service(executable_path=chromedriver_path) if chromedriver_path else Service()
+    driver = webdriver.Chrome(service=service, options=options)
+    driver.set_page_load_timeout(PAGE_LOAD_TIMEOUT)
+    return driver
+
+
+def load_page(driver, url, verbose=VERBOSE):
+    """
+    Loads a page in a driver under the rate limit and circuit breaker of its host (see throttle.py),
+    retrying with jittered exponential backoff when the load times out.
+
+    Args:
+        driver: The Selenium WebDriver instance.
+        url (str): The URL to load.
+        verbose (bool, optional): Whether to print verbose output.
+    """
+    from selenium.common.exceptions import TimeoutException, WebDriverException
+
+    policy = get_host_policy(url)
+    host = host_of(url)
+    for attempt in range(PAGE_LOAD_RETRIES + 1):
+        THROTTLE_WAIT_SECONDS.inc(policy.acquire(host), host=host)
+        start_time = time.monotonic()
+        try:
+            driver.get(url)
+        except TimeoutException:
+            BROWSER_SECONDS.observe(time.monotonic() - start_time, operation="load_page")
+            policy.record_throttled()
+            if attempt == PAGE_LOAD_RETRIES:
+                raise
+            if verbose:
+                print("Page load timed out, retrying", url)
+            time.sleep(retry_delay(attempt))
+            continue
+        except WebDriverException:
+            BROWSER_SECONDS.observe(time.monotonic() - start_time, operation="load_page")
+            policy.record_failure()
+            raise
+        latency = time.monotonic() - start_time
+        BROWSER_SECONDS.observe(latency, operation="load_page")
+        policy.record_success(latency)
+        return
+
+
+class DriverPool:
+    """
+    Thread-safe pool of long-lived Chrome WebDrivers.
+
+    Drivers are started on demand up to size, leased to one task at a time and returned to
+    the pool afterwards, so the Chrome launch cost is paid once per driver instead of once per
+    query. A driver is checked before each lease and replaced if it no longer responds,
+    and it is quit after max_uses leases.
+
+    Args:
+        size (int, optional): The maximum number of drivers alive at once. Defaults to DRIVER_POOL_SIZE.
+        max_uses (int, optional): The number of leases after which a driver is recycled. Defaults to MAX_USES.
+        headless (bool, optional): Whether Chrome runs without a window. Defaults to HEADLESS.
+        chromedriver_path (str, optional): The chromedriver executable. Defaults to find_chromedriver().
+        factory (callable, optional): Called without arguments to start a driver. Defaults to create_driver.
+        verbose (bool, optional): Whether to print verbose output.
+    """
+
+    def __init__(self, size=DRIVER_POOL_SIZE, max_uses=MAX_USES, headless=HEADLESS, chromedriver_path=None,
+                 factory=None, verbose=VERBOSE):
+        self.size = size
+        self.max_uses = max_uses
+        self.verbose = verbose
+        self._factory = factory or (lambda: create_driver(headless=headless, chromedriver_path=chromedriver_path))
+        self._idle = []
+        self._uses = {}
+        self._n_drivers = 0
+        self._closed = False
+        self._condition = threading.Condition()
+
+    def acquire(self, timeout=None):
+        """
+        Leases a driver, starting a new one if none is idle and the pool is not full.
+
+        Args:
+            timeout (float, optional): Seconds to wait for a driver when all of them are leased.
+                None waits forever.
+
+        Returns:
+            webdriver.Chrome: The leased driver. It must be given back with release.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            driver = self._take_or_reserve(deadline)
+            if driver is None:
+                driver = self._start_driver()
+            elif not self._is_healthy(driver):
+                if self.verbose:
+                    print("Replacing a driver that stopped responding")
+                self._discard(driver)
+                continue
+            with self._condition:
+                self._uses[driver] += 1
+            return driver
+
+    def release(self, driver, broken=False):
+        """
+        Gives a leased driver back to the pool.
+
+        Args:
+            driver (webdriver.Chrome): The driver returned by acquire.
+            broken (bool, optional): Whether the driver failed and must be replaced.
+        """
+        with self._condition:
+            recycle = broken or self._closed or self._uses.get(driver, 0) >= self.max_uses
+            if not recycle:
+                self._idle.append(driver)
+                self._condition.notify()
+                return
+        if self.verbose:
+            print("Quitting a driver after", self._uses.get(driver, 0), "uses")
+        self._discard(driver)
+
+    @contextmanager
+    def lease(self, timeout=None):
+        """
+        Context manager leasing a driver for the duration of a with block.
+
+        The driver is replaced if the block fails with a WebDriverException.
+
+        Args:
+            timeout (float, optional): Seconds to wait for a driver, see acquire.
+
+        Yields:
+            webdriver.Chrome: The leased driver.
+        """
+        from selenium.common.exceptions import WebDriverException
+
+        driver = self.acquire(timeout)
+        broken = False
+        try:
+            yield driver
+        except WebDriverException:
+            broken = True
+            raise
+        finally:
+            self.release(driver, broken=broken)
+
+    def close(self):
+        """
+        Quits every idle driver. Drivers still leased are quit when they are released.
+        """
+        with self._condition:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._condition.notify_all()
+        for driver in idle:
+            self._discard(driver)
+
+    def stats(self):
+        """
+        Returns the state of the pool.
+
+        Returns:
+            dict: With the keys "size", "alive", "idle" and "leased".
+        """
+        with self._condition:
+            return {"size": self.size, "alive": self._n_drivers, "idle": len(self._idle),
+                    "leased": self._n_drivers - len(self._idle)}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _take_or_reserve(self, deadline):
+        # Returns an idle driver, or None after reserving a slot for a new one
+        with self._condition:
+            while True:
+                if self._closed:
+                    raise RuntimeError("The driver pool is closed")
+                if self._idle:
+                    return self._idle.pop()
+                if self._n_drivers < self.size:
+                    self._n_drivers += 1
+                    return None
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    raise TimeoutError(f"No driver became available within the timeout ({self.size} leased)")
+                self._condition.wait(remaining)
+
+    def _start_driver(self):
+        if self.verbose:
+            print("Starting a new driver")
+        try:
+            driver = self._factory()
+        except Exception:
+            with self._condition:
+                self._n_drivers -= 1
+                self._condition.notify()
+            raise
+        with self._condition:
+            self._uses[driver] = 0
+        return driver
+
+    def _is_healthy(self, driver):
+        from selenium.common.exceptions import WebDriverException
+
+        try:
+            driver.execute_script("return 1")
+            return True
+        except WebDriverException:
+            return False
+
+    def _discard(self, driver):
+        with self._condition:
+            self._uses.pop(driver, None)
+            self._n_drivers -= 1
+            self._condition.notify()
+        try:
+            driver.quit()
+        except Exception:
+            pass
+
+
+def get_driver_pool():
+    """
+    Returns the driver pool shared by every Selenium scrape, creating it on first use.
+
+    The pool is closed when the interpreter exits.
+
+    Returns:
+        DriverPool: The shared pool.
+    """
+    global _POOL
+    with _POOL_LOCK:
+        if _POOL is None:
+            _POOL = DriverPool()
+            atexit.register(_POOL.close)
+        return _POOL
+
+
+def set_driver_pool(pool):
+    """
+    Replaces the driver pool shared by every Selenium scrape, closing the previous one.
+
+    Args:
+        pool (DriverPool): The new pool.
+    """
+    global _POOL
+    with _POOL_LOCK:
+        previous, _POOL = _POOL, pool
+    if previous is not None and previous is not pool:
+        previous.close()
+    if pool is not None:
+        atexit.register(pool.close)
@@ -0,0 +1,297 @@
+import time
+from urllib.parse import urljoin
+
+from cache import ResponseCache, content_hash, make_cache_key
+from metrics import CACHE_LOOKUPS, FETCH_RETRIES, REVALIDATIONS, THROTTLE_WAIT_SECONDS, record_fetch, timed_stage
+from throttle import get_host_policy, host_of, parse_retry_after, retry_delay
+
+VERBOSE=False
+
+BASE_URL = "https://www.cryst.ehu.es"
+COMMONSUPER_FORM_PATH = "/cryst/commonsuper.html"
+COMMONSUPER_PATH = "/cgi-bin/cryst/programs/paths/nph-commonsuper"
+
+# Number of keep-alive connections kept open per host by the shared session
+POOL_SIZE = 16
+
+_SESSION = None
+_CACHE = None
+
+# Set to False to always go to the network
+USE_CACHE = True
+
+# Seconds to wait for the connection to be established and for each read of the response
+CONNECT_TIMEOUT = 10
+READ_TIMEOUT = 60
+# Number of times a request is retried after a timeout, a connection error or one of RETRY_STATUSES
+MAX_RETRIES = 4
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+#################################################################################################################################
+
+
+def get_session():
+    """
+    Returns the shared requests.Session used for every HTTP fetch.
+
+    The session is created on first use and keeps a pool of keep-alive connections
+    to the server, so consecutive requests skip the TCP/TLS handshake.
+
+    Returns:
+        requests.Session: The shared session.
+    """
+    global _SESSION
+    if _SESSION is None:
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        _SESSION = session
+    return _SESSION
+
+
+def get_cache():
+    """
+    Returns the response cache shared by every fetch, opening the default on-disk cache on first use.
+
+    Returns:
+        ResponseCache or None: The cache, or None if caching is disabled.
+    """
+    global _CACHE
+    if _CACHE is None and USE_CACHE:
+        _CACHE = ResponseCache()
+    return _CACHE if USE_CACHE else None
+
+
+def set_cache(cache):
+    """
+    Replaces the response cache shared by every fetch.
+
+    Args:
+        cache (ResponseCache or None): The new cache. None disables caching.
+    """
+    global _CACHE, USE_CACHE
+    _CACHE = cache
+    USE_CACHE = cache is not None
+
+
+def absolute_url(href, base_url=None):
+    """
+    Resolves a (possibly relative) link found on a page to an absolute URL.
+
+    Args:
+        href (str): The link as it appears in the page.
+        base_url (str, optional): The URL of the page the link was found on. Defaults to BASE_URL.
+
+    Returns:
+        str: The absolute URL.
+    """
+    return urljoin(base_url or BASE_URL, href)
+
+
+def fetch_page(url, data=None, session=None, verbose=VERBOSE, use_cache=True):
+    """
+    Downloads a page, issuing a form POST when data is given and a GET otherwise.
+
+    Responses are looked up in and stored to the shared response cache, keyed by the
+    normalized URL and, for POSTs, the form payload.
+
+    Requests to the server go through the policy of its host (see throttle.py): they wait for
+    the adaptive rate limit, are refused while the circuit breaker of the host is open, and
+    are retried with jittered exponential backoff after a timeout, a connection error or a
+    429/5xx response.
+
+    Args:
+        url (str): The URL to fetch.
+        data (dict, optional): Form fields to POST. Defaults to None (GET).
+        session (requests.Session, optional): The session to use. Defaults to the shared session.
+        verbose (bool, optional): Whether to print verbose output.
+        use_cache (bool, optional): Whether to use the response cache for this request. Defaults to True.
+
+    Returns:
+        tuple: The raw page content (bytes) and the final URL after redirects.
+
+    Raises:
+        throttle.CircuitOpenError: If the circuit breaker of the host is open.
+        requests.RequestException: If the request still fails after MAX_RETRIES retries,
+            or fails with a status that is not retried.
+    """
+    cache = get_cache() if use_cache else None
+    if cache is not None:
+        key = make_cache_key(url, data)
+        cached = cache.get(key)
+        CACHE_LOOKUPS.inc(result="hit" if cached is not None else "miss")
+        if cached is not None:
+            if verbose:
+                print("Cache hit", url)
+            return cached
+
+    session = session or get_session()
+    response = request_with_retries(session, url, data=data, verbose=verbose)
+
+    if cache is not None:
+        store_response(cache, key, response)
+    return response.content, response.url
+
+
+def store_response(cache, key, response):
+    """
+    Stores a response in the cache with its validators (ETag and Last-Modified headers).
+    """
+    cache.set(key, response.content, response.url, etag=response.headers.get("ETag"),
+              last_modified=response.headers.get("Last-Modified"))
+
+
+def revalidate_page(url, data=None, session=None, verbose=VERBOSE):
+    """
+    Checks whether a cached page changed on the server, and stores the new version if it did.
+
+    GET requests are made conditional with the ETag and Last-Modified validators stored
+    with the page, so an unchanged page costs a 304 response without a body. When the
+    server answers with the full page (no validators, or a POST form), it is compared with
+    the stored one by content hash.
+
+    Args:
+        url (str): The URL of the page.
+        data (dict, optional): Form fields to POST. Defaults to None (GET).
+        session (requests.Session, optional): The session to use. Defaults to the shared session.
+        verbose (bool, optional): Whether to print verbose output.
+
+    Returns:
+        bool: True if the page changed or was not cached, False if it is unchanged.
+    """
+    cache = get_cache()
+    key = make_cache_key(url, data)
+    entry = cache.get_entry(key) if cache is not None else None
+
+    headers = {}
+    if entry is not None and data is None:
+        if entry["etag"]:
+            headers["If-None-Match"] = entry["etag"]
+        if entry["last_modified"]:
+            headers["If-Modified-Since"] = entry["last_modified"]
+
+    response = request_with_retries(session or get_session(), url, data=data, headers=headers, verbose=verbose)
+    if response.status_code == 304 and entry is not None:
+        cache.touch(key)
+        REVALIDATIONS.inc(result="not_modified")
+        return False
+
+    changed = entry is None or content_hash(response.content) != entry["content_hash"]
+    if cache is not None:
+        store_response(cache, key, response)
+    REVALIDATIONS.inc(result="changed" if changed else "unchanged")
+    if verbose and changed:
+        print("Page changed", url)
+    return changed
+
+
+def request_with_retries(session, url, data=None, headers=None, verbose=VERBOSE):
+    """
+    Sends one GET or POST under the rate limit and circuit breaker of its host, retrying transient failures.
+
+    Args:
+        session (requests.Session): The session to use.
+        url (str): The URL to fetch.
+        data (dict, optional): Form fields to POST. Defaults to None (GET).
+        headers (dict, optional): Extra request headers, e.g. conditional request validators.
+        verbose (bool, optional): Whether to print verbose output.
+
+    Returns:
+        requests.Response: The successful response.
+    """
+    import requests
+
+    policy = get_host_policy(url)
+    host = host_of(url)
+    method = "GET" if data is None else "POST"
+    for attempt in range(MAX_RETRIES + 1):
+        THROTTLE_WAIT_SECONDS.inc(policy.acquire(host), host=host)
+        if verbose:
+            print("Fetching", url, "(POST)" if data is not None else "(GET)", *([f"attempt {attempt + 1}"] if attempt else []))
+
+        start_time = time.monotonic()
+        try:
+            if data is None:
+                response = session.get(url, headers=headers, timeout=(CONNECT_TIMEOUT, READ_TIMEOUT))
+            else:
+                response = session.post(url, data=data, headers=headers, timeout=(CONNECT_TIMEOUT, READ_TIMEOUT))
+        except (requests.ConnectionError, requests.Timeout) as error:
+            record_fetch(url, host, method, "error", time.monotonic() - start_time, 0, attempt + 1)
+            policy.record_throttled()
+            if attempt == MAX_RETRIES:
+                raise
+            FETCH_RETRIES.inc(host=host, reason=type(error).__name__)
+            if verbose:
+                print("Retrying", url, "after", repr(error))
+            time.sleep(retry_delay(attempt))
+            continue
+        except requests.RequestException:
+            # Not transient, so not retried, but the circuit breaker must still hear of it
+            record_fetch(url, host, method, "error", time.monotonic() - start_time, 0, attempt + 1)
+            policy.record_failure()
+            raise
+
+        latency = time.monotonic() - start_time
+        record_fetch(url, host, method, response.status_code, latency, len(response.content), attempt + 1)
+
+        if response.status_code in RETRY_STATUSES:
+            retry_after = parse_retry_after(response.headers.get("Retry-After"))
+            policy.record_throttled(retry_after)
+            if attempt == MAX_RETRIES:
+                response.raise_for_status()
+            FETCH_RETRIES.inc(host=host, reason=response.status_code)
+            if verbose:
+                print("Retrying", url, "after status", response.status_code)
+            time.sleep(retry_delay(attempt) if retry_after is None else 0)
+            continue
+
+        # Any other answer means the server is up, even if the request itself is rejected
+        policy.record_success(latency)
+        response.raise_for_status()
+        return response
+
+
+@timed_stage("form_submit")
+def submit_common_supergroup_form(spg_1, z_1, spg_2, z_2, k_index, session=None, verbose=VERBOSE):
+    """
+    Submits the COMMONSUPER form directly, without loading it in a browser first.
+
+    This posts the same fields the form on https://www.cryst.ehu.es/cryst/commonsuper.html
+    sends to /cgi-bin/cryst/programs/paths/nph-commonsuper.
+
+    Args:
+        spg_1 (int): The spacegroup number of the first spacegroup.
+        z_1 (int): The Z number of the first spacegroup.
+        spg_2 (int): The spacegroup number of the second spacegroup.
+        z_2 (int): The Z number of the second spacegroup.
+        k_index (int): The maxik option to select.
+        session (requests.Session, optional): The session to use. Defaults to the shared session.
+        verbose (bool, optional): Whether to print verbose output.
+
+    Returns:
+        tuple: The raw result page (bytes) and its URL.
+    """
+    return fetch_page(absolute_url(COMMONSUPER_PATH), data=common_supergroup_form_data(spg_1, z_1, spg_2, z_2, k_index),
+                      session=session, verbose=verbose)
+
+
+def common_supergroup_form_data(spg_1, z_1, spg_2, z_2, k_index):
+    """
+    Returns the fields the COMMONSUPER form posts for a query (see submit_common_supergroup_form).
+
+    Returns:
+        dict: The form fields.
+    """
+    return {
+        'client': 'commonsuper',
+        'G1': str(spg_1),
+        'ZG1': str(z_1),
+        'G2': str(spg_2),
+        'ZG2': str(z_2),
+        'maxik': str(k_index),
+        'submit': 'Show supergroups',
+    }
@@ -0,0 +1,554 @@
+import argparse
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from fractions import Fraction
+from urllib.parse import parse_qsl, urlsplit
+
+from cache import normalize_url
+from fetch import absolute_url
+from memo import set_persistent_store
+
+VERBOSE=False
+
+GROUP_INDEX_PATH = os.environ.get("BILBAO_INDEX_PATH", ".bilbao_index.sqlite")
+
+# Names of the memos whose results are stored in the index (see memo.memoize_by_url)
+SUPERGROUP_INFO = "supergroup_info"
+WYCKOFF_SPLITTING_INFO = "wyckoff_splitting_info"
+
+# Default maxik option used by build_index
+DEFAULT_K_INDEX = 2
+
+SUPERGROUP_PATH = "/cgi-bin/cryst/programs/nph-show_all_super"
+
+_INDEX = None
+
+# Several relations G > H can have the same index, e.g. with different Z ratios or supergroup pages,
+# so all the columns are needed to tell them apart. The URL is '' when the table has no link.
+_RELATIONS_SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS relations ("
+    " super INTEGER NOT NULL,"
+    " sub INTEGER NOT NULL,"
+    " ind INTEGER NOT NULL,"
+    " it INTEGER NOT NULL,"
+    " ik INTEGER NOT NULL,"
+    " z_ratio TEXT NOT NULL,"
+    " url TEXT NOT NULL DEFAULT '',"
+    " PRIMARY KEY (super, sub, ind, it, ik, z_ratio, url))"
+)
+
+#################################################################################################################################
+
+
+def page_relation(url):
+    """
+    Returns the group-subgroup relation a supergroup or Wyckoff splitting page describes.
+
+    Args:
+        url (str): The URL of an nph-show_all_super or nph-allwpsplit page.
+
+    Returns:
+        tuple: (super, sub, ind) for a supergroup page, or (super, sub, trmat) for a Wyckoff
+               splitting page. Missing values are None.
+    """
+    parameters = dict(parse_qsl(urlsplit(url).query, keep_blank_values=True))
+
+    def number(name):
+        value = parameters.get(name, "")
+        return int(value) if value.isdigit() else None
+
+    if "trmat" in parameters:
+        return number("super"), number("sub"), parameters["trmat"]
+    return number("super"), number("sub"), number("ind")
+
+
+def _migrate_relations(connection):
+    """
+    Upgrades a relations table keyed by (super, sub, ind) only, in which relations with the same
+    index overwrote each other. The relations kept are copied over, and the groups are marked as
+    not crawled so build_index records the lost ones again.
+    """
+    rows = connection.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'relations'").fetchall()
+    if not rows or "PRIMARY KEY (super, sub, ind)" not in rows[0][0]:
+        return
+    connection.execute("BEGIN IMMEDIATE")
+    connection.execute("ALTER TABLE relations RENAME TO relations_old")
+    connection.execute(_RELATIONS_SCHEMA)
+    connection.execute("INSERT OR IGNORE INTO relations SELECT super, sub, ind, it, ik, z_ratio, COALESCE(url, '') FROM relations_old")
+    connection.execute("DROP TABLE relations_old")
+    if connection.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'crawled_groups'").fetchall():
+        connection.execute("DELETE FROM crawled_groups")
+    connection.commit()
+
+
+def parse_fraction(text):
+    """
+    Parses a value of the common supergroups table such as "2" or "1/4".
+
+    Returns:
+        Fraction or None: The value, or None if the text is not a number.
+    """
+    try:
+        return Fraction(str(text).strip())
+    except (ValueError, ZeroDivisionError):
+        return None
+
+
+class GroupIndex:
+    """
+    Local store of the group-subgroup graph of the Bilbao Crystallographic Server, in a SQLite database.
+
+    Three kinds of records are kept:
+        - the relations G > H read from the common supergroups tables: the index i = it * ik
+          of H in G and the ratio between the Z of G and the Z of H, indexed by (super, sub, ind).
+          Several relations can share an index, they are told apart by it, ik, the ratio and the URL;
+        - the parsed supergroup pages (nph-show_all_super), indexed by (super, sub, ind);
+        - the parsed Wyckoff splitting pages (nph-allwpsplit), indexed by (super, sub, trmat).
+
+    The Wyckoff splitting info of a supergroup page is stored once, with its own page, and
+    joined back when the supergroup page is loaded.
+
+    Set as a persistent store of the memos (see set_group_index), the index answers
+    get_supergroup_info and get_wyckoff_splitting_info locally, so only pages it has not
+    seen are fetched; the pages fetched are added to it. build_index fills it ahead of time.
+
+    Args:
+        path (str, optional): The path of the SQLite database. Defaults to GROUP_INDEX_PATH.
+    """
+
+    def __init__(self, path=GROUP_INDEX_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection = None
+        self._pid = None
+
+    def _connect(self):
+        # Connections cannot be shared with forked worker processes, so reopen after a fork
+        if self._connection is None or self._pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=60, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS groups ("
+                " number INTEGER PRIMARY KEY,"
+                " hm_symbol TEXT,"
+                " point_group TEXT)"
+            )
+            _migrate_relations(connection)
+            connection.execute(_RELATIONS_SCHEMA)
+            connection.execute("CREATE INDEX IF NOT EXISTS relations_sub ON relations (sub, ik)")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS crawled_groups ("
+                " sub INTEGER PRIMARY KEY,"
+                " k_index INTEGER NOT NULL,"
+                " updated_at REAL NOT NULL)"
+            )
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS supergroup_pages ("
+                " url_key TEXT PRIMARY KEY,"
+                " super INTEGER,"
+                " sub INTEGER,"
+                " ind INTEGER,"
+                " rows BLOB NOT NULL,"
+                " updated_at REAL NOT NULL)"
+            )
+            connection.execute("CREATE INDEX IF NOT EXISTS supergroup_pages_relation ON supergroup_pages (super, sub, ind)")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS wyckoff_pages ("
+                " url_key TEXT PRIMARY KEY,"
+                " super INTEGER,"
+                " sub INTEGER,"
+                " trmat TEXT,"
+                " rows BLOB NOT NULL,"
+                " updated_at REAL NOT NULL)"
+            )
+            connection.execute("CREATE INDEX IF NOT EXISTS wyckoff_pages_relation ON wyckoff_pages (super, sub, trmat)")
+            connection.commit()
+            self._connection = connection
+            self._pid = os.getpid()
+        return self._connection
+
+    def __getstate__(self):
+        # Only the path is sent to worker processes, each of them opens its own connection
+        return {"path": self.path}
+
+    def __setstate__(self, state):
+        self.__init__(state["path"])
+
+    def _execute(self, query, parameters=()):
+        with self._lock:
+            connection = self._connect()
+            rows = connection.execute(query, parameters).fetchall()
+            connection.commit()
+        return rows
+
+    def load(self, name, key):
+        """
+        Returns the parsed result of a supergroup or Wyckoff splitting page.
+
+        Args:
+            name (str): The name of the memo the result belongs to. Only "supergroup_info" and
+                "wyckoff_splitting_info" are stored.
+            key (str): The normalized URL of the page.
+
+        Returns:
+            list or None: The parsed result, or None if the page, or one of the Wyckoff
+                          splitting pages it links to, is not in the index.
+        """
+        if name == WYCKOFF_SPLITTING_INFO:
+            rows = self._execute("SELECT rows FROM wyckoff_pages WHERE url_key = ?", (key,))
+            return pickle.loads(rows[0][0]) if rows else None
+        if name != SUPERGROUP_INFO:
+            return None
+
+        rows = self._execute("SELECT rows FROM supergroup_pages WHERE url_key = ?", (key,))
+        if not rows:
+            return None
+        results = pickle.loads(rows[0][0])
+        for row_dict in results:
+            if row_dict["Wyckoff splitting url"]:
+                wyckoff_splitting_info = self.load(WYCKOFF_SPLITTING_INFO, normalize_url(row_dict["Wyckoff splitting url"]))
+                if wyckoff_splitting_info is None:
+                    return None
+                row_dict["Wyckoff splitting info"] = wyckoff_splitting_info
+        return results
+
+    def save(self, name, key, value):
+        """
+        Adds the parsed result of a supergroup or Wyckoff splitting page to the index.
+
+        Args:
+            name (str): The name of the memo the result belongs to. Results of other memos are ignored.
+            key (str): The normalized URL of the page.
+            value (list): The parsed result.
+        """
+        if name == WYCKOFF_SPLITTING_INFO:
+            table = "wyckoff_pages (url_key, super, sub, trmat, rows, updated_at)"
+        elif name == SUPERGROUP_INFO:
+            table = "supergroup_pages (url_key, super, sub, ind, rows, updated_at)"
+            # The Wyckoff splitting info is stored with its own page
+            value = [dict(row_dict, **{"Wyckoff splitting info": None}) for row_dict in value]
+        else:
+            return
+        self._execute(
+            f"INSERT OR REPLACE INTO {table} VALUES (?, ?, ?, ?, ?, ?)",
+            (key, *page_relation(key), sqlite3.Binary(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)), time.time()),
+        )
+
+    def stored_keys(self, name):
+        """
+        Returns the normalized URL of every page stored for a memo.
+
+        Args:
+            name (str): "supergroup_info" or "wyckoff_splitting_info".
+
+        Returns:
+            list: The normalized URLs.
+        """
+        table = {SUPERGROUP_INFO: "supergroup_pages", WYCKOFF_SPLITTING_INFO: "wyckoff_pages"}.get(name)
+        return [row[0] for row in self._execute(f"SELECT url_key FROM {table}")] if table else []
+
+    def supergroup_info(self, super_number, sub_number, index):
+        """
+        Returns the parsed supergroup page of a relation.
+
+        Args:
+            super_number (int): The space group number of the supergroup.
+            sub_number (int): The space group number of the subgroup.
+            index (int): The index of the subgroup in the supergroup.
+
+        Returns:
+            list or None: The result of get_supergroup_info for the page, or None if it is not in the index.
+        """
+        rows = self._execute("SELECT url_key FROM supergroup_pages WHERE super = ? AND sub = ? AND ind = ?",
+                             (super_number, sub_number, index))
+        return self.load(SUPERGROUP_INFO, rows[0][0]) if rows else None
+
+    def record_supergroup_table(self, spg_1, z_1, spg_2, z_2, rows):
+        """
+        Adds the relations G > H1 and G > H2 of every row of a common supergroups table to the index.
+
+        Args:
+            spg_1 (int): The spacegroup number of the first spacegroup.
+            z_1 (int): The Z number of the first spacegroup.
+            spg_2 (int): The spacegroup number of the second spacegroup.
+            z_2 (int): The Z number of the second spacegroup.
+            rows (list): The rows of the table, as returned by parse_supergroup_table.
+        """
+        groups = []
+        relations = []
+        for row in rows:
+            z_g = parse_fraction(row.get('ZG'))
+            if not str(row.get('ITA', '')).strip().isdigit() or z_g is None:
+                continue
+            super_number = int(row['ITA'])
+            groups.append((super_number, row.get('HM Symbol'), row.get('PG')))
+            for sub_number, z, suffix in ((spg_1, z_1, '1'), (spg_2, z_2, '2')):
+                values = [row.get(f'{name}{suffix}', '') for name in ('i', 'it', 'ik')]
+                if not all(str(value).strip().isdigit() for value in values) or not parse_fraction(z):
+                    continue
+                z_ratio = z_g / parse_fraction(z)
+                relations.append((super_number, int(sub_number), *(int(value) for value in values), str(z_ratio),
+                                  row.get(f'G > H{suffix}') or ''))
+
+        with self._lock:
+            connection = self._connect()
+            connection.executemany("INSERT OR REPLACE INTO groups (number, hm_symbol, point_group) VALUES (?, ?, ?)", groups)
+            connection.executemany(
+                "INSERT OR REPLACE INTO relations (super, sub, ind, it, ik, z_ratio, url) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                relations)
+            connection.commit()
+
+    def supergroups_of(self, sub_number, max_ik=None):
+        """
+        Returns the recorded relations G > H of a subgroup H.
+
+        Args:
+            sub_number (int): The space group number of H.
+            max_ik (int, optional): Only return the relations with ik at most max_ik.
+
+        Returns:
+            list: A dictionary per relation with the keys "super", "ind", "it", "ik",
+                  "z_ratio" (Z of G over Z of H, a Fraction) and "url" (the supergroup page).
+        """
+        query = "SELECT super, ind, it, ik, z_ratio, url FROM relations WHERE sub = ?"
+        parameters = (sub_number,)
+        if max_ik is not None:
+            query += " AND ik <= ?"
+            parameters += (max_ik,)
+        return [{"super": super_number, "ind": index, "it": it, "ik": ik, "z_ratio": Fraction(z_ratio), "url": url or None}
+                for super_number, index, it, ik, z_ratio, url in self._execute(query + " ORDER BY super, ind, it, ik, z_ratio, url",
+                                                                                parameters)]
+
+    def group(self, number):
+        """
+        Returns the Hermann-Mauguin symbol and point group of a space group, if recorded.
+
+        Returns:
+            dict or None: With the keys "HM Symbol" and "PG".
+        """
+        rows = self._execute("SELECT hm_symbol, point_group FROM groups WHERE number = ?", (number,))
+        return {"HM Symbol": rows[0][0], "PG": rows[0][1]} if rows else None
+
+    def mark_crawled(self, sub_number, k_index):
+        """
+        Records that the supergroups of a space group were crawled with a maxik option.
+        The largest option crawled is kept.
+        """
+        self._execute(
+            "INSERT INTO crawled_groups (sub, k_index, updated_at) VALUES (?, ?, ?)"
+            " ON CONFLICT (sub) DO UPDATE SET k_index = MAX(k_index, excluded.k_index), updated_at = excluded.updated_at",
+            (sub_number, k_index, time.time()))
+
+    def crawled_k_index(self, sub_number):
+        """
+        Returns the largest maxik option the supergroups of a space group were crawled with, or None.
+        """
+        rows = self._execute("SELECT k_index FROM crawled_groups WHERE sub = ?", (sub_number,))
+        return rows[0][0] if rows else None
+
+    def stats(self):
+        """
+        Returns the number of records of each kind.
+
+        Returns:
+            dict: With the keys "groups", "relations", "crawled_groups", "supergroup_pages" and "wyckoff_pages".
+        """
+        return {table: self._execute(f"SELECT COUNT(*) FROM {table}")[0][0]
+                for table in ("groups", "relations", "crawled_groups", "supergroup_pages", "wyckoff_pages")}
+
+
+def set_group_index(index):
+    """
+    Sets the group index consulted by get_supergroup_info and get_wyckoff_splitting_info,
+    and filled with every common supergroups table and page scraped.
+
+    Args:
+        index (GroupIndex): The index, or None to stop using it.
+    """
+    global _INDEX
+    _INDEX = index
+    set_persistent_store(index, role="index")
+
+
+def get_group_index():
+    """
+    Returns the group index set with set_group_index, or None.
+    """
+    return _INDEX
+
+
+def record_supergroup_table(spg_1, z_1, spg_2, z_2, rows):
+    """
+    Adds the relations of a common supergroups table to the group index, if one is set.
+
+    See GroupIndex.record_supergroup_table for the arguments.
+    """
+    if _INDEX is not None:
+        _INDEX.record_supergroup_table(spg_1, z_1, spg_2, z_2, rows)
+
+
+def solve_common_supergroups(spg_1, z_1, spg_2, z_2, k_index, index=None):
+    """
+    Computes the common supergroups table of two space groups from the group index, without
+    contacting the server.
+
+    The supergroups G of H1 and of H2 with an ik of at most k_index are intersected; a
+    pair of relations G > H1 and G > H2 is kept when both give G the same Z, which is
+    reported in the ZG column. The rows are ordered like the tables of the server, by
+    decreasing space group number of G.
+
+    Both groups must have been crawled into the index with build_index with a maxik option
+    of at least k_index, so that their sets of supergroups are complete.
+
+    Parameters:
+    spg_1 (int): The spacegroup number of the first spacegroup.
+    z_1 (int): The Z number of the first spacegroup.
+    spg_2 (int): The spacegroup number of the second spacegroup.
+    z_2 (int): The Z number of the second spacegroup.
+    k_index (int): The largest ik of the relations G > H1 and G > H2.
+    index (GroupIndex, optional): The index to query. Defaults to the one set with set_group_index.
+
+    Returns:
+    list: A list of dictionaries with the same keys as parse_supergroup_table.
+
+    Raises:
+    LookupError: If no index is set, or one of the groups was not crawled into it.
+    """
+    index = index or _INDEX
+    if index is None:
+        raise LookupError("No group index is set, see group_index.set_group_index")
+    for group in (spg_1, spg_2):
+        if (index.crawled_k_index(int(group)) or 0) < k_index:
+            raise LookupError(f"The supergroups of {group} are not indexed up to k={k_index}, "
+                              f"run: python group_index.py build --groups {group} --k-index {k_index}")
+
+    z_1, z_2 = parse_fraction(z_1), parse_fraction(z_2)
+    ancestors_2 = {}
+    for relation in index.supergroups_of(int(spg_2), max_ik=k_index):
+        ancestors_2.setdefault(relation["super"], []).append(relation)
+
+    matches = []
+    for relation_1 in index.supergroups_of(int(spg_1), max_ik=k_index):
+        for relation_2 in ancestors_2.get(relation_1["super"], ()):
+            z_g = z_1 * relation_1["z_ratio"]
+            if z_g == z_2 * relation_2["z_ratio"]:
+                matches.append((relation_1, relation_2, z_g))
+    matches.sort(key=lambda match: (-match[0]["super"], match[0]["ind"], match[1]["ind"]))
+
+    all_rows_data = []
+    for n, (relation_1, relation_2, z_g) in enumerate(matches, start=1):
+        group = index.group(relation_1["super"]) or {"HM Symbol": "", "PG": ""}
+        row_data = {'N': str(n), 'HM Symbol': group["HM Symbol"], 'PG': group["PG"], 'ZG': str(z_g),
+                    'ITA': str(relation_1["super"])}
+        for suffix, relation in (('1', relation_1), ('2', relation_2)):
+            row_data[f'i{suffix}'] = str(relation["ind"])
+            row_data[f'it{suffix}'] = str(relation["it"])
+            row_data[f'ik{suffix}'] = str(relation["ik"])
+        for suffix, sub_number, relation in (('1', spg_1, relation_1), ('2', spg_2, relation_2)):
+            row_data[f'G > H{suffix}'] = relation["url"] or absolute_url(
+                f"{SUPERGROUP_PATH}?super={relation['super']}&sub={sub_number}&ind={relation['ind']}&super_nor=en&subgr_nor=en")
+        all_rows_data.append(row_data)
+    return all_rows_data
+
+
+def build_index(groups, k_index=DEFAULT_K_INDEX, z=1, index=None, max_concurrency_per_host=None, verbose=VERBOSE):
+    """
+    Fills the group index with every supergroup of the given space groups, and their pages.
+
+    The supergroups of H are the rows of the common supergroups table of H with itself.
+    Each of these tables is crawled with async_crawler, every page going through the
+    response cache, so running the build again only fetches what is missing. Groups
+    already crawled with this maxik option or a larger one are skipped.
+
+    Args:
+        groups (iterable): The space group numbers.
+        k_index (int, optional): The maxik option of the queries. Defaults to DEFAULT_K_INDEX.
+        z (int, optional): The Z number of the queries. Defaults to 1.
+        index (GroupIndex, optional): The index to fill. Defaults to the one set with set_group_index.
+        max_concurrency_per_host (int, optional): The maximum number of requests in flight.
+        verbose (bool, optional): Whether to print verbose output.
+
+    Returns:
+        dict: The exception raised for every group that failed, keyed by group number.
+    """
+    import asyncio
+
+    from async_crawler import MAX_CONCURRENCY_PER_HOST, AsyncCrawler
+
+    index = index or _INDEX or GroupIndex()
+    previous = _INDEX
+    set_group_index(index)
+
+    groups = [group for group in dict.fromkeys(int(group) for group in groups)
+              if (index.crawled_k_index(group) or 0) < k_index]
+    if verbose:
+        print("Crawling the supergroups of", len(groups), "space groups")
+    errors = {}
+
+    async def crawl_all():
+        async with AsyncCrawler(max_concurrency_per_host=max_concurrency_per_host or MAX_CONCURRENCY_PER_HOST,
+                                verbose=verbose) as crawler:
+            async def crawl_one(group):
+                try:
+                    # The crawler records the table in the index
+                    await crawler.crawl(group, z, group, z, k_index)
+                    index.mark_crawled(group, k_index)
+                    if verbose:
+                        print("Indexed the supergroups of", group)
+                except Exception as error:
+                    errors[group] = error
+
+            await asyncio.gather(*(crawl_one(group) for group in groups))
+
+    try:
+        asyncio.run(crawl_all())
+    finally:
+        set_group_index(previous)
+    return errors
+
+
+def parse_groups(text):
+    """
+    Parses a list of space group numbers such as "1-230" or "213,214,220-230".
+
+    Returns:
+        list: The space group numbers.
+    """
+    groups = []
+    for part in text.split(","):
+        first, _, last = part.strip().partition("-")
+        groups.extend(range(int(first), int(last or first) + 1))
+    return groups
+
+
+def main():
+    """
+    Command line entry point: builds the group index or prints what it holds.
+    """
+    parser = argparse.ArgumentParser(description="Build a local index of the group-subgroup graph of the Bilbao Crystallographic Server.")
+    parser.add_argument("command", choices=("build", "stats"), help="Crawl the supergroups of the groups into the index, or count its records")
+    parser.add_argument("--groups", default="1-230", help="Space groups to crawl, e.g. 1-230 or 213,214 (default: all)")
+    parser.add_argument("--k-index", type=int, default=DEFAULT_K_INDEX, help="The maxik option of the queries")
+    parser.add_argument("--z", type=int, default=1, help="The Z number of the queries")
+    parser.add_argument("--index", default=GROUP_INDEX_PATH, help="Path of the SQLite index")
+    parser.add_argument("--workers", type=int, help="Number of requests in flight")
+    parser.add_argument("--verbose", action="store_true", help="Print verbose output")
+    args = parser.parse_args()
+
+    index = GroupIndex(args.index)
+    if args.command == "build":
+        start_time = time.time()
+        errors = build_index(parse_groups(args.groups), k_index=args.k_index, z=args.z, index=index,
+                             max_concurrency_per_host=args.workers, verbose=args.verbose)
+        for group, error in sorted(errors.items()):
+            print(group, "failed:", repr(error))
+        print("Execution time:", time.time() - start_time, "seconds,", len(errors), "failed groups")
+    print(index.stats())
+
+
+if __name__ == "__main__":
+
+    main()
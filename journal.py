@@ -0,0 +1,240 @@
+import os
+import pickle
+import sqlite3
+import threading
+import time
+
+VERBOSE=False
+
+JOURNAL_PATH = "batch_journal.sqlite"
+
+#################################################################################################################################
+
+
+def pair_key(pair):
+    """
+    Returns the key a query is recorded under in the journal.
+
+    Args:
+        pair (tuple): The (spg_1, z_1, spg_2, z_2, k_index) query.
+
+    Returns:
+        str: The values of the query joined by commas.
+    """
+    return ",".join(str(int(value)) for value in pair)
+
+
+def parse_pair_key(key):
+    """
+    Returns the query recorded under a pair_key.
+
+    Args:
+        key (str): The values of the query joined by commas.
+
+    Returns:
+        tuple: The (spg_1, z_1, spg_2, z_2, k_index) query.
+    """
+    return tuple(int(value) for value in key.split(","))
+
+
+class Journal:
+    """
+    Records the progress of a batch run in a SQLite database so an interrupted run can be resumed.
+
+    Two kinds of work are recorded:
+        - completed queries, with their results, or failed queries with the error message;
+        - completed sub-pages (supergroup and Wyckoff splitting pages), with their parsed results,
+          so a restarted run neither fetches nor parses them again.
+
+    Every record is committed as soon as it is made. The database is opened in WAL mode so
+    the worker processes of a batch can write to it concurrently.
+
+    Args:
+        path (str, optional): The path of the SQLite database. Defaults to JOURNAL_PATH.
+    """
+
+    def __init__(self, path=JOURNAL_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection = None
+        self._pid = None
+
+    def _connect(self):
+        # Connections cannot be shared with forked worker processes, so reopen after a fork
+        if self._connection is None or self._pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=60, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS pairs ("
+                " pair_key TEXT PRIMARY KEY,"
+                " status TEXT NOT NULL,"
+                " result BLOB,"
+                " error TEXT,"
+                " updated_at REAL NOT NULL)"
+            )
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS urls ("
+                " name TEXT NOT NULL,"
+                " url_key TEXT NOT NULL,"
+                " result BLOB NOT NULL,"
+                " updated_at REAL NOT NULL,"
+                " PRIMARY KEY (name, url_key))"
+            )
+            connection.commit()
+            self._connection = connection
+            self._pid = os.getpid()
+        return self._connection
+
+    def __getstate__(self):
+        # Only the path is sent to worker processes, each of them opens its own connection
+        return {"path": self.path}
+
+    def __setstate__(self, state):
+        self.__init__(state["path"])
+
+    def _execute(self, query, parameters=()):
+        with self._lock:
+            connection = self._connect()
+            rows = connection.execute(query, parameters).fetchall()
+            connection.commit()
+        return rows
+
+    def record_pair(self, pair, result):
+        """
+        Marks a query as completed and stores its result.
+
+        Args:
+            pair (tuple): The (spg_1, z_1, spg_2, z_2, k_index) query.
+            result (list): The common supergroups of the query.
+        """
+        self._execute(
+            "INSERT OR REPLACE INTO pairs (pair_key, status, result, error, updated_at) VALUES (?, 'done', ?, NULL, ?)",
+            (pair_key(pair), sqlite3.Binary(pickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL)), time.time()),
+        )
+
+    def record_failure(self, pair, error):
+        """
+        Marks a query as failed. Failed queries are run again when the batch is resumed.
+
+        Args:
+            pair (tuple): The (spg_1, z_1, spg_2, z_2, k_index) query.
+            error (Exception): The exception raised by the query.
+        """
+        self._execute(
+            "INSERT OR REPLACE INTO pairs (pair_key, status, result, error, updated_at) VALUES (?, 'failed', NULL, ?, ?)",
+            (pair_key(pair), repr(error), time.time()),
+        )
+
+    def completed_pairs(self):
+        """
+        Returns the keys of every completed query.
+
+        Returns:
+            set: The pair_key of each completed query.
+        """
+        return {row[0] for row in self._execute("SELECT pair_key FROM pairs WHERE status = 'done'")}
+
+    def is_pair_done(self, pair):
+        """
+        Returns whether a query has already been completed.
+
+        Args:
+            pair (tuple): The (spg_1, z_1, spg_2, z_2, k_index) query.
+
+        Returns:
+            bool: True if the query is recorded as completed.
+        """
+        return bool(self._execute("SELECT 1 FROM pairs WHERE pair_key = ? AND status = 'done'", (pair_key(pair),)))
+
+    def get_pair_result(self, pair):
+        """
+        Returns the stored result of a completed query.
+
+        Args:
+            pair (tuple): The (spg_1, z_1, spg_2, z_2, k_index) query.
+
+        Returns:
+            list or None: The common supergroups of the query, or None if it is not completed.
+        """
+        rows = self._execute("SELECT result FROM pairs WHERE pair_key = ? AND status = 'done'", (pair_key(pair),))
+        return pickle.loads(rows[0][0]) if rows else None
+
+    def completed_results(self):
+        """
+        Yields every completed query with its stored result, reading and unpickling one row at
+        a time so the results of a large batch are never all in memory.
+
+        The rows are read through a connection of their own, which sees the journal as it was
+        when the iteration started, so the journal can be written to meanwhile.
+
+        Yields:
+            tuple: The (pair, result) of each completed query.
+        """
+        with self._lock:
+            # Creates the tables of a new journal
+            self._connect()
+        connection = sqlite3.connect(self.path, timeout=60)
+        try:
+            for key, result in connection.execute("SELECT pair_key, result FROM pairs WHERE status = 'done'"):
+                yield parse_pair_key(key), pickle.loads(result)
+        finally:
+            connection.close()
+
+    def mark_stale(self, pair):
+        """
+        Marks a completed query as stale, because a page its result depends on changed.
+        Stale queries are run again when the batch is resumed.
+
+        Args:
+            pair (tuple): The (spg_1, z_1, spg_2, z_2, k_index) query.
+        """
+        self._execute("UPDATE pairs SET status = 'stale', updated_at = ? WHERE pair_key = ?", (time.time(), pair_key(pair)))
+
+    def failed_pairs(self):
+        """
+        Returns the error message of every failed query.
+
+        Returns:
+            dict: The error messages keyed by pair_key.
+        """
+        return dict(self._execute("SELECT pair_key, error FROM pairs WHERE status = 'failed'"))
+
+    def load(self, name, key):
+        """
+        Returns the stored parsed result of a sub-page.
+
+        Args:
+            name (str): The name of the memo the result belongs to (e.g. "supergroup_info").
+            key (str): The normalized URL of the page.
+
+        Returns:
+            The parsed result, or None if the page is not recorded.
+        """
+        rows = self._execute("SELECT result FROM urls WHERE name = ? AND url_key = ?", (name, key))
+        return pickle.loads(rows[0][0]) if rows else None
+
+    def save(self, name, key, value):
+        """
+        Records the parsed result of a sub-page.
+
+        Args:
+            name (str): The name of the memo the result belongs to (e.g. "supergroup_info").
+            key (str): The normalized URL of the page.
+            value: The parsed result.
+        """
+        self._execute(
+            "INSERT OR REPLACE INTO urls (name, url_key, result, updated_at) VALUES (?, ?, ?, ?)",
+            (name, key, sqlite3.Binary(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)), time.time()),
+        )
+
+    def stored_keys(self, name):
+        """
+        Returns the normalized URL of every sub-page recorded for a memo.
+
+        Args:
+            name (str): The name of the memo (e.g. "supergroup_info").
+
+        Returns:
+            list: The normalized URLs.
+        """
+        return [row[0] for row in self._execute("SELECT url_key FROM urls WHERE name = ?", (name,))]
@@ -0,0 +1,323 @@
+import glob
+import os
+import sys
+
+import lxml.html
+import numpy as np
+
+from fetch import absolute_url
+from new_scrape_method import (collect_form_fields, form_request, parse_supergroup_info_bs4, parse_supergroup_table_bs4,
+                               parse_wyckoff_position_splitting_info_bs4, parse_wyckoff_splitting_info_bs4,
+                               set_transformation_matrices, split_coset_representatives)
+
+VERBOSE=False
+
+# Directories of the saved pages, next to this file so the check runs from any directory
+FIXTURE_DIRECTORIES = tuple(os.path.join(os.path.dirname(os.path.abspath(__file__)), directory)
+                            for directory in ("data", "example_data"))
+
+#################################################################################################################################
+# lxml implementations of the parse_* functions in new_scrape_method. They walk the tree with
+# XPath instead of BeautifulSoup's select/find_all and must return exactly the same results.
+
+
+def _parse(html):
+    return lxml.html.fromstring(html)
+
+
+def _text(element):
+    return element.text_content()
+
+
+def get_table_rows(table):
+    """
+    Returns the rows directly under a table, looking through its tbody if the page has one.
+
+    Args:
+        table: The lxml table element.
+
+    Returns:
+        list: The tr elements of the table.
+    """
+    tbody = table.xpath("./tbody")
+    if tbody:
+        table = tbody[0]
+    return table.xpath("./tr")
+
+
+def get_form_request(form, base_url=None):
+    """
+    lxml version of new_scrape_method.get_form_request.
+
+    Args:
+        form: The lxml form element.
+        base_url (str, optional): The URL of the page holding the form.
+
+    Returns:
+        tuple: The URL and form data, see new_scrape_method.form_request.
+    """
+    controls = []
+    for element in form.xpath(".//input|.//select|.//textarea"):
+        input_type = element.get('type', 'text').lower()
+        if element.tag == 'select':
+            options = element.xpath(".//option[@selected]") or element.xpath(".//option")
+            value = None
+            if options:
+                value = options[0].get('value')
+                if value is None:
+                    value = _text(options[0]).strip()
+        elif element.tag == 'textarea':
+            value = _text(element)
+        else:
+            value = element.get('value', 'on' if input_type in ('checkbox', 'radio') else '')
+        controls.append((element.tag, element.get('name'), input_type, value, element.get('checked') is not None))
+    return form_request(form.get('action'), form.get('method'), collect_form_fields(controls), base_url)
+
+
+def parse_supergroup_table(html, base_url=None, verbose=VERBOSE):
+    """
+    lxml version of new_scrape_method.parse_supergroup_table_bs4.
+
+    Args:
+        html (str or bytes): The content of the result page.
+        base_url (str, optional): The URL of the result page, used to resolve the 'G > H1' and 'G > H2' links.
+
+    Returns:
+        A list of dictionaries, where each dictionary represents a row in the table.
+    """
+    tables = _parse(html).xpath('//table[@border="0" and @cellpadding="3"]')
+    if not tables:
+        if verbose:
+            print("Table not found")
+        return []
+
+    all_rows_data = []
+    for row in tables[0].xpath(".//tr")[1:]:
+        cols = row.xpath(".//td")
+        if len(cols) > 12:
+            h1_links = cols[11].xpath(".//a[@href]")
+            h2_links = cols[12].xpath(".//a[@href]")
+            row_data = {
+                'N': _text(cols[0]).strip(),
+                'HM Symbol': _text(cols[1]).strip(),
+                'PG': _text(cols[2]).strip(),
+                'ZG': _text(cols[3]).strip(),
+                'ITA': _text(cols[4]).strip(),
+                'i1': _text(cols[5]).strip(),
+                'it1': _text(cols[6]).strip(),
+                'ik1': _text(cols[7]).strip(),
+                'i2': _text(cols[8]).strip(),
+                'it2': _text(cols[9]).strip(),
+                'ik2': _text(cols[10]).strip(),
+                'G > H1': absolute_url(h1_links[0].get('href'), base_url) if h1_links else '',
+                'G > H2': absolute_url(h2_links[0].get('href'), base_url) if h2_links else ''
+            }
+            all_rows_data.append(row_data)
+
+    return all_rows_data
+
+
+def parse_supergroup_info(html, webpage=None, verbose=VERBOSE):
+    """
+    lxml version of new_scrape_method.parse_supergroup_info_bs4.
+
+    Args:
+        html (str or bytes): The content of the supergroup page.
+        webpage (str, optional): The URL of the page, used to resolve the Wyckoff splitting links.
+
+    Returns:
+        list: A list of dictionaries, one per supergroup.
+    """
+    tables = _parse(html).xpath('//table[@border=""]')
+    if not tables:
+        raise ValueError(f"Supergroup table not found on {webpage}")
+
+    results = []
+    matrix_texts = []
+    for i_row, row in enumerate(get_table_rows(tables[0])[1:]):
+        if verbose:
+            print("Procesing row",i_row)
+        supergroup_number = None
+        transformation_matrix = np.zeros(shape=(3,3))
+        initial_vector = np.zeros(shape=(3))
+        coset_representatives = None
+        wyckoff_splitting_url = None
+
+        for i_col, column in enumerate(row.xpath("./td")):
+            if i_col == 0:
+                supergroup_number = _text(column).strip()
+            elif i_col == 1:
+                matrix_texts.append((i_row, _text(column)))
+            elif i_col == 2:
+                coset_representatives = split_coset_representatives(_text(column))
+            elif i_col == 3:
+                wyckoff_splitting_url = absolute_url(column.xpath(".//a")[0].get('href'), webpage)
+
+        results.append({
+            "Supergroup number": supergroup_number,
+            "Transformation matrix": transformation_matrix,
+            "Initial vector": initial_vector,
+            "Coset representatives": coset_representatives,
+            "Wyckoff splitting url": wyckoff_splitting_url,
+            "Wyckoff splitting info": None
+        })
+
+    set_transformation_matrices(results, matrix_texts)
+    return results
+
+
+def parse_wyckoff_splitting_info(html, webpage=None, verbose=VERBOSE):
+    """
+    lxml version of new_scrape_method.parse_wyckoff_splitting_info_bs4.
+
+    Args:
+        html (str or bytes): The content of the Wyckoff splitting page.
+        webpage (str, optional): The URL of the page, used to resolve the form actions.
+
+    Returns:
+        list: A list of dictionaries, one per Wyckoff position.
+    """
+    tables = _parse(html).xpath('//table[@border="5" and @width="60%"]')
+    if not tables:
+        raise ValueError(f"Wyckoff splitting table not found on {webpage}")
+
+    results = []
+    for row in get_table_rows(tables[0])[2:]:
+        wyckoff_number = None
+        wyckoff_group = None
+        wyckoff_subgroup = None
+        position_splitting_url = None
+        position_splitting_form = None
+
+        for i_col, column in enumerate(row.xpath("./td")):
+            if i_col == 0:
+                wyckoff_number = _text(column).strip()
+            elif i_col == 1:
+                wyckoff_group = _text(column).strip()
+            elif i_col == 2:
+                wyckoff_subgroup = _text(column).strip().split()
+            elif i_col == 3:
+                forms = column.xpath(".//form")
+                if forms:
+                    position_splitting_url, position_splitting_form = get_form_request(forms[0], webpage)
+
+        results.append({
+            "Wyckoff number": wyckoff_number,
+            "Wyckoff Group": wyckoff_group,
+            "Wyckoff Subgroup": wyckoff_subgroup,
+            "Wyckoff position splitting url": position_splitting_url,
+            "Wyckoff position splitting form": position_splitting_form,
+            "Wyckoff Position Splitting Info": None
+        })
+
+    return results
+
+
+def parse_wyckoff_position_splitting_info(html, webpage=None, verbose=VERBOSE):
+    """
+    lxml version of new_scrape_method.parse_wyckoff_position_splitting_info_bs4.
+
+    Args:
+        html (str or bytes): The content of the position splitting page.
+        webpage (str, optional): The URL of the page.
+
+    Returns:
+        list: A list of dictionaries, one per row of the table.
+    """
+    tables = _parse(html).xpath('//table[@border=""]')
+    if not tables:
+        raise ValueError(f"Wyckoff position splitting table not found on {webpage}")
+
+    results = []
+    subgroup_name = None
+    for i_row, row in enumerate(get_table_rows(tables[0])[2:]):
+        columns = [_text(column).strip() for column in row.xpath("./td")]
+        if len(columns) == 5:
+            subgroup_name = columns[3]
+            representative = columns[4]
+        elif len(columns) == 4:
+            representative = columns[3]
+        else:
+            if verbose:
+                print("Skipping row", i_row, "with", len(columns), "columns")
+            continue
+
+        results.append({
+            "group_basis": columns[1],
+            "subgroup_basis": columns[2],
+            "representative": representative,
+            'subgroup_name': subgroup_name,
+            'operation_number': columns[0]
+        })
+
+    return results
+
+#################################################################################################################################
+
+
+def results_equal(a, b):
+    """
+    Compares two parsed results, including the numpy arrays they contain.
+
+    Args:
+        a: The first result.
+        b: The second result.
+
+    Returns:
+        bool: True if both results are identical.
+    """
+    if isinstance(a, np.ndarray) or isinstance(b, np.ndarray):
+        return isinstance(a, np.ndarray) and isinstance(b, np.ndarray) and a.shape == b.shape and np.array_equal(a, b)
+    if isinstance(a, dict) and isinstance(b, dict):
+        return a.keys() == b.keys() and all(results_equal(a[key], b[key]) for key in a)
+    if isinstance(a, (list, tuple)) and isinstance(b, (list, tuple)):
+        return len(a) == len(b) and all(results_equal(x, y) for x, y in zip(a, b))
+    return type(a) == type(b) and a == b
+
+
+def check_parser_parity(directories=FIXTURE_DIRECTORIES, verbose=VERBOSE):
+    """
+    Runs both parser backends over every saved page in the fixture directories and compares their output.
+
+    Each page is given to every parser; a parser that fails on a page must fail with both backends.
+
+    Args:
+        directories (tuple, optional): The directories holding the saved .html pages.
+        verbose (bool, optional): Whether to print each comparison.
+
+    Returns:
+        list: The (path, parser name) combinations where the backends disagree. Empty if they all agree.
+    """
+    parsers = (
+        ("parse_supergroup_table", parse_supergroup_table_bs4, parse_supergroup_table),
+        ("parse_supergroup_info", parse_supergroup_info_bs4, parse_supergroup_info),
+        ("parse_wyckoff_splitting_info", parse_wyckoff_splitting_info_bs4, parse_wyckoff_splitting_info),
+        ("parse_wyckoff_position_splitting_info", parse_wyckoff_position_splitting_info_bs4,
+         parse_wyckoff_position_splitting_info),
+    )
+    mismatches = []
+    for directory in directories:
+        for path in sorted(glob.glob(os.path.join(directory, "*.html"))):
+            with open(path, "rb") as file:
+                html = file.read()
+            for name, bs4_parser, lxml_parser in parsers:
+                outcomes = []
+                for parser in (bs4_parser, lxml_parser):
+                    try:
+                        outcomes.append(("ok", parser(html, "https://www.cryst.ehu.es/")))
+                    except ValueError as error:
+                        outcomes.append(("error", str(error)))
+                equal = results_equal(outcomes[0], outcomes[1])
+                if verbose:
+                    print(path, name, "same" if equal else "DIFFERENT", outcomes[0][0])
+                if not equal:
+                    mismatches.append((path, name))
+    return mismatches
+
+
+if __name__ == "__main__":
+
+    mismatches = check_parser_parity(verbose=True)
+    print("-"*200)
+    print("All parsers agree" if not mismatches else f"{len(mismatches)} mismatches: {mismatches}")
+    sys.exit(1 if mismatches else 0)
@@ -1,88 +1,185 @@
 import time
 
-import numpy as np
-from selenium import webdriver
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support.ui import Select
-from selenium.webdriver.chrome.service import Service
-from selenium.common.exceptions import StaleElementReferenceException
+import new_scrape_method
+from cache import normalize_url
+from canonical import symmetric_query
+from driver_pool import get_driver_pool, load_page
+from fetch import COMMONSUPER_FORM_PATH, absolute_url, submit_common_supergroup_form
+from group_index import record_supergroup_table, solve_common_supergroups
+from memo import memoize_by_url
+from metrics import BROWSER_SECONDS, stage, time_breakdown, timed_stage, timer
 
 VERBOSE=False
 
+# Returns the text, links and forms of every cell of a table in a single WebDriver call.
+# arguments[0] is the CSS selector of the table; with arguments[1] only the rows directly under
+# the table (or its first tbody) and the cells directly under them are returned.
+_TABLE_SCRIPT = """
+const table = document.querySelector(arguments[0]);
+if (!table) {
+    return null;
+}
+const direct = arguments[1];
+const body = table.tBodies.length ? table.tBodies[0] : table;
+const rows = direct ? Array.from(body.children).filter(row => row.tagName === 'TR') : Array.from(table.querySelectorAll('tr'));
+return rows.map(row => {
+    const cells = direct ? Array.from(row.children).filter(cell => cell.tagName === 'TD') : Array.from(row.querySelectorAll('td'));
+    return cells.map(cell => ({
+        text: cell.innerText,
+        hrefs: Array.from(cell.querySelectorAll('a')).map(link => link.href),
+        forms: Array.from(cell.querySelectorAll('form')).map(form => ({
+            action: form.action,
+            method: form.method,
+            controls: Array.from(form.querySelectorAll('input, select, textarea')).map(control => [
+                control.tagName.toLowerCase(),
+                control.name,
+                control.type,
+                control.tagName === 'SELECT' ? (control.selectedOptions.length ? control.selectedOptions[0].value : null) : control.value,
+                !!control.checked
+            ])
+        }))
+    }));
+});
+"""
+
 #################################################################################################################################
 
 
-def get_supergroup_table(driver, verbose=VERBOSE):
+def get_table_cells(driver, selector, direct=True):
+    """
+    Reads a whole table of the current page in one JavaScript call, instead of one WebDriver
+    round-trip per cell.
+
+    Args:
+        driver: The Selenium WebDriver instance.
+        selector (str): The CSS selector of the table.
+        direct (bool, optional): Whether to only read the rows directly under the table (or its tbody)
+            and the cells directly under them, like the XPath "tr" and "td". Otherwise every
+            descendant row and cell is read, like find_elements(By.TAG_NAME, ...).
+
+    Returns:
+        list or None: For every row, the list of its cells, each a dictionary with the keys
+                      "text" (the rendered text), "hrefs" (the absolute URL of every link) and
+                      "forms" (the action, method and controls of every form).
+                      None if there is no such table on the page.
+    """
+    with timer(BROWSER_SECONDS, operation="execute_script"):
+        return driver.execute_script(_TABLE_SCRIPT, selector, direct)
+
+
+@timed_stage("supergroup_table")
+def get_supergroup_table(driver, verbose=VERBOSE, depth=new_scrape_method.FULL_DEPTH, branches=new_scrape_method.BRANCHES):
     """
     Extracts data from a table on a webpage 
     (https://www.cryst.ehu.es/cgi-bin/cryst/programs/paths/nph-commonsuper) 
     using a Selenium WebDriver.
 
+    The supergroup pages of the selected branches are visited down to depth, like
+    new_scrape_method.expand_common_supergroups does over HTTP. A page linked several
+    times is visited once.
+
     Args:
         driver: The Selenium WebDriver instance.
+        depth (int, optional): The deepest level to retrieve, see new_scrape_method.expand_common_supergroups.
+            Defaults to FULL_DEPTH.
+        branches (tuple, optional): The links to follow, among "H1" and "H2". Defaults to both.
 
     Returns:
         A list of dictionaries, where each dictionary represents a row in the table.
         The keys in the dictionary correspond to the column names, and the values
         represent the data in each cell of the row.
     """
-    try:
-        table = driver.find_element(By.CSS_SELECTOR, 'table[border="0"][cellpadding="3"]')
-    except:
+    rows = get_table_cells(driver, 'table[border="0"][cellpadding="3"]', direct=False)
+    if rows is None:
         if verbose:
             print("Table not found")
         return []
     # Initialize a list to store all rows' data
     all_rows_data = []
 
-    # Extract the rows, skipping the header row
-    rows = table.find_elements(By.TAG_NAME, 'tr')[1:]  # Assuming first row is the header
-
-    for row in rows:
-        cols = row.find_elements(By.TAG_NAME, 'td')
+    # Skip the header row
+    for cols in rows[1:]:  # Assuming first row is the header
         if len(cols) > 12:  # Ensure there are enough columns in the row to avoid index errors
             row_data = {
-                'N': cols[0].text,
-                'HM Symbol': cols[1].text,
-                'PG': cols[2].text,
-                'ZG': cols[3].text,
-                'ITA': cols[4].text,
-                'i1': cols[5].text,
-                'it1': cols[6].text,
-                'ik1': cols[7].text,
-                'i2': cols[8].text,
-                'it2': cols[9].text,
-                'ik2': cols[10].text,
-                'G > H1': cols[11].find_element(By.TAG_NAME, 'a').get_attribute('href') if cols[11].find_elements(By.TAG_NAME, 'a') else '',
-                'G > H2': cols[12].find_element(By.TAG_NAME, 'a').get_attribute('href') if cols[12].find_elements(By.TAG_NAME, 'a') else ''
+                'N': cols[0]["text"].strip(),
+                'HM Symbol': cols[1]["text"].strip(),
+                'PG': cols[2]["text"].strip(),
+                'ZG': cols[3]["text"].strip(),
+                'ITA': cols[4]["text"].strip(),
+                'i1': cols[5]["text"].strip(),
+                'it1': cols[6]["text"].strip(),
+                'ik1': cols[7]["text"].strip(),
+                'i2': cols[8]["text"].strip(),
+                'it2': cols[9]["text"].strip(),
+                'ik2': cols[10]["text"].strip(),
+                'G > H1': cols[11]["hrefs"][0] if cols[11]["hrefs"] else '',
+                'G > H2': cols[12]["hrefs"][0] if cols[12]["hrefs"] else ''
             }
             all_rows_data.append(row_data)
 
+    unknown = set(branches) - set(new_scrape_method.BRANCHES)
+    if unknown:
+        raise ValueError(f"Unknown branches {sorted(unknown)}, expected some of {new_scrape_method.BRANCHES}")
+    if depth < new_scrape_method.DEPTH_SUPERGROUP_INFO:
+        return all_rows_data
+
+    shared = {}
     for i,entry in enumerate(all_rows_data[:]):
         if verbose:
             print("Processing common supergroups row",i)
             print("-"*200)
 
-        if entry['G > H1']:
-            webpage=entry['G > H1']
-            entry_name='G > H1 Supergroup Info'  # Name for the entry in the dictionary
-            supergroup_info=get_supergroup_info(webpage=webpage,driver=driver)  # Get the supergroup info
-            entry[entry_name]=supergroup_info  # Add the supergroup info to the dictionary entry
+        for branch in branches:
+            webpage=entry[f'G > {branch}']
+            if webpage:
+                entry_name=f'G > {branch} Supergroup Info'  # Name for the entry in the dictionary
+                key = normalize_url(webpage)
+                if key not in shared:
+                    shared[key] = expand_supergroup_info(webpage, driver, depth=depth, verbose=verbose, shared=shared)
+                entry[entry_name]=shared[key]  # Add the supergroup info to the dictionary entry
 
-        if entry['G > H2']:
-            webpage=entry['G > H2']
-            entry_name='G > H2 Supergroup Info'  # Name for the entry in the dictionary
+    return all_rows_data
 
-            supergroup_info=get_supergroup_info(webpage=webpage,driver=driver)  # Get the supergroup info
-            entry[entry_name]=supergroup_info  # Add the supergroup info to the dictionary entry
-            
 
-    return all_rows_data
+def expand_supergroup_info(webpage, driver, depth=new_scrape_method.FULL_DEPTH, verbose=VERBOSE, shared=None):
+    """
+    Retrieves a supergroup page in the browser with its children down to a given depth,
+    see new_scrape_method.expand_supergroup_info.
+
+    Args:
+        webpage (str): The URL of the supergroup page.
+        driver: The webdriver object to use for scraping.
+        depth (int, optional): The deepest level to retrieve. Defaults to FULL_DEPTH.
+        verbose (bool, optional): Whether to print verbose output.
+        shared (dict, optional): The pages already retrieved in the same tree, keyed by normalized URL.
+
+    Returns:
+        list: A list of dictionaries with the same keys as get_supergroup_info. The
+              "Wyckoff splitting info" of rows below depth is None.
+    """
+    if depth >= new_scrape_method.FULL_DEPTH or normalize_url(webpage) in get_supergroup_info.memo:
+        return get_supergroup_info(webpage, driver, verbose=verbose)
+
+    shared = {} if shared is None else shared
+    results = read_supergroup_info(webpage, driver, verbose=verbose)
+    if depth >= new_scrape_method.DEPTH_WYCKOFF_SPLITTING_INFO:
+        for row_dict in results:
+            url = row_dict["Wyckoff splitting url"]
+            if url:
+                key = normalize_url(url)
+                if key not in shared:
+                    # The position splitting is below depth, so the forms are not submitted
+                    shared[key] = (get_wyckoff_splitting_info(url, driver, verbose=verbose)
+                                   if key in get_wyckoff_splitting_info.memo else read_wyckoff_splitting_info(url, driver, verbose=verbose))
+                row_dict["Wyckoff splitting info"] = shared[key]
+    return results
         
 
 #################################################################################################################################
 
 
+@memoize_by_url("selenium_supergroup_info")
+@timed_stage("supergroup_info")
 def get_supergroup_info(webpage,driver, verbose=VERBOSE):
     """
     Retrieves information about supergroups from a this type of webpage:
@@ -98,118 +195,97 @@ def get_supergroup_info(webpage,driver, verbose=VERBOSE):
             - "Transformation matrix": The transformation matrix associated with the supergroup.
             - "Initial vector": The initial vector associated with the supergroup.
             - "Coset representatives": The coset representatives associated with the supergroup.
+            - "Wyckoff splitting url": The URL of the Wyckoff splitting page of the supergroup.
             - "Wyckoff splitting info": The Wyckoff splitting information associated with the supergroup.
     """
+    results = read_supergroup_info(webpage, driver, verbose=verbose)
 
-    # Load the webpage (assuming local HTML or reachable URL)
-    driver.get(webpage)
-    
-    nested_table = get_nested_table(driver)
-  
-    results = []
-    if nested_table:
-
-        rows=nested_table.find_elements(By.XPATH, "tr")[1:]
-        # Iterate through each row in the nested table, skipping the header row
-        for i_row, row in enumerate(rows): # This find the rows directly under table/tbody
-            
-            try:
-                if verbose:
-                    print("Procesing row",i_row)
-                    print(row.text)
-                    print(type(row))
-                row_dict = process_supergroup_row(row,driver, verbose)
-            except StaleElementReferenceException:
-                # Handle the case where the row has gone stale, refind the table and rows
-                driver.get(webpage)
-                nested_table = get_nested_table(driver)
-                rows = nested_table.find_elements(By.XPATH, "tr")[1:]
-                row = rows[i_row]  # Re-find the specific row that went stale
-                row_dict = process_supergroup_row(row,driver, verbose)
-
-
-            # Append the dictionary to the results list
-            results.append(row_dict)
+    for row_dict in results:
+        if row_dict["Wyckoff splitting url"]:
+            # Retrieve the wyckoff splitting information using the provided function
+            row_dict["Wyckoff splitting info"] = get_wyckoff_splitting_info(webpage=row_dict["Wyckoff splitting url"], driver=driver)
 
     return results
 
-def get_nested_table(driver, verbose=VERBOSE):
+
+def read_supergroup_info(webpage, driver, verbose=VERBOSE):
     """
-    Retrieves the nested table from the current page.
+    Reads the table of a supergroup page in the browser, without visiting its Wyckoff
+    splitting pages ("Wyckoff splitting info" is left as None).
 
     Args:
+        webpage (str): The URL or local path of the webpage to scrape.
         driver: The webdriver object to use for scraping.
 
     Returns:
-        WebElement: The nested table element.
+        list: A list of dictionaries with the same keys as get_supergroup_info.
     """
-    return driver.find_element(By.CSS_SELECTOR, 'table[border=""]').find_element(By.XPATH, "tbody")
 
-def process_supergroup_row(row, driver, verbose=False):
+    # Load the webpage (assuming local HTML or reachable URL)
+    load_page(driver, webpage, verbose=verbose)
+
+    # Read the whole table at once, the Wyckoff splitting pages are visited afterwards
+    rows = get_table_cells(driver, 'table[border=""]')
+    if rows is None:
+        raise ValueError(f"Supergroup table not found on {webpage}")
+
+    results = []
+    # Iterate through each row in the nested table, skipping the header row
+    for i_row, row in enumerate(rows[1:]):
+        if verbose:
+            print("Procesing row",i_row)
+        results.append(process_supergroup_row(row, verbose))
+
+    return results
+
+
+def process_supergroup_row(row, verbose=False):
     """
     Process a row of data from a table and extract relevant information.
 
+    The Wyckoff splitting page is not visited; its URL is returned under
+    "Wyckoff splitting url" and "Wyckoff splitting info" is left as None.
+
     Args:
-        row (WebElement): The row element containing the data.
-        driver (WebDriver): The WebDriver instance used for web scraping.
+        row (list): The cells of the row, as returned by get_table_cells.
         verbose (bool, optional): Whether to print verbose output. Defaults to False.
 
     Returns:
         dict: A dictionary containing the extracted data for the row.
 
     """
+    import numpy as np
+
+    from symmetry import parse_transformation_matrix
+
     # Initialize variables to store the data for each row
     supergroup_number = None
     transformation_matrix = np.zeros(shape=(3,3))
     initial_vector = np.zeros(shape=(3))
     coset_representatives = None
     wyckoff_splitting_url = None
-    wyckoff_information = None
 
     # Iterate through each column in the row
-    for i_col, column in enumerate(row.find_elements(By.XPATH, "td")):
+    for i_col, column in enumerate(row):
         if verbose:
             print("Processing column", i_col)
         
         # Extract the supergroup number from the first column
         if i_col == 0:
-            supergroup_number = column.text.strip()
+            supergroup_number = column["text"].strip()
 
         # Extract the transformation matrix and initial vector from the second column
         elif i_col == 1:
-            raw_transformation_matrix_rows = column.text.strip().split("\n")
-            for i_transform_row, transformation_row in enumerate(raw_transformation_matrix_rows):
-                raw_numbers = transformation_row.replace("[","").replace("]","").split()
-                tmp_list = []
-                for raw_number in raw_numbers:
-                    # handles cases where the string is a fraction
-                    if 't' in raw_number:
-                        raw_number = raw_number.split('t')[-1]
-                        if raw_number == '':
-                            raw_number = "0"
-                    if "/" in raw_number:
-                        
-                        numerator, denominator = map(int, raw_number.split('/'))
-                        result_number = numerator / denominator
-                    else:
-                        result_number=raw_number
-                    tmp_list.append(float(result_number))
-
-                raw_numbers = tmp_list
-                transformation_matrix[i_transform_row,:] = raw_numbers[:3]
-                initial_vector[i_transform_row] = raw_numbers[3]
+            transformation_matrix, initial_vector = parse_transformation_matrix(column["text"])
 
         # Extract the coset representatives from the third column
         elif i_col == 2:
-            coset_representatives = column.text.strip().split('\n')
+            coset_representatives = new_scrape_method.split_coset_representatives(column["text"])
 
         # Extract the URL for the wyckoff splitting information from the fourth column
         elif i_col == 3:
 
-            wyckoff_splitting_url = column.find_elements(By.TAG_NAME, "a")[0].get_attribute('href')
-
-            # Retrieve the wyckoff splitting information using the provided function
-            wyckoff_information = get_wyckoff_splitting_info(webpage=wyckoff_splitting_url,driver=driver)
+            wyckoff_splitting_url = column["hrefs"][0]
 
 
     # Create a dictionary to store the data for the current row
@@ -218,13 +294,16 @@ def process_supergroup_row(row, driver, verbose=False):
         "Transformation matrix": transformation_matrix,
         "Initial vector": initial_vector,
         "Coset representatives": coset_representatives,
-        "Wyckoff splitting info": wyckoff_information
+        "Wyckoff splitting url": wyckoff_splitting_url,
+        "Wyckoff splitting info": None
     }
     return row_dict
 
 
 #################################################################################################################################
 
+@memoize_by_url("selenium_wyckoff_splitting_info")
+@timed_stage("wyckoff_splitting_info")
 def get_wyckoff_splitting_info(webpage,driver, verbose=VERBOSE):
     """
     Retrieves Wyckoff splitting information from a this example webpage 
@@ -240,121 +319,189 @@ def get_wyckoff_splitting_info(webpage,driver, verbose=VERBOSE):
               - "Wyckoff number": The Wyckoff number.
               - "Wyckoff Group": The Wyckoff group.
               - "Wyckoff Subgroup": The Wyckoff subgroup.
+              - "Wyckoff position splitting url" and "Wyckoff position splitting form": The request
+                of the form giving the position splitting.
+              - "Wyckoff Position Splitting Info": The position splitting information, obtained by
+                submitting the form of the row directly over HTTP (see get_wyckoff_position_splitting_info).
 
     """
+    results = read_wyckoff_splitting_info(webpage, driver, verbose=verbose)
+
+    # Submit the forms of every row at once, the browser never leaves the page
+    form_requests = [(row_dict["Wyckoff position splitting url"], row_dict["Wyckoff position splitting form"])
+                     for row_dict in results]
+    position_splitting_infos = get_wyckoff_position_splitting_info(form_requests, verbose=verbose)
+    for row_dict, position_splitting_info in zip(results, position_splitting_infos):
+        row_dict['Wyckoff Position Splitting Info'] = position_splitting_info
+
+    # Return the list of Wyckoff splitting information
+    return results
+
+
+def read_wyckoff_splitting_info(webpage, driver, verbose=VERBOSE):
+    """
+    Reads the table of a Wyckoff splitting page in the browser, without submitting the
+    position splitting forms ("Wyckoff Position Splitting Info" is left as None).
+
+    Args:
+        webpage (str): The URL or local file path of the webpage to scrape.
+        driver: The webdriver object to use for scraping.
+
+    Returns:
+        list: A list of dictionaries with the same keys as get_wyckoff_splitting_info.
+    """
 
     # Load the webpage (assuming local HTML or reachable URL)
-    driver.get(webpage)
+    load_page(driver, webpage, verbose=verbose)
 
-    # From the located outer table, find the nested table with border=""
-    nested_table = driver.find_element(By.CSS_SELECTOR, 'table[border="5"][width="60%"]').find_element(By.XPATH, "tbody")
+    # Read the whole Wyckoff splitting table at once
+    rows = get_table_cells(driver, 'table[border="5"][width="60%"]')
+    if rows is None:
+        raise ValueError(f"Wyckoff splitting table not found on {webpage}")
 
     results=[]
     # Iterate through each row in the nested table
-    for i_row, row in enumerate(nested_table.find_elements(By.XPATH, "tr")[2:]): # skip first two rows, they are headers
+    for i_row, row in enumerate(rows[2:]): # skip first two rows, they are headers
 
         # Initialize variables to store Wyckoff splitting information
         wyckoff_number = None
         wyckoff_group = None
         wyckoff_subgroup = None
+        position_splitting_url = None
+        position_splitting_form = None
 
         # Iterate through each column in the row
-        for i_col, column in enumerate(row.find_elements(By.XPATH, "td")):
+        for i_col, column in enumerate(row):
             # Extract Wyckoff number from the first column
             if i_col == 0:
-                wyckoff_number = column.text.strip()
+                wyckoff_number = column["text"].strip()
             # Extract Wyckoff group from the second column
             elif i_col == 1:
-                wyckoff_group = column.text.strip()
+                wyckoff_group = column["text"].strip()
             # Extract Wyckoff subgroup from the third column
             elif i_col == 2:
-                wyckoff_subgroup = column.text.strip().split()
+                wyckoff_subgroup = column["text"].strip().split()
 
             elif i_col == 3:
-                # Submit form
-                wyckoff_position_splitting_info = get_wyckoff_position_splitting_info(element=column,driver=driver)
+                # Read the fields of the form instead of clicking it
+                if column["forms"]:
+                    position_splitting_url, position_splitting_form = get_form_request(column["forms"][0], base_url=webpage)
 
         # Create a dictionary to store the Wyckoff splitting information for the current row
         row_dict = {
             "Wyckoff number": wyckoff_number,
             "Wyckoff Group": wyckoff_group,
             "Wyckoff Subgroup": wyckoff_subgroup,
-            'Wyckoff Position Splitting Info':wyckoff_position_splitting_info
+            "Wyckoff position splitting url": position_splitting_url,
+            "Wyckoff position splitting form": position_splitting_form,
+            'Wyckoff Position Splitting Info': None
         }
 
         # Append the dictionary to the results list
         results.append(row_dict)
 
-    
-
-    # Return the list of Wyckoff splitting information
     return results
    
 
-def get_wyckoff_position_splitting_info(element, driver, verbose=VERBOSE):
+def get_form_request(form, base_url=None):
     """
-    Retrieves the Wyckoff splitting information from a web page.
+    Builds the request a form sends when its submit button is clicked, without clicking it.
+
+    Args:
+        form (dict): The action, method and controls of the form, as returned by get_table_cells.
+        base_url (str, optional): The URL of the page holding the form.
+
+    Returns:
+        tuple: The URL and form data, see new_scrape_method.form_request.
+    """
+    fields = new_scrape_method.collect_form_fields(form["controls"])
+    return new_scrape_method.form_request(form["action"], form["method"], fields, base_url=base_url)
+
+
+def get_wyckoff_position_splitting_info(form_requests, verbose=VERBOSE):
+    """
+    Retrieves the position splitting information of the rows of a Wyckoff splitting page.
+
+    The forms are submitted directly over HTTP and concurrently, instead of clicking each
+    of them in the browser and navigating back.
 
     Args:
-        element: The element containing the web page to scrape.
-        driver: The web driver used to interact with the web page.
+        form_requests: The (url, form data) of each row, as returned by get_form_request.
         verbose: A boolean indicating whether to print verbose output.
 
     Returns:
-        A list of dictionaries, where each dictionary represents a row of Wyckoff splitting information.
-        Each dictionary contains the following keys:
+        A list with, for every row, a list of dictionaries where each dictionary represents
+        a row of Wyckoff splitting information. Each dictionary contains the following keys:
             - 'group_basis': The group basis.
             - 'subgroup_basis': The subgroup basis.
             - 'representative': The representative.
             - 'subgroup_name': The subgroup name.
             - 'operation_number': The operation number.
     """
-    element.find_element(By.CSS_SELECTOR, "input[type='submit']").click()
+    return new_scrape_method.get_wyckoff_position_splitting_infos(form_requests, verbose=verbose)
 
-    nested_table = driver.find_element(By.CSS_SELECTOR, 'table[border=""]').find_element(By.XPATH, "tbody")
 
-    results = []
-    rows = nested_table.find_elements(By.XPATH, 'tr')[2:]  # skip first two rows, they are headers
-    # Iterate through each row in the nested table
-    for i_row, row in enumerate(rows):
-        columns = row.find_elements(By.XPATH, 'td')
-        if len(columns) == 5:
-            subgroup_name = columns[3].text.strip()
 
-        for i_col, column in enumerate(columns):
-            if i_col == 0:
-                operation_number = column.text
-            if i_col == 1:
-                group_basis = column.text
-            if i_col == 2:
-                subgroup_basis = column.text
-            if i_col == 3 and len(columns) == 4:
-                representative = column.text
-            if i_col == 4 and len(columns) == 5:
-                representative = column.text
+def get_common_supergroups_of_two_spacegroups_without_browser(spg_1, z_1, spg_2, z_2, k_index, verbose=VERBOSE, offline=False,
+                                                             depth=None, branches=new_scrape_method.BRANCHES, lazy=False):
+    """
+    Retrieves the common supergroups of two spacegroups over plain HTTP.
 
-        row_dict = {
-            "group_basis": group_basis,
-            "subgroup_basis": subgroup_basis,
-            "representative": representative,
-            'subgroup_name': subgroup_name,
-            'operation_number': operation_number
-        }
+    The form is posted directly to nph-commonsuper and every page is parsed with the
+    BeautifulSoup functions in new_scrape_method, so no browser is started.
 
-        # Append the dictionary to the results list
-        results.append(row_dict)
+    With offline, the common supergroups table is computed from the local group index
+    instead (see group_index.solve_common_supergroups), and by default no page is retrieved.
+    With a larger depth, the pages are answered from the index, and those it does not
+    hold are fetched.
 
-    # Return the list of Wyckoff splitting information
-    # Go back to the previous page to continue the loop
-    driver.back()
-    return results
+    The linked pages are retrieved down to depth, for the selected branches, now or on
+    first access with lazy (see new_scrape_method.expand_common_supergroups).
 
+    Parameters:
+    spg_1 (int): The spacegroup number of the first spacegroup.
+    z_1 (int): The Z number of the first spacegroup.
+    spg_2 (int): The spacegroup number of the second spacegroup.
+    z_2 (int): The Z number of the second spacegroup.
+    k_index (int): The index of the maxik option to select, or the largest ik when offline.
+    verbose (bool): Whether to print verbose output. Default is VERBOSE.
+    offline (bool): Whether to compute the table from the local group index. Default is False.
+    depth (int): The deepest level of the tree to retrieve, DEPTH_TABLE for the table only.
+        Default is FULL_DEPTH, or DEPTH_TABLE offline.
+    branches (tuple): The links of the table to follow, among "H1" and "H2". Default is both.
+    lazy (bool): Whether to fetch the linked pages when they are first accessed. Default is False.
 
+    Returns:
+    list: A list of dictionaries containing the data of the common supergroups.
 
-def get_common_supergroups_of_two_spacegroups(spg_1, z_1, spg_2, z_2, k_index, verbose=VERBOSE):
+    """
+    depth = new_scrape_method.default_depth(depth, offline)
+    if offline:
+        with stage("supergroup_table", offline=True):
+            all_rows_data = solve_common_supergroups(spg_1, z_1, spg_2, z_2, k_index)
+    else:
+        html, url = submit_common_supergroup_form(spg_1, z_1, spg_2, z_2, k_index, verbose=verbose)
+        with stage("supergroup_table"):
+            all_rows_data = new_scrape_method.parse_supergroup_table(html, base_url=url, verbose=verbose)
+        record_supergroup_table(spg_1, z_1, spg_2, z_2, all_rows_data)
+
+    return new_scrape_method.expand_common_supergroups(all_rows_data, depth=depth, branches=branches, lazy=lazy, verbose=verbose)
+
+
+@symmetric_query
+def get_common_supergroups_of_two_spacegroups(spg_1, z_1, spg_2, z_2, k_index, verbose=VERBOSE, use_selenium=False, offline=False,
+                                               depth=None, branches=new_scrape_method.BRANCHES, lazy=False):
     """
     Retrieves the common supergroups of two spacegroups using web scraping.
 
+    By default no browser is used (see get_common_supergroups_of_two_spacegroups_without_browser).
+    Pass use_selenium=True to drive Chrome through the form and every linked page instead,
+    with a driver leased from the shared pool (see driver_pool.get_driver_pool).
+    Pass offline=True to compute the table from the local group index (see group_index.py);
+    only the table is returned unless a depth is given.
+    depth, branches and lazy select which linked pages are retrieved and when; with
+    use_selenium lazy is not available.
+
     Parameters:
     spg_1 (int): The spacegroup number of the first spacegroup.
     z_1 (int): The Z number of the first spacegroup.
@@ -362,40 +509,48 @@ def get_common_supergroups_of_two_spacegroups(spg_1, z_1, spg_2, z_2, k_index, v
     z_2 (int): The Z number of the second spacegroup.
     k_index (int): The index of the maxik option to select.
     verbose (bool): Whether to print verbose output. Default is VERBOSE.
+    use_selenium (bool): Whether to scrape through a Chrome WebDriver. Default is False.
+    offline (bool): Whether to compute the table from the local group index. Default is False.
+    depth (int): The deepest level of the tree to retrieve, DEPTH_TABLE for the table only.
+        Default is FULL_DEPTH, or DEPTH_TABLE offline.
+    branches (tuple): The links of the table to follow, among "H1" and "H2". Default is both.
+    lazy (bool): Whether to fetch the linked pages when they are first accessed. Default is False.
 
     Returns:
     list: A list of dictionaries containing the data of the common supergroups.
 
     """
-    service = Service(executable_path="Z:\side_projects\Web Scraping\chromedriver.exe")
-    driver = webdriver.Chrome(service=service)
-
-    driver.get("https://www.cryst.ehu.es/cryst/commonsuper.html")
-
-    # Fill in the text inputs
-    spg_1 = spg_1
-    z_1 = z_1
-    spg_2 = spg_2
-    z_2 = z_2
-    k_index = str(k_index)
+    depth = new_scrape_method.default_depth(depth, offline)
+    if use_selenium and offline:
+        raise ValueError("use_selenium and offline cannot be combined")
+    if use_selenium and lazy:
+        raise ValueError("lazy is only available without a browser")
+    if not use_selenium:
+        return get_common_supergroups_of_two_spacegroups_without_browser(spg_1, z_1, spg_2, z_2, k_index, verbose=verbose,
+                                                                         offline=offline, depth=depth, branches=branches, lazy=lazy)
 
-    driver.find_element(By.NAME, 'G1').send_keys(str(spg_1))  # Example value for G1
-    driver.find_element(By.NAME, 'ZG1').send_keys(str(z_1))   # Example value for Z1
-    driver.find_element(By.NAME, 'G2').send_keys(str(spg_2))  # Example value for G2
-    driver.find_element(By.NAME, 'ZG2').send_keys(str(z_2))  # Example value for Z2
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.support.ui import Select
 
-    # Select an option from the dropdown for maxik
-    select_maxik = Select(driver.find_element(By.NAME, 'maxik'))
-    select_maxik.select_by_value(str(k_index))  # Example value, choose as needed
+    # Lease a warm driver from the shared pool instead of starting Chrome for every query
+    with get_driver_pool().lease() as driver:
+        load_page(driver, absolute_url(COMMONSUPER_FORM_PATH), verbose=verbose)
 
-    # Submit the form
-    driver.find_element(By.NAME, 'submit').click()
+        driver.find_element(By.NAME, 'G1').send_keys(str(spg_1))  # Example value for G1
+        driver.find_element(By.NAME, 'ZG1').send_keys(str(z_1))   # Example value for Z1
+        driver.find_element(By.NAME, 'G2').send_keys(str(spg_2))  # Example value for G2
+        driver.find_element(By.NAME, 'ZG2').send_keys(str(z_2))  # Example value for Z2
 
+        # Select an option from the dropdown for maxik
+        select_maxik = Select(driver.find_element(By.NAME, 'maxik'))
+        select_maxik.select_by_value(str(k_index))  # Example value, choose as needed
 
-    all_rows_data = get_supergroup_table(driver=driver, verbose=verbose)
+        # Submit the form
+        driver.find_element(By.NAME, 'submit').click()
 
+        all_rows_data = get_supergroup_table(driver=driver, verbose=verbose, depth=depth, branches=branches)
+    record_supergroup_table(spg_1, z_1, spg_2, z_2, all_rows_data)
 
-    driver.quit()
     return all_rows_data
 
 
@@ -433,6 +588,7 @@ def main():
     execution_time = end_time - start_time
     print("-"*200)
     print("Execution time:", execution_time, "seconds")
+    print("Time breakdown:", time_breakdown())
     print("-"*200)
     for entry in common_supergroups_info:
         print(entry)
@@ -0,0 +1,233 @@
+import functools
+import threading
+from collections import OrderedDict
+
+from cache import normalize_url
+
+VERBOSE=False
+
+# Maximum number of parsed pages kept per memoized function
+MEMO_MAXSIZE = 4096
+
+_MEMOS = {}
+
+# Optional persistent stores backing every memo, looked up in the order of STORE_ROLES (see set_persistent_store)
+STORE_ROLES = ("journal", "index", "queue")
+_STORES = {}
+
+#################################################################################################################################
+
+
+class MemoCache:
+    """
+    Bounded, thread-safe LRU mapping of canonical URLs to parsed results, with hit/miss counters.
+
+    When persistent stores are set, misses are looked up in them (counted as store_hits) and
+    every new result is saved to them.
+
+    Args:
+        name (str): The name the memo is reported under by memo_stats.
+        maxsize (int, optional): The maximum number of entries kept. Defaults to MEMO_MAXSIZE.
+    """
+
+    def __init__(self, name, maxsize=MEMO_MAXSIZE):
+        self.name = name
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.store_hits = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """
+        Looks up a result, counting the lookup as a hit or a miss.
+
+        Args:
+            key (str): The canonical URL.
+            default: The value to return on a miss.
+
+        Returns:
+            The memoized result, or default.
+        """
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+
+        for store in _persistent_stores():
+            value = store.load(self.name, key)
+            if value is not None:
+                with self._lock:
+                    self.store_hits += 1
+                    self._insert(key, value)
+                return value
+
+        with self._lock:
+            self.misses += 1
+        return default
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._entries
+
+    def set(self, key, value):
+        """
+        Stores a result, evicting the least recently used entry if the memo is full.
+
+        Args:
+            key (str): The canonical URL.
+            value: The parsed result.
+        """
+        with self._lock:
+            self._insert(key, value)
+        for store in _persistent_stores():
+            store.save(self.name, key, value)
+
+    def claim(self, key):
+        """
+        Claims the computation of a missing result in the stores shared with other workers
+        (see work_queue.WorkQueue.claim).
+
+        Args:
+            key (str): The canonical URL.
+
+        Returns:
+            The result computed by another worker that held the claim, or None if the caller
+            now holds it and must compute the result (then set or release it).
+        """
+        for store in _persistent_stores():
+            if hasattr(store, "claim"):
+                value = store.claim(self.name, key)
+                if value is not None:
+                    with self._lock:
+                        self.store_hits += 1
+                        self._insert(key, value)
+                    return value
+        return None
+
+    def release(self, key):
+        """
+        Gives up the claims taken by claim after the computation failed, so another worker can retry it.
+
+        Args:
+            key (str): The canonical URL.
+        """
+        for store in _persistent_stores():
+            if hasattr(store, "release"):
+                store.release(self.name, key)
+
+    def _insert(self, key, value):
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        """
+        Removes every entry and resets the counters.
+        """
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+            self.store_hits = 0
+
+    def stats(self):
+        """
+        Returns the hit/miss counters and current size of the memo.
+
+        Returns:
+            dict: With the keys "hits", "store_hits", "misses", "size" and "maxsize".
+        """
+        with self._lock:
+            return {"hits": self.hits, "store_hits": self.store_hits, "misses": self.misses,
+                    "size": len(self._entries), "maxsize": self.maxsize}
+
+
+def memoize_by_url(name, maxsize=MEMO_MAXSIZE):
+    """
+    Decorator memoizing a scraping function on the canonical form of its webpage argument.
+
+    The decorated function must take the URL as its first argument (or as webpage=...).
+    Other arguments, such as the driver or verbose flag, are ignored for the lookup.
+    The memo is available as the .memo attribute of the decorated function.
+
+    Results are shared between callers and must be treated as read-only.
+
+    Args:
+        name (str): The name the memo is reported under by memo_stats.
+        maxsize (int, optional): The maximum number of results kept.
+
+    Returns:
+        callable: The decorator.
+    """
+    memo = MemoCache(name, maxsize=maxsize)
+    _MEMOS[name] = memo
+
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            webpage = kwargs["webpage"] if "webpage" in kwargs else args[0]
+            key = normalize_url(webpage)
+            result = memo.get(key)
+            if result is None:
+                # Workers sharing a work queue compute each page once, the others wait for it
+                result = memo.claim(key)
+            if result is None:
+                try:
+                    result = function(*args, **kwargs)
+                except BaseException:
+                    memo.release(key)
+                    raise
+                memo.set(key, result)
+            return result
+
+        wrapper.memo = memo
+        return wrapper
+
+    return decorator
+
+
+def set_persistent_store(store, role="journal"):
+    """
+    Backs every memo with a persistent store, such as a journal.Journal or a group_index.GroupIndex.
+
+    The store must provide load(name, key) returning None for unknown entries and
+    save(name, key, value). One store can be set per role; misses are looked up in the
+    journal, then the index, then the work queue. Stores shared between workers, such as a
+    work_queue.WorkQueue, may also provide claim(name, key) and release(name, key).
+
+    Args:
+        store: The store, or None to remove the store of this role.
+        role (str, optional): One of STORE_ROLES. Defaults to "journal".
+    """
+    if role not in STORE_ROLES:
+        raise ValueError(f"Unknown store role {role!r}, expected one of {STORE_ROLES}")
+    if store is None:
+        _STORES.pop(role, None)
+    else:
+        _STORES[role] = store
+
+
+def _persistent_stores():
+    return [_STORES[role] for role in STORE_ROLES if role in _STORES]
+
+
+def memo_stats():
+    """
+    Returns the counters of every memo created with memoize_by_url.
+
+    Returns:
+        dict: The stats of each memo keyed by its name.
+    """
+    return {name: memo.stats() for name, memo in _MEMOS.items()}
+
+
+def clear_memos():
+    """
+    Empties every memo created with memoize_by_url.
+    """
+    for memo in _MEMOS.values():
+        memo.clear()
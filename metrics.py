@@ -0,0 +1,358 @@
+import functools
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+VERBOSE=False
+
+# Upper bounds (in seconds) of the histogram buckets
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Structured events are logged as one JSON object per line on this logger, at INFO level.
+# Nothing is printed unless logging is configured, e.g. with configure_json_logging.
+logger = logging.getLogger("bilbao.metrics")
+
+_METRICS = []
+
+#################################################################################################################################
+
+
+class Counter:
+    """
+    Thread-safe counter with labels, exported as a Prometheus counter.
+
+    Args:
+        name (str): The metric name.
+        documentation (str): The help text.
+        labelnames (tuple, optional): The names of the labels.
+    """
+
+    kind = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        _METRICS.append(self)
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def total(self):
+        """
+        Returns the sum over every label combination.
+        """
+        with self._lock:
+            return sum(self._values.values())
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, dict(zip(self.labelnames, key)), value) for key, value in sorted(self._values.items())]
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+
+class Histogram:
+    """
+    Thread-safe histogram with labels, exported as a Prometheus histogram.
+
+    Args:
+        name (str): The metric name.
+        documentation (str): The help text.
+        labelnames (tuple, optional): The names of the labels.
+        buckets (tuple, optional): The upper bounds of the buckets. Defaults to BUCKETS.
+    """
+
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._values = {}
+        self._lock = threading.Lock()
+        _METRICS.append(self)
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            counts, value_sum, count = self._values.get(key, ([0] * len(self.buckets), 0.0, 0))
+            for i_bucket, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i_bucket] += 1
+            self._values[key] = (counts, value_sum + value, count + 1)
+
+    def total(self):
+        """
+        Returns the sum of every observed value over every label combination.
+        """
+        with self._lock:
+            return sum(value_sum for _, value_sum, _ in self._values.values())
+
+    def samples(self):
+        samples = []
+        with self._lock:
+            items = [(key, (list(counts), value_sum, count)) for key, (counts, value_sum, count) in sorted(self._values.items())]
+        for key, (counts, value_sum, count) in items:
+            labels = dict(zip(self.labelnames, key))
+            for bound, bucket_count in zip(self.buckets, counts):
+                samples.append((self.name + "_bucket", dict(labels, le=repr(float(bound))), bucket_count))
+            samples.append((self.name + "_bucket", dict(labels, le="+Inf"), count))
+            samples.append((self.name + "_sum", labels, value_sum))
+            samples.append((self.name + "_count", labels, count))
+        return samples
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+
+STAGE_SECONDS = Histogram("bilbao_stage_seconds", "Wall time of each scraping stage, including the stages it contains", ("stage",))
+FETCH_SECONDS = Histogram("bilbao_fetch_seconds", "Latency of each HTTP request sent to the server", ("host", "method", "status"))
+FETCH_BYTES = Counter("bilbao_fetch_bytes_total", "Bytes of response content downloaded", ("host",))
+FETCH_RETRIES = Counter("bilbao_fetch_retries_total", "Requests retried after a transient failure", ("host", "reason"))
+THROTTLE_WAIT_SECONDS = Counter("bilbao_throttle_wait_seconds_total", "Time spent waiting for the rate limit", ("host",))
+CACHE_LOOKUPS = Counter("bilbao_cache_lookups_total", "Lookups in the response cache", ("result",))
+REVALIDATIONS = Counter("bilbao_revalidations_total", "Cached pages checked against the server", ("result",))
+PIPELINE_WAIT_SECONDS = Counter("bilbao_pipeline_wait_seconds_total", "Time the pipeline fetchers waited for the parsers to catch up")
+PARSE_SECONDS = Histogram("bilbao_parse_seconds", "Time spent parsing pages", ("parser", "backend"))
+BROWSER_SECONDS = Histogram("bilbao_browser_seconds", "Time spent waiting for WebDriver calls", ("operation",))
+
+
+def log_event(event, **fields):
+    """
+    Logs a structured event as a single JSON object.
+
+    Args:
+        event (str): The name of the event, e.g. "fetch" or "stage".
+        **fields: The fields of the event.
+    """
+    if logger.isEnabledFor(logging.INFO):
+        logger.info(json.dumps(dict(event=event, time=time.time(), **fields), default=str))
+
+
+@contextmanager
+def stage(name, **fields):
+    """
+    Context manager timing a stage of a scrape into STAGE_SECONDS and logging it.
+
+    Args:
+        name (str): The name of the stage, e.g. "supergroup_info".
+        **fields: Extra fields for the log event, such as the URL.
+    """
+    start_time = time.perf_counter()
+    error = None
+    try:
+        yield
+    except Exception as exception:
+        error = repr(exception)
+        raise
+    finally:
+        elapsed = time.perf_counter() - start_time
+        STAGE_SECONDS.observe(elapsed, stage=name)
+        log_event("stage", stage=name, seconds=elapsed, error=error, **fields)
+
+
+@contextmanager
+def timer(histogram, **labels):
+    """
+    Context manager observing the wall time of its block in a histogram.
+
+    Args:
+        histogram (Histogram): The histogram, e.g. PARSE_SECONDS or BROWSER_SECONDS.
+        **labels: The labels of the observation.
+    """
+    start_time = time.perf_counter()
+    try:
+        yield
+    finally:
+        histogram.observe(time.perf_counter() - start_time, **labels)
+
+
+def timed_stage(name):
+    """
+    Decorator timing every call of a function as a stage (see stage).
+
+    When the function is memoized, apply this decorator below memoize_by_url so only
+    the calls that do the work are timed.
+
+    Args:
+        name (str): The name of the stage.
+
+    Returns:
+        callable: The decorator.
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def record_fetch(url, host, method, status, seconds, n_bytes, attempt):
+    """
+    Records one HTTP request sent to the server.
+
+    Args:
+        url (str): The URL requested.
+        host (str): The host of the URL.
+        method (str): "GET" or "POST".
+        status (int or str): The HTTP status, or "error" if no response was received.
+        seconds (float): The latency of the request.
+        n_bytes (int): The size of the response content.
+        attempt (int): The attempt number, starting at 1.
+    """
+    FETCH_SECONDS.observe(seconds, host=host, method=method, status=status)
+    FETCH_BYTES.inc(n_bytes, host=host)
+    log_event("fetch", url=url, method=method, status=status, seconds=seconds, bytes=n_bytes, attempt=attempt)
+
+
+def time_breakdown():
+    """
+    Splits the time recorded so far between the network, parsing, the browser and the rate limit,
+    to tell whether a slow run is network-, parse- or browser-bound. With concurrent workers the
+    times add up over every thread.
+
+    Returns:
+        dict: The seconds spent in each, plus the request count and cache hit ratio.
+    """
+    lookups = {labels["result"]: value for _, labels, value in CACHE_LOOKUPS.samples()}
+    n_lookups = sum(lookups.values())
+    return {
+        "network_seconds": FETCH_SECONDS.total(),
+        "parse_seconds": PARSE_SECONDS.total(),
+        "browser_seconds": BROWSER_SECONDS.total(),
+        "throttle_wait_seconds": THROTTLE_WAIT_SECONDS.total(),
+        "pipeline_wait_seconds": PIPELINE_WAIT_SECONDS.total(),
+        "requests": sum(value for name, _, value in FETCH_SECONDS.samples() if name.endswith("_count")),
+        "retries": FETCH_RETRIES.total(),
+        "cache_hit_ratio": lookups.get("hit", 0) / n_lookups if n_lookups else None,
+    }
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_sample(name, labels, value):
+    if labels:
+        label_text = ",".join(f'{key}="{_escape(item)}"' for key, item in labels.items())
+        return f"{name}{{{label_text}}} {value}"
+    return f"{name} {value}"
+
+
+def render_prometheus():
+    """
+    Renders every metric, plus the memo and rate limiter state, in the Prometheus text format.
+
+    Returns:
+        str: The exposition text.
+    """
+    lines = []
+    for metric in _METRICS:
+        lines.append(f"# HELP {metric.name} {metric.documentation}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        lines.extend(_format_sample(*sample) for sample in metric.samples())
+
+    # State owned by other modules is exported as gauges when rendering
+    from memo import memo_stats
+    from throttle import throttle_stats
+
+    gauges = (
+        ("bilbao_memo_entries", "Parsed pages held by each memo", [
+            ({"memo": name}, stats["size"]) for name, stats in memo_stats().items()]),
+        ("bilbao_memo_hits", "Memo lookups answered from memory or the persistent store", [
+            ({"memo": name}, stats["hits"] + stats["store_hits"]) for name, stats in memo_stats().items()]),
+        ("bilbao_throttle_rate", "Current requests per second allowed to each host", [
+            ({"host": host}, stats["rate"]) for host, stats in throttle_stats().items()]),
+        ("bilbao_circuit_open", "Whether the circuit breaker of each host is open", [
+            ({"host": host}, int(stats["circuit"] != "closed")) for host, stats in throttle_stats().items()]),
+    )
+    for name, documentation, samples in gauges:
+        lines.append(f"# HELP {name} {documentation}")
+        lines.append(f"# TYPE {name} gauge")
+        lines.extend(_format_sample(name, labels, value) for labels, value in samples)
+    return "\n".join(lines) + "\n"
+
+
+def write_prometheus(path):
+    """
+    Writes the metrics to a file atomically, e.g. for the node_exporter textfile collector.
+
+    Args:
+        path (str): The path of the .prom file.
+    """
+    temporary_path = f"{path}.{os.getpid()}.tmp"
+    with open(temporary_path, "w") as file:
+        file.write(render_prometheus())
+    os.replace(temporary_path, path)
+
+
+def start_metrics_server(port, host="0.0.0.0"):
+    """
+    Serves the metrics at http://host:port/metrics from a background thread.
+
+    Args:
+        port (int): The port to listen on.
+        host (str, optional): The address to listen on.
+
+    Returns:
+        ThreadingHTTPServer: The running server; call shutdown() to stop it.
+    """
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            content = render_prometheus().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def configure_json_logging(path=None):
+    """
+    Prints the structured events, one JSON object per line, to a file or to stderr.
+
+    Args:
+        path (str, optional): The file to append the events to. Defaults to stderr.
+    """
+    handler = logging.FileHandler(path) if path else logging.StreamHandler()
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+
+def clear_metrics():
+    """
+    Resets every metric.
+    """
+    for metric in _METRICS:
+        metric.clear()
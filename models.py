@@ -0,0 +1,387 @@
+import sys
+import threading
+import weakref
+from collections.abc import Sequence
+
+VERBOSE=False
+
+# Arrays shared by shared_array, only kept while a result still holds them
+_ARRAYS = weakref.WeakValueDictionary()
+_ARRAYS_LOCK = threading.Lock()
+
+#################################################################################################################################
+
+
+def intern_text(value):
+    """
+    Interns a string so that equal symbols (HM symbols, Wyckoff letters, coordinates...) share one object.
+
+    Args:
+        value (str or None): The string.
+
+    Returns:
+        str or None: The interned string, or value unchanged if it is not a string.
+    """
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+def intern_texts(values):
+    """
+    Interns every string of a list.
+
+    Returns:
+        tuple or None: The interned strings, or None if values is None.
+    """
+    return None if values is None else tuple(intern_text(value) for value in values)
+
+
+def shared_array(array):
+    """
+    Returns a read-only array equal to the given one, shared with every other equal array.
+
+    Supergroup pages repeat a handful of transformation matrices and initial vectors over
+    millions of rows, so each distinct value is stored once. An array is forgotten once no
+    result holds it any more, so long batches do not keep every distinct matrix alive.
+
+    Args:
+        array (array-like or None): The matrix or vector.
+
+    Returns:
+        numpy.ndarray or None: The shared read-only array.
+    """
+    if array is None:
+        return None
+    import numpy as np
+
+    array = np.asarray(array, dtype=float)
+    key = (array.shape, array.tobytes())
+    with _ARRAYS_LOCK:
+        shared = _ARRAYS.get(key)
+        if shared is None:
+            shared = array.copy()
+            shared.setflags(write=False)
+            _ARRAYS[key] = shared
+    return shared
+
+
+def shared_array_count():
+    """
+    Returns the number of distinct arrays stored by shared_array and still in use.
+    """
+    with _ARRAYS_LOCK:
+        return len(_ARRAYS)
+
+
+class LazyList(Sequence):
+    """
+    Read-only list whose items are only computed, once, when it is first accessed.
+
+    Used for the child pages of a result scraped with lazy=True (see
+    new_scrape_method.expand_common_supergroups): the page is fetched the first time its
+    rows are read, iterated or counted. It pickles as a plain list.
+
+    Args:
+        load (callable): Called without arguments to compute the items.
+    """
+
+    __slots__ = ("_load", "_items", "_lock")
+
+    def __init__(self, load):
+        self._load = load
+        self._items = None
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self):
+        """
+        Whether the items have been computed.
+        """
+        return self._items is not None
+
+    def _get(self):
+        if self._items is None:
+            with self._lock:
+                if self._items is None:
+                    self._items = list(self._load())
+                    self._load = None
+        return self._items
+
+    def __getitem__(self, index):
+        return self._get()[index]
+
+    def __len__(self):
+        return len(self._get())
+
+    def __iter__(self):
+        return iter(self._get())
+
+    def __eq__(self, other):
+        if isinstance(other, (list, tuple, LazyList)):
+            return self._get() == list(other)
+        return NotImplemented
+
+    def __repr__(self):
+        return repr(self._items) if self.loaded else "LazyList(<not loaded>)"
+
+    def __reduce__(self):
+        return list, (self._get(),)
+
+
+class PositionSplitting:
+    """
+    One row of a Wyckoff position splitting page (see new_scrape_method.get_wyckoff_position_splitting_info).
+
+    Once encoded (see encode_operations), operations holds the group basis, subgroup basis
+    and representative as (numerators, denominators) views of 3 affine operations; it stays
+    None when one of them cannot be parsed.
+    """
+
+    __slots__ = ("operation_number", "group_basis", "subgroup_basis", "representative", "subgroup_name", "operations")
+
+    def __init__(self, operation_number, group_basis, subgroup_basis, representative, subgroup_name):
+        self.operation_number = intern_text(operation_number)
+        self.group_basis = intern_text(group_basis)
+        self.subgroup_basis = intern_text(subgroup_basis)
+        self.representative = intern_text(representative)
+        self.subgroup_name = intern_text(subgroup_name)
+        self.operations = None
+
+    @classmethod
+    def from_dict(cls, row_dict):
+        return cls(row_dict.get('operation_number'), row_dict.get('group_basis'), row_dict.get('subgroup_basis'),
+                   row_dict.get('representative'), row_dict.get('subgroup_name'))
+
+    def to_dict(self):
+        """
+        Returns the row in the dictionary shape produced by the scraper.
+        """
+        return {
+            "group_basis": self.group_basis,
+            "subgroup_basis": self.subgroup_basis,
+            "representative": self.representative,
+            'subgroup_name': self.subgroup_name,
+            'operation_number': self.operation_number
+        }
+
+
+class WyckoffSplitting:
+    """
+    One row of a Wyckoff splitting page (see new_scrape_method.get_wyckoff_splitting_info).
+    """
+
+    __slots__ = ("wyckoff_number", "wyckoff_group", "wyckoff_subgroup", "position_splitting_url",
+                 "position_splitting_form", "position_splittings")
+
+    def __init__(self, wyckoff_number, wyckoff_group, wyckoff_subgroup, position_splitting_url=None,
+                 position_splitting_form=None, position_splittings=None):
+        self.wyckoff_number = intern_text(wyckoff_number)
+        self.wyckoff_group = intern_text(wyckoff_group)
+        self.wyckoff_subgroup = intern_texts(wyckoff_subgroup)
+        self.position_splitting_url = intern_text(position_splitting_url)
+        self.position_splitting_form = position_splitting_form
+        self.position_splittings = position_splittings
+
+    @classmethod
+    def from_dict(cls, row_dict):
+        position_splittings = row_dict.get("Wyckoff Position Splitting Info")
+        if position_splittings is not None:
+            position_splittings = tuple(PositionSplitting.from_dict(row) for row in position_splittings)
+        return cls(row_dict.get("Wyckoff number"), row_dict.get("Wyckoff Group"), row_dict.get("Wyckoff Subgroup"),
+                   row_dict.get("Wyckoff position splitting url"), row_dict.get("Wyckoff position splitting form"),
+                   position_splittings)
+
+    def to_dict(self):
+        """
+        Returns the row in the dictionary shape produced by the scraper.
+        """
+        return {
+            "Wyckoff number": self.wyckoff_number,
+            "Wyckoff Group": self.wyckoff_group,
+            "Wyckoff Subgroup": None if self.wyckoff_subgroup is None else list(self.wyckoff_subgroup),
+            "Wyckoff position splitting url": self.position_splitting_url,
+            "Wyckoff position splitting form": self.position_splitting_form,
+            "Wyckoff Position Splitting Info": None if self.position_splittings is None else [
+                position_splitting.to_dict() for position_splitting in self.position_splittings]
+        }
+
+
+class Supergroup:
+    """
+    One row of a supergroup page (see new_scrape_method.get_supergroup_info).
+
+    The transformation matrix and initial vector are read-only arrays shared between
+    equal rows (see shared_array). Once encoded (see encode_operations), coset_operations
+    holds the coset representatives as (numerators, denominators) views of affine operations;
+    it stays None when one of them cannot be parsed.
+    """
+
+    __slots__ = ("supergroup_number", "transformation_matrix", "initial_vector", "coset_representatives",
+                 "wyckoff_splitting_url", "wyckoff_splittings", "coset_operations")
+
+    def __init__(self, supergroup_number, transformation_matrix, initial_vector, coset_representatives,
+                 wyckoff_splitting_url=None, wyckoff_splittings=None):
+        self.supergroup_number = intern_text(supergroup_number)
+        self.transformation_matrix = shared_array(transformation_matrix)
+        self.initial_vector = shared_array(initial_vector)
+        self.coset_representatives = intern_texts(coset_representatives)
+        self.wyckoff_splitting_url = intern_text(wyckoff_splitting_url)
+        self.wyckoff_splittings = wyckoff_splittings
+        self.coset_operations = None
+
+    @classmethod
+    def from_dict(cls, row_dict, shared=None):
+        wyckoff_splittings = row_dict.get("Wyckoff splitting info")
+        if wyckoff_splittings is not None:
+            wyckoff_splittings = _convert_once(wyckoff_splittings, WyckoffSplitting.from_dict, shared)
+        return cls(row_dict.get("Supergroup number"), row_dict.get("Transformation matrix"), row_dict.get("Initial vector"),
+                   row_dict.get("Coset representatives"), row_dict.get("Wyckoff splitting url"), wyckoff_splittings)
+
+    def to_dict(self):
+        """
+        Returns the row in the dictionary shape produced by the scraper.
+        """
+        return {
+            "Supergroup number": self.supergroup_number,
+            "Transformation matrix": self.transformation_matrix,
+            "Initial vector": self.initial_vector,
+            "Coset representatives": None if self.coset_representatives is None else list(self.coset_representatives),
+            "Wyckoff splitting url": self.wyckoff_splitting_url,
+            "Wyckoff splitting info": None if self.wyckoff_splittings is None else [
+                wyckoff_splitting.to_dict() for wyckoff_splitting in self.wyckoff_splittings]
+        }
+
+
+class CommonSupergroup:
+    """
+    One row of the common supergroups table, with the supergroups of its G > H1 and G > H2
+    pages when they were scraped (see get_common_supergroups_of_two_spacegroups).
+    """
+
+    # Column of the table for each attribute holding a table cell
+    COLUMNS = {'n': 'N', 'hm_symbol': 'HM Symbol', 'pg': 'PG', 'zg': 'ZG', 'ita': 'ITA', 'i1': 'i1', 'it1': 'it1',
+               'ik1': 'ik1', 'i2': 'i2', 'it2': 'it2', 'ik2': 'ik2', 'url_h1': 'G > H1', 'url_h2': 'G > H2'}
+
+    __slots__ = tuple(COLUMNS) + ("supergroups_h1", "supergroups_h2")
+
+    def __init__(self, supergroups_h1=None, supergroups_h2=None, **cells):
+        for attribute in self.COLUMNS:
+            setattr(self, attribute, intern_text(cells.get(attribute)))
+        self.supergroups_h1 = supergroups_h1
+        self.supergroups_h2 = supergroups_h2
+
+    @classmethod
+    def from_dict(cls, entry, shared=None):
+        supergroups = {}
+        for attribute, key in (('supergroups_h1', 'G > H1 Supergroup Info'), ('supergroups_h2', 'G > H2 Supergroup Info')):
+            if entry.get(key) is not None:
+                supergroups[attribute] = _convert_once(entry[key], lambda row: Supergroup.from_dict(row, shared), shared)
+        return cls(**supergroups, **{attribute: entry.get(key) for attribute, key in cls.COLUMNS.items()})
+
+    def to_dict(self):
+        """
+        Returns the row in the dictionary shape produced by the scraper. The supergroup info
+        keys are only present when the supergroups were scraped.
+        """
+        entry = {key: getattr(self, attribute) for attribute, key in self.COLUMNS.items()}
+        if self.supergroups_h1 is not None:
+            entry['G > H1 Supergroup Info'] = [supergroup.to_dict() for supergroup in self.supergroups_h1]
+        if self.supergroups_h2 is not None:
+            entry['G > H2 Supergroup Info'] = [supergroup.to_dict() for supergroup in self.supergroups_h2]
+        return entry
+
+
+def _convert_once(rows, convert, shared):
+    # The memoized pages are shared between rows and queries, so each list is converted once
+    if shared is None:
+        return tuple(convert(row) for row in rows)
+    key = id(rows)
+    if key not in shared:
+        shared[key] = (rows, tuple(convert(row) for row in rows))
+    return shared[key][1]
+
+
+def compact_results(all_rows_data, shared=None):
+    """
+    Converts the result of a common supergroups query into CommonSupergroup objects.
+
+    Supergroup and Wyckoff splitting pages appearing several times in the result, or in
+    the results converted with the same shared dictionary, are converted once and shared.
+
+    Args:
+        all_rows_data (list): The dictionaries returned by get_common_supergroups_of_two_spacegroups.
+        shared (dict, optional): Conversions to reuse between calls; it keeps the converted
+            pages alive, so it should only live as long as a batch of queries.
+
+    Returns:
+        list: One CommonSupergroup per row.
+    """
+    shared = {} if shared is None else shared
+    common_supergroups = [CommonSupergroup.from_dict(entry, shared) for entry in all_rows_data]
+    encode_operations(common_supergroups)
+    return common_supergroups
+
+
+def _unique_objects(objects):
+    # Pages shared between rows hold the same objects, so each is encoded once
+    return list({id(obj): obj for obj in objects}.values())
+
+
+def encode_operations(common_supergroups):
+    """
+    Parses the coset representatives and the position splitting bases of CommonSupergroup
+    objects into integer-rational affine operations (see symmetry.AffineOperations), and
+    stores in each Supergroup and PositionSplitting views of its operations.
+
+    All the strings are parsed in one batch into contiguous arrays, which are returned so that
+    the operations of a whole batch can be processed with numpy at once. A row holding a
+    string that is not a triplet of affine coordinates is left unencoded, with only its raw
+    strings, and is masked out by the valid attribute of the arrays. compact_results encodes
+    its result; calling this again on several results gives the arrays of all of them, and the
+    objects then hold views of the new arrays.
+
+    Args:
+        common_supergroups (list): The CommonSupergroup objects returned by compact_results.
+
+    Returns:
+        dict: With the keys "coset_representatives" (one row per Supergroup, in the order of
+              the "supergroups" list) and "position_splittings" (one row of 3 operations, the
+              group basis, subgroup basis and representative, per PositionSplitting of the
+              "splittings" list), the AffineOperations, and the two lists of objects.
+    """
+    from symmetry import AffineOperations
+
+    supergroups = _unique_objects(supergroup for entry in common_supergroups
+                                  for supergroups in (entry.supergroups_h1, entry.supergroups_h2) if supergroups is not None
+                                  for supergroup in supergroups)
+    splittings = _unique_objects(splitting for supergroup in supergroups if supergroup.wyckoff_splittings is not None
+                                 for wyckoff_splitting in supergroup.wyckoff_splittings
+                                 if wyckoff_splitting.position_splittings is not None
+                                 for splitting in wyckoff_splitting.position_splittings
+                                 if splitting.group_basis and splitting.subgroup_basis and splitting.representative)
+
+    coset_operations = AffineOperations.from_texts([supergroup.coset_representatives for supergroup in supergroups])
+    for supergroup, operations, valid in zip(supergroups, coset_operations, coset_operations.valid_rows()):
+        supergroup.coset_operations = operations if valid else None
+    splitting_operations = AffineOperations.from_texts(
+        [(splitting.group_basis, splitting.subgroup_basis, splitting.representative) for splitting in splittings])
+    for splitting, operations, valid in zip(splittings, splitting_operations, splitting_operations.valid_rows()):
+        splitting.operations = operations if valid else None
+    return {
+        "coset_representatives": coset_operations,
+        "supergroups": supergroups,
+        "position_splittings": splitting_operations,
+        "splittings": splittings,
+    }
+
+
+def expand_results(common_supergroups):
+    """
+    Converts CommonSupergroup objects back into the dictionaries returned by the scraper.
+
+    Args:
+        common_supergroups (list): The CommonSupergroup objects, or dictionaries which are returned as is.
+
+    Returns:
+        list: The dictionaries.
+    """
+    return [entry.to_dict() if isinstance(entry, CommonSupergroup) else entry for entry in common_supergroups]
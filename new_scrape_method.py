@@ -1,24 +1,49 @@
+import functools
+import re
 import time
-import requests
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode, urlsplit, urlunsplit
+
+from cache import make_cache_key, normalize_url
+from canonical import symmetric_query
+from driver_pool import get_driver_pool, load_page
+from fetch import COMMONSUPER_FORM_PATH, absolute_url, fetch_page, submit_common_supergroup_form
+from group_index import record_supergroup_table, solve_common_supergroups
+from memo import memoize_by_url
+from metrics import BROWSER_SECONDS, PARSE_SECONDS, timed_stage, timer
+from models import LazyList
 
+VERBOSE=False
 
-import numpy as np
-from bs4 import BeautifulSoup
-from selenium import webdriver
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support.ui import Select
-from selenium.webdriver.chrome.service import Service
+# HTML parsing backend used by the parse_* functions, see set_parser_backend
+PARSER_BACKENDS = ("bs4", "lxml")
+PARSER_BACKEND = "bs4"
 
-VERBOSE=False
+# Number of position splitting forms of one Wyckoff splitting page submitted at the same time
+POSITION_SPLITTING_WORKERS = 8
+
+# Levels of the supergroup tree below the common supergroups table (see expand_common_supergroups)
+DEPTH_TABLE = 0
+DEPTH_SUPERGROUP_INFO = 1
+DEPTH_WYCKOFF_SPLITTING_INFO = 2
+DEPTH_POSITION_SPLITTING = 3
+FULL_DEPTH = DEPTH_POSITION_SPLITTING
+# The G > H1 and G > H2 links of the common supergroups table
+BRANCHES = ("H1", "H2")
+# A coordinate triplet of a "Coset representatives" cell
+_TRIPLET = re.compile(r"\([^()]*\)")
 
 #################################################################################################################################
 
 
+@timed_stage("supergroup_table")
 def get_supergroup_table(driver, verbose=VERBOSE):
     """
     Extracts data from a table on a webpage 
     (https://www.cryst.ehu.es/cgi-bin/cryst/programs/paths/nph-commonsuper) 
-    using a Selenium WebDriver.
+    open in a Selenium WebDriver.
+
+    The page source is read in a single call and parsed with parse_supergroup_table.
 
     Args:
         driver: The Selenium WebDriver instance.
@@ -29,9 +54,33 @@ def get_supergroup_table(driver, verbose=VERBOSE):
         represent the data in each cell of the row.
     """
 
-    try:
-        table = driver.find_element(By.CSS_SELECTOR, 'table[border="0"][cellpadding="3"]')
-    except:
+    # Take the rendered page once and parse it locally, instead of one WebDriver round-trip per cell
+    with timer(BROWSER_SECONDS, operation="page_source"):
+        html, url = driver.page_source, driver.current_url
+    return parse_supergroup_table(html, base_url=url, verbose=verbose)
+
+
+def parse_supergroup_table_bs4(html, base_url=None, verbose=VERBOSE):
+    """
+    Extracts data from the common supergroups table 
+    (https://www.cryst.ehu.es/cgi-bin/cryst/programs/paths/nph-commonsuper) 
+    using BeautifulSoup. This produces the same rows as get_supergroup_table without a browser.
+
+    Args:
+        html (str or bytes): The content of the result page.
+        base_url (str, optional): The URL of the result page, used to resolve the 'G > H1' and 'G > H2' links.
+
+    Returns:
+        A list of dictionaries, where each dictionary represents a row in the table.
+        The keys in the dictionary correspond to the column names, and the values
+        represent the data in each cell of the row.
+    """
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(html, 'html.parser')
+
+    table = soup.select_one('table[border="0"][cellpadding="3"]')
+    if table is None:
         if verbose:
             print("Table not found")
         return []
@@ -40,25 +89,27 @@ def get_supergroup_table(driver, verbose=VERBOSE):
     all_rows_data = []
 
     # Extract the rows, skipping the header row
-    rows = table.find_elements(By.TAG_NAME, 'tr')[1:]  # Assuming first row is the header
+    rows = table.find_all('tr')[1:]  # Assuming first row is the header
 
     for row in rows:
-        cols = row.find_elements(By.TAG_NAME, 'td')
+        cols = row.find_all('td')
         if len(cols) > 12:  # Ensure there are enough columns in the row to avoid index errors
+            h1_link = cols[11].find('a', href=True)
+            h2_link = cols[12].find('a', href=True)
             row_data = {
-                'N': cols[0].text,
-                'HM Symbol': cols[1].text,
-                'PG': cols[2].text,
-                'ZG': cols[3].text,
-                'ITA': cols[4].text,
-                'i1': cols[5].text,
-                'it1': cols[6].text,
-                'ik1': cols[7].text,
-                'i2': cols[8].text,
-                'it2': cols[9].text,
-                'ik2': cols[10].text,
-                'G > H1': cols[11].find_element(By.TAG_NAME, 'a').get_attribute('href') if cols[11].find_elements(By.TAG_NAME, 'a') else '',
-                'G > H2': cols[12].find_element(By.TAG_NAME, 'a').get_attribute('href') if cols[12].find_elements(By.TAG_NAME, 'a') else ''
+                'N': cols[0].get_text().strip(),
+                'HM Symbol': cols[1].get_text().strip(),
+                'PG': cols[2].get_text().strip(),
+                'ZG': cols[3].get_text().strip(),
+                'ITA': cols[4].get_text().strip(),
+                'i1': cols[5].get_text().strip(),
+                'it1': cols[6].get_text().strip(),
+                'ik1': cols[7].get_text().strip(),
+                'i2': cols[8].get_text().strip(),
+                'it2': cols[9].get_text().strip(),
+                'ik2': cols[10].get_text().strip(),
+                'G > H1': absolute_url(h1_link['href'], base_url) if h1_link else '',
+                'G > H2': absolute_url(h2_link['href'], base_url) if h2_link else ''
             }
             all_rows_data.append(row_data)
 
@@ -68,37 +119,149 @@ def get_supergroup_table(driver, verbose=VERBOSE):
 #################################################################################################################################
 
 
-def get_supergroup_info(webpage, verbose=VERBOSE):
+def split_coset_representatives(text):
     """
-    Retrieves information about supergroups from a this type of webpage:
-    https://www.cryst.ehu.es/cgi-bin/cryst/programs/nph-show_all_super?super=230&sub=213&ind=4&super_nor=en&subgr_nor=en
+    Splits the text of a "Coset representatives" cell into its coordinate triplets.
+
+    The representatives follow each other without a separator in the HTML text, e.g.
+    "(x,  y,  z  )(-x,  -y,  -z  )", and on separate lines in the text rendered by the
+    browser, so each parenthesized triplet is taken as one representative.
 
     Args:
-        webpage (str): The URL or local path of the webpage to scrape.
+        text (str): The text of the cell.
 
     Returns:
-        list: A list of dictionaries, where each dictionary contains the following information for a supergroup:
-            - "Supergroup number": The number of the supergroup.
-            - "Transformation matrix": The transformation matrix associated with the supergroup.
-            - "Initial vector": The initial vector associated with the supergroup.
-            - "Coset representatives": The coset representatives associated with the supergroup.
-            - "Wyckoff splitting info": The Wyckoff splitting information associated with the supergroup.
+        list: The coset representatives as strings.
     """
+    return _TRIPLET.findall(text)
 
-    # Load the webpage (assuming local HTML or reachable URL)
-    # driver.get(webpage)
 
-    # From the located outer table, find the nested table with border=""
+def get_table_rows(table):
+    """
+    Returns the rows directly under a table, looking through its tbody if the page has one.
+
+    Pages saved from a browser (like the ones in data/) contain an explicit tbody,
+    while the pages served by the CGI programs do not.
+
+    Args:
+        table: The BeautifulSoup table element.
 
-    soup = BeautifulSoup(requests.get(webpage).content, 'html.parser')
+    Returns:
+        list: The tr elements of the table.
+    """
+    tbody = table.find('tbody', recursive=False)
+    if tbody is not None:
+        table = tbody
+    return table.find_all('tr', recursive=False)
 
 
-    nested_table = soup.select('table[border=""]')[0]
+def form_request(action, method, fields, base_url=None):
+    """
+    Builds the request a browser sends when a form is submitted.
+
+    Args:
+        action (str): The action attribute of the form.
+        method (str): The method attribute of the form ("get" or "post").
+        fields (dict): The name and value of every field sent with the form.
+        base_url (str, optional): The URL of the page holding the form, used to resolve the action.
+
+    Returns:
+        tuple: The URL to fetch and the form data to POST (None for a GET form, whose
+               fields are put in the query string instead).
+    """
+    url = absolute_url(action or "", base_url)
+    if (method or "get").lower() == "post":
+        return url, fields
+    parts = urlsplit(url)
+    return urlunsplit((parts.scheme, parts.netloc, parts.path, urlencode(fields), "")), None
+
+
+def collect_form_fields(controls):
+    """
+    Selects the fields a browser sends when a form is submitted with its first submit button.
+
+    Args:
+        controls (iterable): (tag, name, type, value, checked) for every input, select and textarea
+            of the form, in document order. The value of a select is the value of its selected option.
+
+    Returns:
+        dict: The value of every field sent, keyed by its name.
+    """
+    fields = {}
+    submitted = False
+    for tag, name, input_type, value, checked in controls:
+        if not name or value is None:
+            continue
+        if tag == 'input':
+            input_type = (input_type or 'text').lower()
+            if input_type in ('checkbox', 'radio') and not checked:
+                continue
+            if input_type in ('button', 'reset', 'image', 'file'):
+                continue
+            if input_type == 'submit':
+                if submitted:
+                    continue
+                submitted = True
+        fields[name] = value
+    return fields
+
+
+def get_form_request(form, base_url=None):
+    """
+    Extracts the request sent by a form of a BeautifulSoup page, with the fields a browser
+    would send when its (first) submit button is clicked.
+
+    Args:
+        form: The BeautifulSoup form element.
+        base_url (str, optional): The URL of the page holding the form.
+
+    Returns:
+        tuple: The URL and form data, see form_request.
+    """
+    controls = []
+    for element in form.find_all(['input', 'select', 'textarea']):
+        input_type = element.get('type', 'text').lower()
+        if element.name == 'select':
+            option = element.find('option', selected=True) or element.find('option')
+            value = None if option is None else option.get('value', option.text.strip())
+        elif element.name == 'textarea':
+            value = element.text
+        else:
+            value = element.get('value', 'on' if input_type in ('checkbox', 'radio') else '')
+        controls.append((element.name, element.get('name'), input_type, value, element.has_attr('checked')))
+    return form_request(form.get('action'), form.get('method'), collect_form_fields(controls), base_url)
+
+
+def parse_supergroup_info_bs4(html, webpage=None, verbose=VERBOSE):
+    """
+    Parses a supergroup page of this type:
+    https://www.cryst.ehu.es/cgi-bin/cryst/programs/nph-show_all_super?super=230&sub=213&ind=4&super_nor=en&subgr_nor=en
+
+    The Wyckoff splitting pages it links to are not fetched; their URLs are returned
+    under "Wyckoff splitting url" and "Wyckoff splitting info" is left as None.
+
+    Args:
+        html (str or bytes): The content of the supergroup page.
+        webpage (str, optional): The URL of the page, used to resolve the Wyckoff splitting links.
+
+    Returns:
+        list: A list of dictionaries with the same keys as get_supergroup_info, plus "Wyckoff splitting url".
+    """
+    import numpy as np
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(html, 'html.parser')
+
+    # From the located outer table, find the nested table with border=""
+    nested_table = soup.select_one('table[border=""]')
+    if nested_table is None:
+        raise ValueError(f"Supergroup table not found on {webpage}")
 
     # Initialize an empty list to store the results
     results = []
+    matrix_texts = []
 
-    rows= nested_table.find_all('tr', recursive=False)[1:]
+    rows= get_table_rows(nested_table)[1:]
     # Iterate through each row in the nested table, skipping the header row
     for i_row, row in enumerate(rows): # This find the rows directly under table/tbody
         if verbose:
@@ -109,7 +272,6 @@ def get_supergroup_info(webpage, verbose=VERBOSE):
         initial_vector = np.zeros(shape=(3))
         coset_representatives = None
         wyckoff_splitting_url = None
-        wyckoff_information = None
 
 
         # Iterate through each column in the row
@@ -125,36 +287,19 @@ def get_supergroup_info(webpage, verbose=VERBOSE):
             if i_col == 0:
                 supergroup_number = column.text.strip()
 
-            # Extract the transformation matrix and initial vector from the second column
+            # Collect the transformation matrix text from the second column, the matrices of all rows are parsed together below
             elif i_col == 1:
-                raw_transformation_matrix_rows = column.text.strip().split("\n")
-                for i_transform_row, transformation_row in enumerate(raw_transformation_matrix_rows):
-                    raw_numbers = transformation_row.replace("[","").replace("]","").split()
-                    tmp_list = []
-                    for raw_number in raw_numbers:
-                        # handles cases where the string is a fraction
-                        if "/" in raw_number:
-                            numerator, denominator = map(int, raw_number.split('/'))
-                            result_number = numerator / denominator
-                        else:
-                            result_number=raw_number
-                        tmp_list.append(float(result_number))
-
-                    raw_numbers = tmp_list
-                    transformation_matrix[i_transform_row,:] = raw_numbers[:3]
-                    initial_vector[i_transform_row] = raw_numbers[3]
+                matrix_texts.append((i_row, column.text))
 
             # Extract the coset representatives from the third column
             elif i_col == 2:
-                coset_representatives = column.text.strip().replace(")(",",)_(").replace(",)",")").split('_')
+                coset_representatives = split_coset_representatives(column.text)
 
 
             # Extract the URL for the wyckoff splitting information from the fourth column
             elif i_col == 3:
                 wyckoff_splitting_url = column.find("a")['href']
-                wyckoff_splitting_url='https://www.cryst.ehu.es/' + wyckoff_splitting_url # Have to add website to the url
-                # Retrieve the wyckoff splitting information using the provided function
-                wyckoff_information = get_wyckoff_splitting_info(webpage=wyckoff_splitting_url)
+                wyckoff_splitting_url = absolute_url(wyckoff_splitting_url, webpage) # Have to add website to the url
 
 
         # Create a dictionary to store the data for the current row
@@ -163,41 +308,97 @@ def get_supergroup_info(webpage, verbose=VERBOSE):
             "Transformation matrix": transformation_matrix,
             "Initial vector": initial_vector,
             "Coset representatives": coset_representatives,
-            "Wyckoff splitting info": wyckoff_information
+            "Wyckoff splitting url": wyckoff_splitting_url,
+            "Wyckoff splitting info": None
         }
 
         # Append the dictionary to the results list
         results.append(row_dict)
 
+    set_transformation_matrices(results, matrix_texts)
+    return results
+
+
+def set_transformation_matrices(results, matrix_texts):
+    """
+    Parses the transformation matrices of a supergroup page in one batch and stores them in its rows.
+
+    Args:
+        results (list): The row dictionaries of the page.
+        matrix_texts (list): (row index, matrix cell text) for every row that has a matrix.
+    """
+    if not matrix_texts:
+        return
+    from symmetry import parse_transformation_matrices, split_transformation_matrices
+
+    transformation_matrices, initial_vectors = split_transformation_matrices(
+        parse_transformation_matrices([text for _, text in matrix_texts]))
+    for i_matrix, (i_row, _) in enumerate(matrix_texts):
+        results[i_row]["Transformation matrix"] = transformation_matrices[i_matrix]
+        results[i_row]["Initial vector"] = initial_vectors[i_matrix]
+
+
+@memoize_by_url("supergroup_info")
+@timed_stage("supergroup_info")
+def get_supergroup_info(webpage, verbose=VERBOSE):
+    """
+    Retrieves information about supergroups from a this type of webpage:
+    https://www.cryst.ehu.es/cgi-bin/cryst/programs/nph-show_all_super?super=230&sub=213&ind=4&super_nor=en&subgr_nor=en
+
+    Args:
+        webpage (str): The URL or local path of the webpage to scrape.
+
+    Returns:
+        list: A list of dictionaries, where each dictionary contains the following information for a supergroup:
+            - "Supergroup number": The number of the supergroup.
+            - "Transformation matrix": The transformation matrix associated with the supergroup.
+            - "Initial vector": The initial vector associated with the supergroup.
+            - "Coset representatives": The coset representatives associated with the supergroup.
+            - "Wyckoff splitting url": The URL of the Wyckoff splitting page of the supergroup.
+            - "Wyckoff splitting info": The Wyckoff splitting information associated with the supergroup.
+
+        Results are memoized per URL for the lifetime of the process and shared between
+        callers, so they must not be modified.
+    """
+    html, _ = fetch_page(webpage, verbose=verbose)
+    results = parse_supergroup_info(html, webpage=webpage, verbose=verbose)
+
+    for row_dict in results:
+        if row_dict["Wyckoff splitting url"]:
+            # Retrieve the wyckoff splitting information using the provided function
+            row_dict["Wyckoff splitting info"] = get_wyckoff_splitting_info(webpage=row_dict["Wyckoff splitting url"], verbose=verbose)
+
     return results
 
 #################################################################################################################################
 
-def get_wyckoff_splitting_info(webpage, verbose=VERBOSE):
+def parse_wyckoff_splitting_info_bs4(html, webpage=None, verbose=VERBOSE):
     """
-    Retrieves Wyckoff splitting information from a this example webpage 
+    Parses a Wyckoff splitting page of this type:
     https://www.cryst.ehu.es/cgi-bin/cryst/programs/nph-allwpsplit?super=230&sub=213&trmat=x%2Cy%2Cz.
 
+    The position splitting of each Wyckoff position is not fetched; the request sent by the
+    form of its row is returned under "Wyckoff position splitting url" and "Wyckoff position
+    splitting form", and "Wyckoff Position Splitting Info" is left as None.
+
     Args:
-        webpage (str): The URL or local file path of the webpage to scrape.
+        html (str or bytes): The content of the Wyckoff splitting page.
+        webpage (str, optional): The URL of the page, used to resolve the form actions.
 
     Returns:
-        list: A list of dictionaries containing the Wyckoff splitting information.
-              Each dictionary represents a row in the table and contains the following keys:
-              - "Wyckoff number": The Wyckoff number.
-              - "Wyckoff Group": The Wyckoff group.
-              - "Wyckoff Subgroup": The Wyckoff subgroup.
-
+        list: A list of dictionaries with the same keys as get_wyckoff_splitting_info.
     """
+    from bs4 import BeautifulSoup
 
-    # Load the webpage (assuming local HTML or reachable URL)
-    soup = BeautifulSoup(requests.get(webpage).content, 'html.parser')
+    soup = BeautifulSoup(html, 'html.parser')
 
     # From the located outer table, find the nested table with border=""
-    nested_table = soup.select('table[border="5"][width="60%"]')[0]
+    nested_table = soup.select_one('table[border="5"][width="60%"]')
+    if nested_table is None:
+        raise ValueError(f"Wyckoff splitting table not found on {webpage}")
 
     results=[]
-    rows= nested_table.find_all('tr', recursive=False)[2:] # skip first two rows, they are headers
+    rows= get_table_rows(nested_table)[2:] # skip first two rows, they are headers
     # Iterate through each row in the nested table
     for i_row, row in enumerate(rows): 
 
@@ -205,6 +406,8 @@ def get_wyckoff_splitting_info(webpage, verbose=VERBOSE):
         wyckoff_number = None
         wyckoff_group = None
         wyckoff_subgroup = None
+        position_splitting_url = None
+        position_splitting_form = None
 
         columns= row.find_all('td', recursive=False)
         # Iterate through each column in the row
@@ -218,12 +421,20 @@ def get_wyckoff_splitting_info(webpage, verbose=VERBOSE):
             # Extract Wyckoff subgroup from the third column
             elif i_col == 2:
                 wyckoff_subgroup = column.text.strip().split()
+            # Extract the request of the position splitting form from the fourth column
+            elif i_col == 3:
+                form = column.find('form')
+                if form is not None:
+                    position_splitting_url, position_splitting_form = get_form_request(form, webpage)
 
         # Create a dictionary to store the Wyckoff splitting information for the current row
         row_dict = {
             "Wyckoff number": wyckoff_number,
             "Wyckoff Group": wyckoff_group,
             "Wyckoff Subgroup": wyckoff_subgroup,
+            "Wyckoff position splitting url": position_splitting_url,
+            "Wyckoff position splitting form": position_splitting_form,
+            "Wyckoff Position Splitting Info": None
         }
 
         # Append the dictionary to the results list
@@ -231,10 +442,347 @@ def get_wyckoff_splitting_info(webpage, verbose=VERBOSE):
 
     # Return the list of Wyckoff splitting information
     return results
+
+
+@memoize_by_url("wyckoff_splitting_info")
+@timed_stage("wyckoff_splitting_info")
+def get_wyckoff_splitting_info(webpage, verbose=VERBOSE):
+    """
+    Retrieves Wyckoff splitting information from a this example webpage 
+    https://www.cryst.ehu.es/cgi-bin/cryst/programs/nph-allwpsplit?super=230&sub=213&trmat=x%2Cy%2Cz.
+
+    Args:
+        webpage (str): The URL or local file path of the webpage to scrape.
+
+    Returns:
+        list: A list of dictionaries containing the Wyckoff splitting information.
+              Each dictionary represents a row in the table and contains the following keys:
+              - "Wyckoff number": The Wyckoff number.
+              - "Wyckoff Group": The Wyckoff group.
+              - "Wyckoff Subgroup": The Wyckoff subgroup.
+              - "Wyckoff position splitting url" and "Wyckoff position splitting form": The request
+                of the form giving the position splitting.
+              - "Wyckoff Position Splitting Info": The position splitting information (see
+                get_wyckoff_position_splitting_info).
+
+        Results are memoized per URL for the lifetime of the process and shared between
+        callers, so they must not be modified.
+
+    """
+    html, _ = fetch_page(webpage, verbose=verbose)
+    results = parse_wyckoff_splitting_info(html, webpage=webpage, verbose=verbose)
+
+    # The forms of every row were read from the page above, so they can all be submitted at once
+    form_requests = [(row_dict["Wyckoff position splitting url"], row_dict["Wyckoff position splitting form"])
+                     for row_dict in results]
+    position_splitting_infos = get_wyckoff_position_splitting_infos(form_requests, verbose=verbose)
+    for row_dict, position_splitting_info in zip(results, position_splitting_infos):
+        row_dict["Wyckoff Position Splitting Info"] = position_splitting_info
+
+    return results
+
+
+def parse_wyckoff_position_splitting_info_bs4(html, webpage=None, verbose=VERBOSE):
+    """
+    Parses the page returned by the position splitting form of a row of a Wyckoff splitting page.
+
+    Rows with 5 columns start the orbit of a new subgroup Wyckoff position and give its name
+    in the fourth column; rows with 4 columns continue the orbit of the previous one.
+
+    Args:
+        html (str or bytes): The content of the position splitting page.
+        webpage (str, optional): The URL of the page.
+
+    Returns:
+        list: A list of dictionaries with the same keys as get_wyckoff_position_splitting_info.
+    """
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(html, 'html.parser')
+
+    nested_table = soup.select_one('table[border=""]')
+    if nested_table is None:
+        raise ValueError(f"Wyckoff position splitting table not found on {webpage}")
+
+    results = []
+    subgroup_name = None
+    rows = get_table_rows(nested_table)[2:]  # skip first two rows, they are headers
+    for i_row, row in enumerate(rows):
+        columns = [column.text.strip() for column in row.find_all('td', recursive=False)]
+        if len(columns) == 5:
+            subgroup_name = columns[3]
+            representative = columns[4]
+        elif len(columns) == 4:
+            representative = columns[3]
+        else:
+            if verbose:
+                print("Skipping row", i_row, "with", len(columns), "columns")
+            continue
+
+        row_dict = {
+            "group_basis": columns[1],
+            "subgroup_basis": columns[2],
+            "representative": representative,
+            'subgroup_name': subgroup_name,
+            'operation_number': columns[0]
+        }
+        results.append(row_dict)
+
+    return results
+
+
+def get_wyckoff_position_splitting_info(webpage, form_data=None, verbose=VERBOSE):
+    """
+    Submits the position splitting form of one Wyckoff position directly and parses the result.
+
+    Args:
+        webpage (str): The action URL of the form.
+        form_data (dict, optional): The fields of the form, None for a GET form.
+
+    Returns:
+        list: A list of dictionaries, where each dictionary represents a row of Wyckoff splitting information.
+        Each dictionary contains the following keys:
+            - 'group_basis': The group basis.
+            - 'subgroup_basis': The subgroup basis.
+            - 'representative': The representative.
+            - 'subgroup_name': The subgroup name.
+            - 'operation_number': The operation number.
+    """
+    html, url = fetch_page(webpage, data=form_data, verbose=verbose)
+    return parse_wyckoff_position_splitting_info(html, webpage=url, verbose=verbose)
+
+
+@timed_stage("position_splitting")
+def get_wyckoff_position_splitting_infos(form_requests, max_workers=POSITION_SPLITTING_WORKERS, verbose=VERBOSE):
+    """
+    Submits the position splitting forms of a Wyckoff splitting page concurrently.
+
+    Args:
+        form_requests (list): (url, form data) for every row; rows whose url is None are skipped.
+        max_workers (int, optional): The number of forms submitted at the same time.
+
+    Returns:
+        list: The position splitting information of every row, in the order of form_requests
+              (None for the skipped rows).
+    """
+    results = [None] * len(form_requests)
+    pending = [(i_row, url, data) for i_row, (url, data) in enumerate(form_requests) if url]
+    if len(pending) <= 1:
+        for i_row, url, data in pending:
+            results[i_row] = get_wyckoff_position_splitting_info(url, data, verbose=verbose)
+        return results
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(pending))) as executor:
+        futures = [(i_row, executor.submit(get_wyckoff_position_splitting_info, url, data, verbose))
+                   for i_row, url, data in pending]
+        for i_row, future in futures:
+            results[i_row] = future.result()
+    return results
    
-def get_common_supergroups_of_two_spacegroups(spg_1, z_1, spg_2, z_2, k_index, verbose=VERBOSE):
+#################################################################################################################################
+
+def _expand(shared, key, load, lazy):
+    # Computes a child page now, or when it is first accessed. Pages linked several times
+    # in the tree being expanded are only retrieved once, and shared.
+    if key not in shared:
+        shared[key] = LazyList(load) if lazy else load()
+    return shared[key]
+
+
+def expand_supergroup_info(webpage, depth=FULL_DEPTH, lazy=False, verbose=VERBOSE, shared=None):
     """
-    Retrieves the common supergroups of two spacegroups using web scraping.
+    Retrieves a supergroup page with its children expanded down to a given depth.
+
+    The full tree is returned by the memoized get_supergroup_info, which is also used
+    when the page is already memoized. Otherwise the page is fetched and parsed, and its
+    Wyckoff splitting pages are fetched if depth reaches DEPTH_WYCKOFF_SPLITTING_INFO.
+
+    Args:
+        webpage (str): The URL of the supergroup page.
+        depth (int, optional): The deepest level to expand, see expand_common_supergroups.
+        lazy (bool, optional): Whether to return the children as LazyLists fetched on first access.
+        verbose (bool, optional): Whether to print verbose output.
+        shared (dict, optional): The pages already expanded in the same tree, keyed by request.
+
+    Returns:
+        list: A list of dictionaries with the same keys as get_supergroup_info. The
+              "Wyckoff splitting info" of rows below depth is None.
+    """
+    if (depth >= FULL_DEPTH and not lazy) or normalize_url(webpage) in get_supergroup_info.memo:
+        return get_supergroup_info(webpage, verbose=verbose)
+
+    shared = {} if shared is None else shared
+    html, _ = fetch_page(webpage, verbose=verbose)
+    results = parse_supergroup_info(html, webpage=webpage, verbose=verbose)
+    if depth >= DEPTH_WYCKOFF_SPLITTING_INFO:
+        for row_dict in results:
+            url = row_dict["Wyckoff splitting url"]
+            if url:
+                row_dict["Wyckoff splitting info"] = _expand(shared, normalize_url(url), functools.partial(
+                    expand_wyckoff_splitting_info, url, depth, lazy, verbose, shared), lazy)
+    return results
+
+
+def expand_wyckoff_splitting_info(webpage, depth=FULL_DEPTH, lazy=False, verbose=VERBOSE, shared=None):
+    """
+    Retrieves a Wyckoff splitting page, with the position splitting of its rows if depth
+    reaches DEPTH_POSITION_SPLITTING (see expand_supergroup_info).
+
+    Args:
+        webpage (str): The URL of the Wyckoff splitting page.
+        depth (int, optional): The deepest level to expand, see expand_common_supergroups.
+        lazy (bool, optional): Whether to submit the position splitting forms on first access only.
+        verbose (bool, optional): Whether to print verbose output.
+        shared (dict, optional): The pages already expanded in the same tree, keyed by request.
+
+    Returns:
+        list: A list of dictionaries with the same keys as get_wyckoff_splitting_info.
+    """
+    if (depth >= FULL_DEPTH and not lazy) or normalize_url(webpage) in get_wyckoff_splitting_info.memo:
+        return get_wyckoff_splitting_info(webpage, verbose=verbose)
+
+    shared = {} if shared is None else shared
+    html, _ = fetch_page(webpage, verbose=verbose)
+    results = parse_wyckoff_splitting_info(html, webpage=webpage, verbose=verbose)
+    if depth >= DEPTH_POSITION_SPLITTING:
+        for row_dict in results:
+            url, form_data = row_dict["Wyckoff position splitting url"], row_dict["Wyckoff position splitting form"]
+            if url:
+                row_dict["Wyckoff Position Splitting Info"] = _expand(shared, make_cache_key(url, form_data), functools.partial(
+                    get_wyckoff_position_splitting_info, url, form_data, verbose), lazy)
+    return results
+
+
+def default_depth(depth, offline=False):
+    """
+    Returns the depth of a query: the one given, or FULL_DEPTH by default. Offline, the
+    default is DEPTH_TABLE, since the pages below the table are fetched from the server
+    when the group index does not hold them.
+
+    Args:
+        depth (int or None): The depth requested, None for the default.
+        offline (bool, optional): Whether the table is computed from the group index.
+
+    Returns:
+        int: The depth.
+    """
+    if depth is not None:
+        return depth
+    return DEPTH_TABLE if offline else FULL_DEPTH
+
+
+def expand_common_supergroups(all_rows_data, depth=FULL_DEPTH, branches=BRANCHES, lazy=False, verbose=VERBOSE):
+    """
+    Adds the supergroup pages linked from a common supergroups table to its rows, under
+    'G > H1 Supergroup Info' and 'G > H2 Supergroup Info'.
+
+    The depth selects how much of the tree below the table is retrieved:
+        - DEPTH_TABLE (0): nothing, the table costs a single request;
+        - DEPTH_SUPERGROUP_INFO (1): the supergroup pages;
+        - DEPTH_WYCKOFF_SPLITTING_INFO (2): the Wyckoff splitting pages as well;
+        - DEPTH_POSITION_SPLITTING (3, FULL_DEPTH): the position splitting of every Wyckoff position as well.
+
+    With lazy, every page is a LazyList that is only fetched when its rows are first
+    accessed, so the cost of a query follows what the caller reads. Either way a page
+    linked several times is retrieved once.
+
+    Args:
+        all_rows_data (list): The rows of the table, as returned by parse_supergroup_table.
+        depth (int, optional): The deepest level to retrieve. Defaults to FULL_DEPTH.
+        branches (tuple, optional): The links to follow, among "H1" and "H2". Defaults to both.
+        lazy (bool, optional): Whether to fetch the pages on first access only.
+        verbose (bool, optional): Whether to print verbose output.
+
+    Returns:
+        list: all_rows_data, with the supergroup info of the selected branches added.
+    """
+    unknown = set(branches) - set(BRANCHES)
+    if unknown:
+        raise ValueError(f"Unknown branches {sorted(unknown)}, expected some of {BRANCHES}")
+    if depth < DEPTH_SUPERGROUP_INFO:
+        return all_rows_data
+
+    shared = {}
+    for i, entry in enumerate(all_rows_data):
+        if verbose:
+            print("Processing common supergroups row",i)
+            print("-"*200)
+
+        for branch in branches:
+            webpage = entry[f'G > {branch}']
+            if webpage:
+                entry[f'G > {branch} Supergroup Info'] = _expand(shared, normalize_url(webpage), functools.partial(
+                    expand_supergroup_info, webpage, depth, lazy, verbose, shared), lazy)
+
+    return all_rows_data
+
+
+def set_parser_backend(backend):
+    """
+    Selects the HTML parsing backend used by parse_supergroup_table, parse_supergroup_info,
+    parse_wyckoff_splitting_info and parse_wyckoff_position_splitting_info. Both backends
+    produce identical results; "lxml" is faster but requires the lxml package.
+
+    Args:
+        backend (str): Either "bs4" (BeautifulSoup with html.parser) or "lxml".
+    """
+    global PARSER_BACKEND
+    if backend not in PARSER_BACKENDS:
+        raise ValueError(f"Unknown parser backend {backend!r}, expected one of {PARSER_BACKENDS}")
+    if backend == "lxml":
+        import lxml_parsers  # Fail now rather than on the first page if lxml is missing
+    PARSER_BACKEND = backend
+
+
+def parse_supergroup_table(html, base_url=None, verbose=VERBOSE):
+    """
+    Parses the common supergroups table with the selected backend (see parse_supergroup_table_bs4).
+    """
+    with timer(PARSE_SECONDS, parser="supergroup_table", backend=PARSER_BACKEND):
+        if PARSER_BACKEND == "lxml":
+            import lxml_parsers
+            return lxml_parsers.parse_supergroup_table(html, base_url=base_url, verbose=verbose)
+        return parse_supergroup_table_bs4(html, base_url=base_url, verbose=verbose)
+
+
+def parse_supergroup_info(html, webpage=None, verbose=VERBOSE):
+    """
+    Parses a supergroup page with the selected backend (see parse_supergroup_info_bs4).
+    """
+    with timer(PARSE_SECONDS, parser="supergroup_info", backend=PARSER_BACKEND):
+        if PARSER_BACKEND == "lxml":
+            import lxml_parsers
+            return lxml_parsers.parse_supergroup_info(html, webpage=webpage, verbose=verbose)
+        return parse_supergroup_info_bs4(html, webpage=webpage, verbose=verbose)
+
+
+def parse_wyckoff_splitting_info(html, webpage=None, verbose=VERBOSE):
+    """
+    Parses a Wyckoff splitting page with the selected backend (see parse_wyckoff_splitting_info_bs4).
+    """
+    with timer(PARSE_SECONDS, parser="wyckoff_splitting_info", backend=PARSER_BACKEND):
+        if PARSER_BACKEND == "lxml":
+            import lxml_parsers
+            return lxml_parsers.parse_wyckoff_splitting_info(html, webpage=webpage, verbose=verbose)
+        return parse_wyckoff_splitting_info_bs4(html, webpage=webpage, verbose=verbose)
+
+
+def parse_wyckoff_position_splitting_info(html, webpage=None, verbose=VERBOSE):
+    """
+    Parses a position splitting page with the selected backend (see parse_wyckoff_position_splitting_info_bs4).
+    """
+    with timer(PARSE_SECONDS, parser="wyckoff_position_splitting_info", backend=PARSER_BACKEND):
+        if PARSER_BACKEND == "lxml":
+            import lxml_parsers
+            return lxml_parsers.parse_wyckoff_position_splitting_info(html, webpage=webpage, verbose=verbose)
+        return parse_wyckoff_position_splitting_info_bs4(html, webpage=webpage, verbose=verbose)
+
+#################################################################################################################################
+
+def get_supergroup_table_with_selenium(spg_1, z_1, spg_2, z_2, k_index, verbose=VERBOSE):
+    """
+    Fills in and submits the common supergroups form in Chrome and extracts the result table,
+    with a driver leased from the shared pool (see driver_pool.get_driver_pool).
 
     Parameters:
     spg_1 (int): The spacegroup number of the first spacegroup.
@@ -245,57 +793,78 @@ def get_common_supergroups_of_two_spacegroups(spg_1, z_1, spg_2, z_2, k_index, v
     verbose (bool): Whether to print verbose output. Default is VERBOSE.
 
     Returns:
-    list: A list of dictionaries containing the data of the common supergroups.
+    list: A list of dictionaries containing the rows of the common supergroups table.
 
     """
-    service = Service(executable_path="Z:\side_projects\Web Scraping\chromedriver.exe")
-    driver = webdriver.Chrome(service=service)
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.support.ui import Select
 
-    driver.get("https://www.cryst.ehu.es/cryst/commonsuper.html")
+    with get_driver_pool().lease() as driver:
+        load_page(driver, absolute_url(COMMONSUPER_FORM_PATH), verbose=verbose)
 
-    # Fill in the text inputs
-    spg_1 = spg_1
-    z_1 = z_1
-    spg_2 = spg_2
-    z_2 = z_2
-    k_index = str(k_index)
-
-    driver.find_element(By.NAME, 'G1').send_keys(str(spg_1))  # Example value for G1
-    driver.find_element(By.NAME, 'ZG1').send_keys(str(z_1))   # Example value for Z1
-    driver.find_element(By.NAME, 'G2').send_keys(str(spg_2))  # Example value for G2
-    driver.find_element(By.NAME, 'ZG2').send_keys(str(z_2))  # Example value for Z2
-
-    # Select an option from the dropdown for maxik
-    select_maxik = Select(driver.find_element(By.NAME, 'maxik'))
-    select_maxik.select_by_value(str(k_index))  # Example value, choose as needed
-
-    # Submit the form
-    driver.find_element(By.NAME, 'submit').click()
+        driver.find_element(By.NAME, 'G1').send_keys(str(spg_1))  # Example value for G1
+        driver.find_element(By.NAME, 'ZG1').send_keys(str(z_1))   # Example value for Z1
+        driver.find_element(By.NAME, 'G2').send_keys(str(spg_2))  # Example value for G2
+        driver.find_element(By.NAME, 'ZG2').send_keys(str(z_2))  # Example value for Z2
+
+        # Select an option from the dropdown for maxik
+        select_maxik = Select(driver.find_element(By.NAME, 'maxik'))
+        select_maxik.select_by_value(str(k_index))  # Example value, choose as needed
+
+        # Submit the form
+        driver.find_element(By.NAME, 'submit').click()
     
-    all_rows_data = get_supergroup_table(driver=driver)
+        all_rows_data = get_supergroup_table(driver=driver, verbose=verbose)
 
-    driver.quit()
+    return all_rows_data
 
 
-    for i,entry in enumerate(all_rows_data[:1]):
-        if verbose:
-            print("Processing common supergroups row",i)
-            print("-"*200)
+@symmetric_query
+def get_common_supergroups_of_two_spacegroups(spg_1, z_1, spg_2, z_2, k_index, verbose=VERBOSE, use_selenium=False, offline=False,
+                                               depth=None, branches=BRANCHES, lazy=False):
+    """
+    Retrieves the common supergroups of two spacegroups using web scraping.
 
-        if entry['G > H1']:
-            webpage=entry['G > H1']
-            entry_name='G > H1 Supergroup Info'  # Name for the entry in the dictionary
-            supergroup_info=get_supergroup_info(webpage=webpage)  # Get the supergroup info
-            entry[entry_name]=supergroup_info  # Add the supergroup info to the dictionary entry
+    By default the form is posted directly over HTTP and the result table is parsed with
+    BeautifulSoup. Chrome is only started when use_selenium is True. With offline, the
+    table is computed from the local group index instead (see group_index.solve_common_supergroups),
+    and by default no page is retrieved.
 
-        # if entry['G > H2']:
-        #     webpage=entry['G > H2']
-        #     entry_name='G > H2 Supergroup Info'  # Name for the entry in the dictionary
+    The pages linked from the table are then retrieved over HTTP down to depth, for the
+    selected branches, now or on first access with lazy (see expand_common_supergroups).
 
-        #     supergroup_info=get_supergroup_info(webpage=webpage)  # Get the supergroup info
-        #     entry[entry_name]=supergroup_info  # Add the supergroup info to the dictionary entry
-   
-    return all_rows_data
+    Parameters:
+    spg_1 (int): The spacegroup number of the first spacegroup.
+    z_1 (int): The Z number of the first spacegroup.
+    spg_2 (int): The spacegroup number of the second spacegroup.
+    z_2 (int): The Z number of the second spacegroup.
+    k_index (int): The index of the maxik option to select.
+    verbose (bool): Whether to print verbose output. Default is VERBOSE.
+    use_selenium (bool): Whether to submit the form through a Chrome WebDriver. Default is False.
+    offline (bool): Whether to compute the table from the local group index. Default is False.
+    depth (int): The deepest level of the tree to retrieve, DEPTH_TABLE for the table only.
+        Default is FULL_DEPTH, or DEPTH_TABLE offline (see default_depth).
+    branches (tuple): The links of the table to follow, among "H1" and "H2". Default is both.
+    lazy (bool): Whether to fetch the linked pages when they are first accessed. Default is False.
+
+    Returns:
+    list: A list of dictionaries containing the data of the common supergroups.
+
+    """
+    depth = default_depth(depth, offline)
+    if use_selenium and offline:
+        raise ValueError("use_selenium and offline cannot be combined")
+    if offline:
+        all_rows_data = solve_common_supergroups(spg_1, z_1, spg_2, z_2, k_index)
+    elif use_selenium:
+        all_rows_data = get_supergroup_table_with_selenium(spg_1, z_1, spg_2, z_2, k_index, verbose=verbose)
+    else:
+        html, url = submit_common_supergroup_form(spg_1, z_1, spg_2, z_2, k_index, verbose=verbose)
+        all_rows_data = parse_supergroup_table(html, base_url=url, verbose=verbose)
+    if not offline:
+        record_supergroup_table(spg_1, z_1, spg_2, z_2, all_rows_data)
+
+    return expand_common_supergroups(all_rows_data, depth=depth, branches=branches, lazy=lazy, verbose=verbose)
 
 
 def main():
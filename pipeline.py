@@ -0,0 +1,314 @@
+import functools
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import new_scrape_method
+from cache import make_cache_key, normalize_url
+from fetch import COMMONSUPER_PATH, POOL_SIZE, absolute_url, common_supergroup_form_data, fetch_page
+from group_index import record_supergroup_table
+from metrics import PARSE_SECONDS, PIPELINE_WAIT_SECONDS, stage
+from new_scrape_method import (get_supergroup_info, get_wyckoff_splitting_info, parse_supergroup_info, parse_supergroup_table,
+                               parse_wyckoff_position_splitting_info, parse_wyckoff_splitting_info)
+
+VERBOSE=False
+
+# Number of threads fetching pages, enough to keep every connection of the shared session busy
+FETCH_WORKERS = POOL_SIZE
+# Number of processes parsing pages
+PARSE_WORKERS = os.cpu_count() or 1
+# Number of fetched pages waiting for a parser before the fetchers stop
+QUEUE_SIZE = 64
+# How the parse processes are started. Forking while the fetch threads hold the locks of the
+# session, cache or metrics could leave the children deadlocked, so they are started from a
+# clean server process instead (or spawned where forkserver is not available).
+START_METHOD = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+
+# Kinds of pages of the common supergroups tree, from the table down
+SUPERGROUP_TABLE = "supergroup_table"
+SUPERGROUP_INFO = "supergroup_info"
+WYCKOFF_SPLITTING_INFO = "wyckoff_splitting_info"
+POSITION_SPLITTING = "position_splitting"
+
+_PARSERS = {
+    SUPERGROUP_TABLE: parse_supergroup_table,
+    SUPERGROUP_INFO: parse_supergroup_info,
+    WYCKOFF_SPLITTING_INFO: parse_wyckoff_splitting_info,
+    POSITION_SPLITTING: parse_wyckoff_position_splitting_info,
+}
+
+# Memos holding the complete results of a kind of page, which are then neither fetched nor expanded
+_MEMOS = {
+    SUPERGROUP_INFO: get_supergroup_info.memo,
+    WYCKOFF_SPLITTING_INFO: get_wyckoff_splitting_info.memo,
+}
+
+#################################################################################################################################
+
+
+def parse_page(kind, html, url, backend, verbose=VERBOSE):
+    """
+    Parses a raw page of the common supergroups tree. Runs in the parse processes of a Pipeline.
+
+    Args:
+        kind (str): The kind of page, one of SUPERGROUP_TABLE, SUPERGROUP_INFO, WYCKOFF_SPLITTING_INFO or POSITION_SPLITTING.
+        html (bytes): The content of the page.
+        url (str): The URL of the page, used to resolve its links.
+        backend (str): The parser backend (see new_scrape_method.set_parser_backend).
+        verbose (bool, optional): Whether to print verbose output.
+
+    Returns:
+        tuple: The rows returned by the parse_* function of new_scrape_method for this kind of
+               page, and the seconds spent parsing, which the metrics of this process would lose.
+    """
+    if new_scrape_method.PARSER_BACKEND != backend:
+        new_scrape_method.set_parser_backend(backend)
+    start_time = time.perf_counter()
+    rows = _PARSERS[kind](html, url, verbose)
+    return rows, time.perf_counter() - start_time
+
+
+def _request_key(url, data=None):
+    # Pages are keyed like the memos, forms like the response cache
+    return normalize_url(url) if data is None else make_cache_key(url, data)
+
+
+class Pipeline:
+    """
+    Expands the common supergroups tree with fetching and parsing split into two stages.
+
+    A pool of threads fetches the pages (through the shared session and response cache of
+    fetch.py) and puts the raw content on a bounded queue. A dispatcher thread hands the
+    queued pages to a pool of parse processes, so parsing runs on every core instead of
+    holding the GIL between requests. The links of every parsed page are fetched as soon as
+    it is parsed, so the fetchers keep working while earlier pages are being parsed.
+
+    Backpressure: at most twice parse_workers pages are parsing or waiting in the process
+    pool. When they are all taken the dispatcher stops, the queue fills up and the fetchers
+    block until the parsers catch up (see metrics.PIPELINE_WAIT_SECONDS), so the memory used
+    by raw pages stays bounded. The parse processes are started with START_METHOD, and the
+    time they spend parsing is recorded in metrics.PARSE_SECONDS of this process.
+
+    Pages already memoized are not fetched, and each page is fetched once per crawl even if
+    several rows link to it. A pipeline can be entered once and shared by several crawls,
+    including concurrent ones from different threads; crawls asking for a page that is
+    already being fetched or parsed for another crawl wait for it instead of fetching it again.
+
+    Args:
+        fetch_workers (int, optional): The number of fetching threads. Defaults to FETCH_WORKERS.
+        parse_workers (int, optional): The number of parsing processes. Defaults to PARSE_WORKERS.
+        queue_size (int, optional): The number of fetched pages queued for the parsers. Defaults to QUEUE_SIZE.
+        verbose (bool, optional): Whether to print verbose output.
+    """
+
+    def __init__(self, fetch_workers=FETCH_WORKERS, parse_workers=PARSE_WORKERS, queue_size=QUEUE_SIZE, verbose=VERBOSE):
+        self.fetch_workers = fetch_workers
+        self.parse_workers = parse_workers
+        self.queue_size = queue_size
+        self.verbose = verbose
+        self._pages = None
+        self._slots = None
+        self._fetchers = None
+        self._parsers = None
+        self._dispatcher = None
+        self._in_flight = {}
+        self._in_flight_lock = threading.Lock()
+
+    def __enter__(self):
+        # The process pool is created before any thread of the pipeline is started
+        self._parsers = ProcessPoolExecutor(max_workers=self.parse_workers, mp_context=multiprocessing.get_context(START_METHOD))
+        self._pages = queue.Queue(maxsize=self.queue_size)
+        self._slots = threading.BoundedSemaphore(2 * self.parse_workers)
+        self._fetchers = ThreadPoolExecutor(max_workers=self.fetch_workers)
+        self._in_flight = {}
+        self._dispatcher = threading.Thread(target=self._dispatch, daemon=True)
+        self._dispatcher.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """
+        Stops the pipeline once the fetches already started are fetched and parsed.
+        """
+        if self._fetchers is None:
+            return
+        self._fetchers.shutdown(wait=True, cancel_futures=True)
+        self._pages.put(None)
+        self._dispatcher.join()
+        self._parsers.shutdown(wait=True)
+        self._fetchers = None
+        self._parsers = None
+        self._dispatcher = None
+
+    def _submit(self, results, request):
+        # Concurrent crawls asking for the same page share a single fetch and parse
+        key = _request_key(*request[1:])
+        with self._in_flight_lock:
+            waiting = key in self._in_flight
+            self._in_flight.setdefault(key, []).append(results)
+        if not waiting:
+            self._fetchers.submit(self._fetch, request)
+
+    def _deliver(self, request, rows, error):
+        with self._in_flight_lock:
+            waiting = self._in_flight.pop(_request_key(*request[1:]))
+        for results in waiting:
+            results.put((request, rows, error))
+
+    def _fetch(self, request):
+        kind, url, data = request
+        try:
+            html, final_url = fetch_page(url, data, None, self.verbose)
+        except Exception as error:
+            self._deliver(request, None, error)
+            return
+        start_time = time.perf_counter()
+        self._pages.put((request, html, final_url))
+        PIPELINE_WAIT_SECONDS.inc(time.perf_counter() - start_time)
+
+    def _dispatch(self):
+        # Hands the queued pages to the parse processes, waiting for a free slot before each
+        backend = new_scrape_method.PARSER_BACKEND
+        while True:
+            item = self._pages.get()
+            if item is None:
+                return
+            request, html, url = item
+            self._slots.acquire()
+            try:
+                future = self._parsers.submit(parse_page, request[0], html, url, backend, self.verbose)
+            except Exception as error:
+                self._slots.release()
+                self._deliver(request, None, error)
+                continue
+            future.add_done_callback(functools.partial(self._parsed, request, backend))
+
+    def _parsed(self, request, backend, future):
+        self._slots.release()
+        try:
+            rows, seconds = future.result()
+        except Exception as error:
+            self._deliver(request, None, error)
+            return
+        PARSE_SECONDS.observe(seconds, parser=_PARSERS[request[0]].__name__[len("parse_"):], backend=backend)
+        self._deliver(request, rows, None)
+
+    def crawl(self, spg_1, z_1, spg_2, z_2, k_index):
+        """
+        Retrieves the common supergroups of two spacegroups and expands every row of the table.
+
+        Parameters:
+        spg_1 (int): The spacegroup number of the first spacegroup.
+        z_1 (int): The Z number of the first spacegroup.
+        spg_2 (int): The spacegroup number of the second spacegroup.
+        z_2 (int): The Z number of the second spacegroup.
+        k_index (int): The index of the maxik option to select.
+
+        Returns:
+        list: A list of dictionaries with the same nested shape as
+              main.get_common_supergroups_of_two_spacegroups_without_browser.
+        """
+        if self._fetchers is None:
+            with self:
+                return self.crawl(spg_1, z_1, spg_2, z_2, k_index)
+
+        # Parsed pages of this crawl come back on its own queue, so crawls can share the pipeline
+        results = queue.Queue()
+        parsed = {kind: {} for kind in _PARSERS}
+        memoized = {kind: {} for kind in _MEMOS}
+        requested = set()
+        n_pending = 0
+
+        def request(kind, url, data=None):
+            nonlocal n_pending
+            if not url:
+                return
+            key = _request_key(url, data)
+            if key in requested:
+                return
+            requested.add(key)
+            if kind in _MEMOS:
+                rows = _MEMOS[kind].get(key)
+                if rows is not None:
+                    memoized[kind][key] = rows
+                    return
+            n_pending += 1
+            self._submit(results, (kind, url, data))
+
+        with stage("pipeline_crawl"):
+            request(SUPERGROUP_TABLE, absolute_url(COMMONSUPER_PATH), common_supergroup_form_data(spg_1, z_1, spg_2, z_2, k_index))
+            while n_pending:
+                (kind, url, data), rows, error = results.get()
+                n_pending -= 1
+                if error is not None:
+                    raise error
+                parsed[kind][_request_key(url, data)] = rows
+                if kind == SUPERGROUP_TABLE:
+                    record_supergroup_table(spg_1, z_1, spg_2, z_2, rows)
+                    for entry in rows:
+                        request(SUPERGROUP_INFO, entry['G > H1'])
+                        request(SUPERGROUP_INFO, entry['G > H2'])
+                elif kind == SUPERGROUP_INFO:
+                    for row_dict in rows:
+                        request(WYCKOFF_SPLITTING_INFO, row_dict["Wyckoff splitting url"])
+                elif kind == WYCKOFF_SPLITTING_INFO:
+                    for row_dict in rows:
+                        request(POSITION_SPLITTING, row_dict["Wyckoff position splitting url"],
+                                row_dict["Wyckoff position splitting form"])
+        if self.verbose:
+            print("Parsed", sum(len(pages) for pages in parsed.values()), "pages,",
+                  sum(len(pages) for pages in memoized.values()), "already parsed")
+
+        # Reassemble the results into the nested shape of the sequential scraper, and share
+        # the new pages with its memos
+        position_splitting_infos = parsed[POSITION_SPLITTING]
+        wyckoff_infos = memoized[WYCKOFF_SPLITTING_INFO]
+        for key, rows in parsed[WYCKOFF_SPLITTING_INFO].items():
+            for row_dict in rows:
+                if row_dict["Wyckoff position splitting url"]:
+                    row_dict["Wyckoff Position Splitting Info"] = position_splitting_infos[_request_key(
+                        row_dict["Wyckoff position splitting url"], row_dict["Wyckoff position splitting form"])]
+            get_wyckoff_splitting_info.memo.set(key, rows)
+            wyckoff_infos[key] = rows
+
+        supergroup_infos = memoized[SUPERGROUP_INFO]
+        for key, rows in parsed[SUPERGROUP_INFO].items():
+            for row_dict in rows:
+                if row_dict["Wyckoff splitting url"]:
+                    row_dict["Wyckoff splitting info"] = wyckoff_infos[_request_key(row_dict["Wyckoff splitting url"])]
+            get_supergroup_info.memo.set(key, rows)
+            supergroup_infos[key] = rows
+
+        all_rows_data = next(iter(parsed[SUPERGROUP_TABLE].values()))
+        for entry in all_rows_data:
+            for branch in ('H1', 'H2'):
+                if entry[f'G > {branch}']:
+                    entry[f'G > {branch} Supergroup Info'] = supergroup_infos[_request_key(entry[f'G > {branch}'])]
+        return all_rows_data
+
+
+def pipeline_common_supergroups(spg_1, z_1, spg_2, z_2, k_index, fetch_workers=FETCH_WORKERS, parse_workers=PARSE_WORKERS,
+                                verbose=VERBOSE):
+    """
+    Runs Pipeline.crawl with a pipeline started for this query only.
+
+    Parameters:
+    spg_1 (int): The spacegroup number of the first spacegroup.
+    z_1 (int): The Z number of the first spacegroup.
+    spg_2 (int): The spacegroup number of the second spacegroup.
+    z_2 (int): The Z number of the second spacegroup.
+    k_index (int): The index of the maxik option to select.
+    fetch_workers (int): The number of fetching threads.
+    parse_workers (int): The number of parsing processes.
+    verbose (bool): Whether to print verbose output. Default is VERBOSE.
+
+    Returns:
+    list: A list of dictionaries containing the data of the common supergroups.
+    """
+    with Pipeline(fetch_workers=fetch_workers, parse_workers=parse_workers, verbose=verbose) as pipeline:
+        return pipeline.crawl(spg_1, z_1, spg_2, z_2, k_index)
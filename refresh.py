@@ -0,0 +1,155 @@
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from cache import normalize_url
+from canonical import plan_queries
+from fetch import COMMONSUPER_PATH, absolute_url, common_supergroup_form_data, revalidate_page
+from group_index import SUPERGROUP_INFO, WYCKOFF_SPLITTING_INFO, GroupIndex, get_group_index, set_group_index
+from journal import Journal
+from memo import clear_memos, set_persistent_store
+from metrics import stage
+from models import expand_results
+from new_scrape_method import get_supergroup_info, get_wyckoff_splitting_info
+
+VERBOSE=False
+
+# Number of pages revalidated concurrently
+REFRESH_WORKERS = 8
+
+#################################################################################################################################
+
+
+def _stored_pages(stores, name):
+    # The store holding each page, the journal first
+    pages = {}
+    for store in stores:
+        for key in store.stored_keys(name):
+            pages.setdefault(key, store)
+    return pages
+
+
+def _revalidate_all(executor, requests, verbose):
+    # Every request is revalidated, so the response cache holds the current version of each page afterwards
+    return list(executor.map(lambda request: revalidate_page(*request, verbose=verbose), requests))
+
+
+def _refresh_pages(stores, name, function, executor, verbose, forms=None, children=None, changed_children=()):
+    # Revalidates the recorded pages of one memo and parses again the ones that changed or link to a changed page.
+    # The requests of every page are submitted at once, so the workers stay busy even when each page has a single one.
+    pages = {key: store.load(name, key) or [] for key, store in _stored_pages(stores, name).items()}
+    requests = [(key, request) for key, rows in pages.items()
+                for request in [(key, None)] + (forms(rows) if forms is not None else [])]
+    changed_requests = _revalidate_all(executor, [request for _, request in requests], verbose)
+
+    changed = {key for (key, _), request_changed in zip(requests, changed_requests) if request_changed}
+    if children is not None:
+        changed |= {key for key, rows in pages.items()
+                    if any(normalize_url(url) in changed_children for url in children(rows))}
+    for key in changed:
+        # The response cache already holds the new pages, so this fetches nothing
+        function.memo.set(key, function.__wrapped__(key, verbose=verbose))
+    return changed, len(requests)
+
+
+def refresh(journal=None, index=None, workers=REFRESH_WORKERS, verbose=VERBOSE):
+    """
+    Revalidates every page recorded in a journal and/or group index against the server, and
+    updates what depends on the pages that changed.
+
+    Each recorded Wyckoff splitting page, with its position splitting forms, then each
+    recorded supergroup page is revalidated with a conditional request (see
+    fetch.revalidate_page). Only the pages that changed, or link to a page that changed,
+    are parsed again and stored back. Completed queries of the journal whose common
+    supergroups table or supergroup pages changed are marked stale, so resuming the batch
+    runs them again. As in run_batch, the table is revalidated once per pair of groups, for
+    the query it was derived from (see canonical.plan_queries).
+
+    Args:
+        journal (journal.Journal, optional): The journal of a batch.
+        index (group_index.GroupIndex, optional): The group index.
+        workers (int, optional): The number of pages revalidated concurrently. Defaults to REFRESH_WORKERS.
+        verbose (bool, optional): Whether to print verbose output.
+
+    Returns:
+        dict: With the keys "checked_requests" (the number of requests revalidated),
+              "changed_pages" (the normalized URLs of the pages parsed again) and
+              "stale_pairs" (the queries to run again).
+    """
+    stores = [store for store in (journal, index) if store is not None]
+    previous_index = get_group_index()
+    # Results recomputed below must be read from the stores, not from memos filled before the refresh
+    clear_memos()
+    set_persistent_store(journal)
+    if index is not None:
+        set_group_index(index)
+
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            with stage("refresh_wyckoff_splitting_info"):
+                changed_wyckoff, n_wyckoff = _refresh_pages(
+                    stores, WYCKOFF_SPLITTING_INFO, get_wyckoff_splitting_info, executor, verbose,
+                    forms=lambda rows: [(row["Wyckoff position splitting url"], row["Wyckoff position splitting form"])
+                                        for row in rows if row.get("Wyckoff position splitting url")])
+            with stage("refresh_supergroup_info"):
+                changed_supergroups, n_supergroups = _refresh_pages(
+                    stores, SUPERGROUP_INFO, get_supergroup_info, executor, verbose,
+                    children=lambda rows: [row["Wyckoff splitting url"] for row in rows if row.get("Wyckoff splitting url")],
+                    changed_children=changed_wyckoff)
+
+            stale_pairs = []
+            with stage("refresh_pairs"):
+                # Only the links of each result are kept, so the results are streamed from the journal
+                pair_urls = {}
+                for pair, result in (journal.completed_results() if journal is not None else ()):
+                    pair_urls[pair] = {normalize_url(entry[branch]) for entry in expand_results(result)
+                                       for branch in ('G > H1', 'G > H2') if entry.get(branch)}
+                # The batch only posted the canonical query with the largest k_index of each pair of groups,
+                # and derived the others from it, so that is the table to revalidate for all of them
+                plan = plan_queries(pair_urls)
+                tables_changed = _revalidate_all(
+                    executor, [(absolute_url(COMMONSUPER_PATH), common_supergroup_form_data(*query)) for query in plan], verbose)
+                for requested, table_changed in zip(plan.values(), tables_changed):
+                    for pair in requested:
+                        if table_changed or pair_urls[pair] & changed_supergroups:
+                            journal.mark_stale(pair)
+                            stale_pairs.append(pair)
+    finally:
+        set_persistent_store(None)
+        set_group_index(previous_index)
+        clear_memos()
+
+    if verbose:
+        print("Parsed again", len(changed_wyckoff) + len(changed_supergroups), "pages,", len(stale_pairs), "stale queries")
+    return {
+        "checked_requests": n_wyckoff + n_supergroups + len(plan),
+        "changed_pages": sorted(changed_wyckoff | changed_supergroups),
+        "stale_pairs": stale_pairs,
+    }
+
+
+def main():
+    """
+    Command line entry point: revalidates the pages of a journal and/or group index.
+    """
+    parser = argparse.ArgumentParser(description="Revalidate the scraped pages against the Bilbao Crystallographic Server.")
+    parser.add_argument("--journal", help="SQLite journal of a batch; its queries depending on changed pages are marked stale")
+    parser.add_argument("--index", help="SQLite group index (see group_index.py)")
+    parser.add_argument("--workers", type=int, default=REFRESH_WORKERS, help="Number of pages revalidated concurrently")
+    parser.add_argument("--verbose", action="store_true", help="Print verbose output")
+    args = parser.parse_args()
+    if not args.journal and not args.index:
+        parser.error("nothing to refresh, pass --journal and/or --index")
+
+    start_time = time.time()
+    summary = refresh(journal=Journal(args.journal) if args.journal else None,
+                      index=GroupIndex(args.index) if args.index else None, workers=args.workers, verbose=args.verbose)
+    print("Checked", summary["checked_requests"], "requests in", time.time() - start_time, "seconds")
+    print(len(summary["changed_pages"]), "pages changed,", len(summary["stale_pairs"]), "queries to run again")
+    for pair in summary["stale_pairs"]:
+        print(pair)
+
+
+if __name__ == "__main__":
+
+    main()
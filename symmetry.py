@@ -0,0 +1,298 @@
+import re
+from fractions import Fraction
+
+import numpy as np
+
+VERBOSE=False
+
+# A matrix cell holds 3 rows of 3 rotation entries followed by 1 translation entry
+MATRIX_SHAPE = (3, 4)
+_MATRIX_SIZE = MATRIX_SHAPE[0] * MATRIX_SHAPE[1]
+
+# Every run of characters that is not whitespace or a bracket is one entry
+_TOKEN = re.compile(r"[^\s\[\]]+")
+_SEPARATOR = ";"
+
+# An operation is written as its coordinate triplet, e.g. "(-y+1/4,  -x+3/4,  z+3/4  )", and
+# stored as 3 rows of 3 rotation entries followed by 1 translation entry
+OPERATION_SHAPE = MATRIX_SHAPE
+_VARIABLES = "xyz"
+# Every term of a coordinate: a signed coefficient, optionally followed by a variable
+_TERM = re.compile(r"([+-]?)([0-9./]*)\*?([xyz]?)")
+
+#################################################################################################################################
+
+
+def parse_entry(token):
+    """
+    Converts one entry of a transformation matrix to an exact fraction.
+
+    Entries are integers ("-1"), fractions ("1/2") or decimals ("0.25"). Entries that
+    contain a free parameter t keep only what follows the last t, and a bare t is 0.
+
+    Args:
+        token (str): The entry as printed on the page.
+
+    Returns:
+        Fraction: The value of the entry.
+    """
+    if 't' in token:
+        token = token.split('t')[-1]
+        if token == '':
+            token = "0"
+    return Fraction(token)
+
+
+def _tokenize(texts):
+    # Tokenize every matrix in one regex pass over the joined texts; the separator between
+    # matrices lets us check that each of them has exactly 12 entries.
+    tokens = np.array(_TOKEN.findall(f" {_SEPARATOR} ".join(texts)))
+    n_matrices = len(texts)
+    stride = _MATRIX_SIZE + 1
+    if len(tokens) != n_matrices * stride - 1 or np.any(tokens[_MATRIX_SIZE::stride] != _SEPARATOR):
+        raise ValueError(f"Every transformation matrix must have {_MATRIX_SIZE} entries")
+    keep = np.ones(len(tokens), dtype=bool)
+    keep[_MATRIX_SIZE::stride] = False
+    return tokens[keep]
+
+
+def parse_transformation_matrices(texts, exact=False):
+    """
+    Parses a whole column of "Transformation matrix" cells in one batch, e.g.
+    "[ 1 0 0 ] [ 0]\\n[ 0 1 0 ] [ 1/2]\\n[ 0 0 1 ] [ 0]".
+
+    Each distinct entry string is converted only once; the values are then scattered
+    back with numpy, so the Python work does not grow with the number of matrices.
+
+    Args:
+        texts (sequence): The text of each cell.
+        exact (bool, optional): Whether to return exact rationals instead of floats. Defaults to False.
+
+    Returns:
+        If exact is False, a float array of shape (N, 3, 4): the 3x3 transformation matrix
+        in [:, :, :3] and the initial vector in [:, :, 3].
+        If exact is True, a tuple (numerators, denominators): an int64 array of shape (N, 3, 4)
+        and an int64 array of shape (N,) holding the common denominator of each matrix,
+        so that matrix i equals numerators[i] / denominators[i].
+    """
+    texts = list(texts)
+    if not texts:
+        if exact:
+            return np.zeros((0,) + MATRIX_SHAPE, dtype=np.int64), np.ones(0, dtype=np.int64)
+        return np.zeros((0,) + MATRIX_SHAPE)
+
+    unique_tokens, inverse = np.unique(_tokenize(texts), return_inverse=True)
+    inverse = inverse.reshape(len(texts), _MATRIX_SIZE)
+    values = [parse_entry(token) for token in unique_tokens]
+
+    if not exact:
+        unique_floats = np.array([float(value) for value in values])
+        return unique_floats[inverse].reshape((len(texts),) + MATRIX_SHAPE)
+
+    unique_numerators = np.array([value.numerator for value in values], dtype=np.int64)
+    unique_denominators = np.array([value.denominator for value in values], dtype=np.int64)
+    denominators = np.lcm.reduce(unique_denominators[inverse], axis=1)
+    numerators = unique_numerators[inverse] * (denominators[:, None] // unique_denominators[inverse])
+    return numerators.reshape((len(texts),) + MATRIX_SHAPE), denominators
+
+
+def split_transformation_matrices(matrices):
+    """
+    Splits parsed (N, 3, 4) matrices into contiguous transformation matrices and initial vectors.
+
+    Args:
+        matrices (np.ndarray): The float output of parse_transformation_matrices.
+
+    Returns:
+        tuple: The transformation matrices (N, 3, 3) and the initial vectors (N, 3).
+    """
+    return np.ascontiguousarray(matrices[:, :, :3]), np.ascontiguousarray(matrices[:, :, 3])
+
+
+def parse_transformation_matrix(text):
+    """
+    Parses a single "Transformation matrix" cell.
+
+    Args:
+        text (str): The text of the cell.
+
+    Returns:
+        tuple: The 3x3 transformation matrix and the initial vector (3,) as numpy arrays.
+    """
+    transformation_matrices, initial_vectors = split_transformation_matrices(parse_transformation_matrices([text]))
+    return transformation_matrices[0], initial_vectors[0]
+
+
+#################################################################################################################################
+
+
+def parse_affine_expression(expression):
+    """
+    Converts one coordinate of a triplet, e.g. "-x+y+1/4", to exact coefficients.
+
+    Args:
+        expression (str): The coordinate as printed on the page.
+
+    Returns:
+        list: The Fraction coefficients of x, y and z followed by the constant term.
+    """
+    expression = "".join(expression.split())
+    coefficients = [Fraction(0)] * (len(_VARIABLES) + 1)
+    position = 0
+    while position < len(expression):
+        match = _TERM.match(expression, position)
+        sign, number, variable = match.groups()
+        if match.end() == position or not (number or variable):
+            raise ValueError(f"Cannot parse the coordinate {expression!r}")
+        value = Fraction(number) if number else Fraction(1)
+        coefficients[_VARIABLES.index(variable) if variable else len(_VARIABLES)] += -value if sign == "-" else value
+        position = match.end()
+    if position == 0:
+        raise ValueError("Empty coordinate")
+    return coefficients
+
+
+def _split_triplet(text):
+    # The three coordinates of a triplet; a trailing comma before ")" is ignored
+    triplet = text.strip().strip("()").split(",")
+    if len(triplet) == 4 and not triplet[3].strip():
+        triplet = triplet[:3]
+    if len(triplet) != 3:
+        raise ValueError(f"{text!r} is not a coordinate triplet")
+    return [coordinate.strip() for coordinate in triplet]
+
+
+def _parse_all(items, parse, default, strict):
+    # Parses every item, replacing the ones that fail by default unless strict; also returns which succeeded
+    values = []
+    valid = np.ones(len(items), dtype=bool)
+    for i_item, item in enumerate(items):
+        try:
+            values.append(parse(item))
+        except ValueError:
+            if strict:
+                raise
+            values.append(default)
+            valid[i_item] = False
+    return values, valid
+
+
+def parse_affine_operations(texts, strict=True):
+    """
+    Parses many coordinate triplets, e.g. "(x+1/2,  -y,  z  )", in one batch into
+    integer-rational affine operations.
+
+    The coset representatives of a batch repeat a handful of operations, so each distinct
+    triplet is split only once and each distinct coordinate converted only once; the values
+    are then scattered back with numpy.
+
+    Args:
+        texts (sequence): The triplets.
+        strict (bool, optional): Whether to raise ValueError on a text that is not a triplet of
+            affine coordinates. Otherwise it is encoded as zeros over 1 and marked invalid. Defaults to True.
+
+    Returns:
+        tuple: (numerators, denominators, valid): an int64 array of shape (N, 3, 4), the rotation in
+        [:, :, :3] and the translation in [:, :, 3], an int64 array of shape (N,) holding the
+        common denominator of each operation, so that operation i equals numerators[i] / denominators[i],
+        and a bool array of shape (N,) telling which texts were parsed.
+    """
+    texts = list(texts)
+    if not texts:
+        return np.zeros((0,) + OPERATION_SHAPE, dtype=np.int64), np.ones(0, dtype=np.int64), np.ones(0, dtype=bool)
+
+    unique_texts, text_inverse = np.unique(np.array(texts), return_inverse=True)
+    triplets, valid = _parse_all(unique_texts, _split_triplet, ["0"] * len(_VARIABLES), strict)
+    unique_coordinates, inverse = np.unique(np.array(triplets), return_inverse=True)
+    values, coordinates_valid = _parse_all(unique_coordinates, parse_affine_expression,
+                                           [Fraction(0)] * (len(_VARIABLES) + 1), strict)
+    valid &= coordinates_valid[inverse].reshape(len(unique_texts), -1).all(axis=1)
+    unique_numerators = np.array([[value.numerator for value in row] for row in values], dtype=np.int64)
+    unique_denominators = np.array([[value.denominator for value in row] for row in values], dtype=np.int64)
+
+    # (n_unique, 12) entries of every distinct operation, then one common denominator per operation
+    numerators = unique_numerators[inverse].reshape(len(unique_texts), -1)
+    entry_denominators = unique_denominators[inverse].reshape(len(unique_texts), -1)
+    denominators = np.lcm.reduce(entry_denominators, axis=1)
+    numerators = (numerators * (denominators[:, None] // entry_denominators)).reshape((len(unique_texts),) + OPERATION_SHAPE)
+    # A triplet with one bad coordinate is invalid as a whole
+    numerators[~valid] = 0
+    denominators[~valid] = 1
+    return numerators[text_inverse], denominators[text_inverse], valid[text_inverse]
+
+
+class AffineOperations:
+    """
+    The operations of many rows (e.g. the coset representatives of every supergroup of a
+    result) stored in contiguous arrays, so that they can be processed with numpy at once.
+
+    The operations of row i are numerators[offsets[i]:offsets[i + 1]] / denominators[offsets[i]:offsets[i + 1]]
+    (see parse_affine_operations for the layout). Texts that could not be parsed are kept as
+    zero operations, with False in valid.
+
+    Args:
+        numerators (np.ndarray): The int64 (N, 3, 4) numerators.
+        denominators (np.ndarray): The int64 (N,) common denominators.
+        offsets (np.ndarray): The int64 (n_rows + 1,) start of each row, followed by N.
+        valid (np.ndarray, optional): The bool (N,) mask of the operations that were parsed. Defaults to all.
+    """
+
+    __slots__ = ("numerators", "denominators", "offsets", "valid")
+
+    def __init__(self, numerators, denominators, offsets, valid=None):
+        self.numerators = numerators
+        self.denominators = denominators
+        self.offsets = offsets
+        self.valid = np.ones(len(denominators), dtype=bool) if valid is None else valid
+
+    @classmethod
+    def from_texts(cls, rows, strict=False):
+        """
+        Parses the triplets of every row in one batch.
+
+        Args:
+            rows (sequence): The list of triplets of each row; None counts as no operation.
+            strict (bool, optional): Whether to raise ValueError on a text that cannot be parsed,
+                instead of marking it invalid. Defaults to False.
+
+        Returns:
+            AffineOperations: The operations.
+        """
+        rows = [row or () for row in rows]
+        offsets = np.zeros(len(rows) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(row) for row in rows])
+        numerators, denominators, valid = parse_affine_operations([text for row in rows for text in row], strict=strict)
+        return cls(numerators, denominators, offsets, valid)
+
+    def valid_rows(self):
+        """
+        Returns whether every operation of each row was parsed, a bool array of shape (n_rows,).
+        """
+        valid_rows = np.ones(len(self), dtype=bool)
+        valid_rows[self.row_indices()[~self.valid]] = False
+        return valid_rows
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index):
+        """
+        Returns views of the (numerators, denominators) of one row.
+        """
+        start, stop = self.offsets[index], self.offsets[index + 1]
+        return self.numerators[start:stop], self.denominators[start:stop]
+
+    def __iter__(self):
+        return (self[index] for index in range(len(self)))
+
+    def row_indices(self):
+        """
+        Returns the row of every operation, an int64 array of shape (N,).
+        """
+        return np.repeat(np.arange(len(self), dtype=np.int64), np.diff(self.offsets))
+
+    def to_float(self):
+        """
+        Returns the operations as a float array of shape (N, 3, 4).
+        """
+        return self.numerators / self.denominators[:, None, None]
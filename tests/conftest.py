@@ -0,0 +1,83 @@
+import json
+
+import pytest
+
+import benchmark
+import fetch
+from group_index import set_group_index
+from memo import clear_memos, set_persistent_store
+
+MEASUREMENTS = pytest.StashKey[list]()
+
+
+def pytest_addoption(parser):
+    group = parser.getgroup("benchmarks", "offline benchmarks (tests marked benchmark, see tests/test_benchmarks.py)")
+    group.addoption("--bench-repeat", type=int, default=benchmark.TEST_REPEAT, help="Number of timed runs per measurement")
+    group.addoption("--bench-rows", type=int, default=benchmark.TEST_ROWS, help="Number of rows of the enlarged synthetic pages")
+    group.addoption("--bench-latency", type=float, default=0.0, help="Simulated network latency of the stub server in seconds")
+    group.addoption("--bench-selenium", action="store_true", help="Also benchmark the Selenium path (needs Chrome)")
+    group.addoption("--bench-save", help="Write the measurements to this JSON file")
+    group.addoption("--bench-compare", help="Fail the measurements slower than in this JSON file written by --bench-save")
+    group.addoption("--bench-tolerance", type=float, default=0.2, help="Allowed relative slowdown when comparing")
+
+
+def pytest_configure(config):
+    config.stash[MEASUREMENTS] = []
+
+
+def pytest_terminal_summary(terminalreporter, config):
+    measurements = config.stash[MEASUREMENTS]
+    if measurements:
+        terminalreporter.section("benchmarks")
+        for result in measurements:
+            terminalreporter.write_line(f"{result['name']:<55} min {result['min'] * 1000:10.2f} ms   median "
+                                        f"{result['median'] * 1000:10.2f} ms   {result['items_per_second']:12.1f} items/s")
+
+
+def pytest_sessionfinish(session):
+    path = session.config.getoption("bench_save")
+    if path and session.config.stash[MEASUREMENTS]:
+        with open(path, "w") as file:
+            json.dump(session.config.stash[MEASUREMENTS], file, indent=2)
+
+
+@pytest.fixture(autouse=True)
+def isolated():
+    """
+    Runs every test without the on-disk response cache, memos or group index of earlier tests.
+    """
+    fetch.set_cache(None)
+    clear_memos()
+    set_group_index(None)
+    yield
+    set_persistent_store(None)
+    set_group_index(None)
+    clear_memos()
+
+
+@pytest.fixture
+def stub_server():
+    """
+    A StubServer replaying the data/ fixtures, see benchmark.build_pages.
+    """
+    with benchmark.StubServer(benchmark.build_pages()) as server:
+        yield server
+
+
+@pytest.fixture
+def measured(request):
+    """
+    Times a function with benchmark.measure, records the measurement for --bench-save and
+    fails when it is slower than allowed by --bench-compare.
+    """
+    config = request.config
+
+    def measured(name, function, n_items=1, setup=None):
+        result = benchmark.measure(name, function, repeat=config.getoption("bench_repeat"), n_items=n_items, setup=setup)
+        config.stash[MEASUREMENTS].append(result)
+        baseline = config.getoption("bench_compare")
+        if baseline and benchmark.compare([result], baseline, config.getoption("bench_tolerance")):
+            pytest.fail(f"{name} is more than {config.getoption('bench_tolerance'):.0%} slower than in {baseline}")
+        return result
+
+    return measured
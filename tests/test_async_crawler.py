@@ -0,0 +1,45 @@
+import threading
+
+import async_crawler
+import main
+from benchmark import FIXTURE_QUERY
+from lxml_parsers import results_equal
+from memo import clear_memos
+from new_scrape_method import get_supergroup_info
+
+
+def test_crawl_matches_sequential_scraper(stub_server):
+    sequential = main.get_common_supergroups_of_two_spacegroups(*FIXTURE_QUERY)
+    n_requests = stub_server.n_requests
+    clear_memos()
+    crawled = async_crawler.crawl_common_supergroups(*FIXTURE_QUERY)
+    # Every page linked several times is fetched once, like the sequential scraper does
+    assert stub_server.n_requests - n_requests == n_requests == 22
+    assert results_equal(crawled, sequential)
+
+
+def test_memoized_pages_are_not_fetched_again(stub_server):
+    async_crawler.crawl_common_supergroups(*FIXTURE_QUERY)
+    n_requests = stub_server.n_requests
+    async_crawler.crawl_common_supergroups(*FIXTURE_QUERY)
+    assert stub_server.n_requests - n_requests == 1
+
+
+def test_parsing_and_memo_lookups_stay_off_the_event_loop(stub_server, monkeypatch):
+    loop_thread = threading.get_ident()
+    threads = []
+
+    def recorded(function):
+        def wrapper(*args, **kwargs):
+            threads.append(threading.get_ident())
+            return function(*args, **kwargs)
+        return wrapper
+
+    monkeypatch.setattr(async_crawler, "parse_supergroup_table", recorded(async_crawler.parse_supergroup_table))
+    monkeypatch.setattr(async_crawler, "record_supergroup_table", recorded(async_crawler.record_supergroup_table))
+    monkeypatch.setattr(get_supergroup_info.memo, "get", recorded(get_supergroup_info.memo.get))
+    monkeypatch.setattr(get_supergroup_info.memo, "set", recorded(get_supergroup_info.memo.set))
+    async_crawler.crawl_common_supergroups(*FIXTURE_QUERY)
+    # The table, 12 supergroup lookups and 12 stored supergroup pages
+    assert len(threads) == 26
+    assert loop_thread not in threads
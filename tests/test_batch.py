@@ -0,0 +1,112 @@
+import json
+import threading
+
+import pytest
+
+import batch
+from benchmark import FIXTURE_QUERY
+from journal import Journal
+from writers import JsonlSink
+
+OTHER_QUERY = (144, 1, 145, 1, 3)
+
+
+def _pairs(records):
+    return sorted({tuple(record[column] for column in ("spg_1", "z_1", "spg_2", "z_2", "k_index")) for record in records})
+
+
+def test_pairs_are_read_from_csv(tmp_path):
+    path = tmp_path / "pairs.csv"
+    path.write_text("spg_1,z_1,spg_2,z_2,k_index\n# comment\n213, 2, 214, 2, 2\n\n144,1,145,1,3\n")
+    assert batch.read_pairs(str(path)) == [FIXTURE_QUERY, OTHER_QUERY]
+    with pytest.raises(ValueError, match="Expected 5 values"):
+        batch.parse_pair("213,2,214,2")
+
+
+def test_repeated_queries_run_once(stub_server, monkeypatch):
+    queried = []
+    query_pair = batch.query_pair
+    monkeypatch.setattr(batch, "query_pair", lambda pair, *args: queried.append(pair) or query_pair(pair, *args))
+    results = list(batch.run_batch([FIXTURE_QUERY, OTHER_QUERY, FIXTURE_QUERY, OTHER_QUERY], workers=4))
+    assert sorted(pair for pair, _, _ in results) == sorted(queried) == sorted([FIXTURE_QUERY, OTHER_QUERY])
+    assert all(error is None for _, _, error in results)
+
+
+@pytest.mark.parametrize("mode", ["thread", "async", "pipeline"])
+def test_results_are_yielded_as_they_complete(monkeypatch, mode):
+    second_received = threading.Event()
+
+    def query_pair(pair, *args):
+        if pair == FIXTURE_QUERY:
+            assert second_received.wait(10)
+        return [{"N": "1", "pair": pair}]
+
+    async def crawl(self, *pair):
+        return await self._run(query_pair, pair)
+
+    monkeypatch.setattr(batch, "query_pair", query_pair)
+    monkeypatch.setattr(batch.AsyncCrawler, "crawl", crawl)
+    monkeypatch.setattr(batch.Pipeline, "crawl", lambda self, *pair: query_pair(pair))
+    results = batch.run_batch([FIXTURE_QUERY, OTHER_QUERY], workers=2, mode=mode)
+    assert next(results)[0] == OTHER_QUERY
+    second_received.set()
+    assert [pair for pair, _, _ in results] == [FIXTURE_QUERY]
+
+
+def test_failed_query_is_yielded_with_its_error(monkeypatch):
+    def query_pair(pair, *args):
+        if pair == OTHER_QUERY:
+            raise RuntimeError("server down")
+        return []
+
+    monkeypatch.setattr(batch, "query_pair", query_pair)
+    results = {pair: (result, error) for pair, result, error in batch.run_batch([FIXTURE_QUERY, OTHER_QUERY], workers=2)}
+    assert results[FIXTURE_QUERY] == ([], None)
+    assert results[OTHER_QUERY][0] is None and str(results[OTHER_QUERY][1]) == "server down"
+
+
+def test_resumed_batch_keeps_jsonl_records(stub_server, tmp_path):
+    args = ["--journal", str(tmp_path / "journal.sqlite"), "--output", str(tmp_path / "results.jsonl")]
+    batch.main(["--pair", ",".join(map(str, FIXTURE_QUERY))] + args)
+    n_requests = stub_server.n_requests
+    batch.main(["--pair", ",".join(map(str, FIXTURE_QUERY)), "--pair", ",".join(map(str, OTHER_QUERY))] + args)
+
+    with open(tmp_path / "results.jsonl") as file:
+        records = [json.loads(line) for line in file]
+    assert _pairs(records) == sorted([FIXTURE_QUERY, OTHER_QUERY])
+    # The completed query is not run again, only the table of the new one is fetched
+    assert stub_server.n_requests - n_requests == 1
+    assert len(Journal(str(tmp_path / "journal.sqlite")).completed_pairs()) == 2
+
+
+def test_resumed_batch_rewrites_parquet_records(stub_server, tmp_path):
+    pyarrow_parquet = pytest.importorskip("pyarrow.parquet")
+    args = ["--journal", str(tmp_path / "journal.sqlite"), "--output", str(tmp_path / "results.parquet")]
+    batch.main(["--pair", ",".join(map(str, FIXTURE_QUERY))] + args)
+    first_run = pyarrow_parquet.read_table(tmp_path / "results.parquet").to_pylist()
+    batch.main(["--pair", ",".join(map(str, FIXTURE_QUERY)), "--pair", ",".join(map(str, OTHER_QUERY))] + args)
+
+    records = pyarrow_parquet.read_table(tmp_path / "results.parquet").to_pylist()
+    assert _pairs(records) == sorted([FIXTURE_QUERY, OTHER_QUERY])
+    assert [record for record in records if record["spg_1"] == FIXTURE_QUERY[0]] == first_run
+
+
+def test_query_is_recorded_once_its_result_is_written(stub_server, tmp_path, monkeypatch):
+    args = ["--journal", str(tmp_path / "journal.sqlite"), "--output", str(tmp_path / "results.jsonl"), "--workers", "1"]
+    write = JsonlSink.write
+
+    def write_or_crash(sink, pair, result):
+        if pair == OTHER_QUERY:
+            raise KeyboardInterrupt
+        write(sink, pair, result)
+
+    monkeypatch.setattr(JsonlSink, "write", write_or_crash)
+    pairs = ["--pair", ",".join(map(str, FIXTURE_QUERY)), "--pair", ",".join(map(str, OTHER_QUERY))]
+    with pytest.raises(KeyboardInterrupt):
+        batch.main(pairs + args)
+    # The query whose result never reached the output is not skipped when the batch is resumed
+    assert Journal(str(tmp_path / "journal.sqlite")).completed_pairs() == {"213,2,214,2,2"}
+    monkeypatch.undo()
+    batch.main(pairs + args)
+    with open(tmp_path / "results.jsonl") as file:
+        assert _pairs(json.loads(line) for line in file) == sorted([FIXTURE_QUERY, OTHER_QUERY])
@@ -0,0 +1,107 @@
+import pytest
+
+import async_crawler
+import benchmark
+import fetch
+import main
+import new_scrape_method
+from benchmark import FIXTURE_QUERY, StubServer, build_pages, reset_state
+from lxml_parsers import results_equal
+from pipeline import Pipeline
+
+pytestmark = pytest.mark.benchmark
+
+PARSE_STAGES = (
+    ("parse_supergroup_table", fetch.COMMONSUPER_PATH, new_scrape_method.parse_supergroup_table),
+    ("parse_supergroup_info", "/cgi-bin/cryst/programs/nph-show_all_super", new_scrape_method.parse_supergroup_info),
+    ("parse_wyckoff_splitting_info", "/cgi-bin/cryst/programs/nph-allwpsplit", new_scrape_method.parse_wyckoff_splitting_info),
+)
+# Pages fetched by a query of the fixtures at full depth: the table, 12 supergroup pages,
+# the Wyckoff splitting page and its 8 position splitting forms
+PAGES_PER_QUERY = 22
+
+
+@pytest.fixture(scope="module")
+def enlarged_pages(request):
+    n_rows = request.config.getoption("bench_rows")
+    return n_rows, {path: page.encode("iso-8859-1", errors="replace") for path, page in build_pages(n_rows).items()}
+
+
+@pytest.fixture
+def server(request):
+    with StubServer(build_pages(), latency=request.config.getoption("bench_latency")) as server:
+        yield server
+
+
+@pytest.fixture
+def backend(request):
+    previous_backend = new_scrape_method.PARSER_BACKEND
+    try:
+        new_scrape_method.set_parser_backend(request.param)
+    except ImportError:
+        pytest.skip(f"The {request.param} backend is not installed")
+    yield request.param
+    new_scrape_method.set_parser_backend(previous_backend)
+
+
+@pytest.mark.parametrize("backend", new_scrape_method.PARSER_BACKENDS, indirect=True)
+@pytest.mark.parametrize("stage, path, parse", PARSE_STAGES, ids=[stage for stage, _, _ in PARSE_STAGES])
+def test_parse_stage(measured, enlarged_pages, backend, stage, path, parse):
+    n_rows, pages = enlarged_pages
+    assert len(parse(pages[path], fetch.BASE_URL)) == n_rows
+    measured(f"parse[{backend}] {stage} ({n_rows} rows)", lambda: parse(pages[path], fetch.BASE_URL), n_items=n_rows)
+
+
+def test_form_submit(measured, server):
+    measured("http form submit", lambda: fetch.submit_common_supergroup_form(*FIXTURE_QUERY), setup=reset_state)
+    assert {request[:2] for request in server.requests} == {("POST", fetch.COMMONSUPER_PATH)}
+
+
+@pytest.mark.parametrize("name, crawl", [
+    ("sequential", lambda: main.get_common_supergroups_of_two_spacegroups(*FIXTURE_QUERY)),
+    ("async crawler", lambda: async_crawler.crawl_common_supergroups(*FIXTURE_QUERY)),
+])
+def test_end_to_end(measured, server, name, crawl):
+    expected = crawl()
+    assert server.n_requests == PAGES_PER_QUERY
+    reset_state()
+    assert results_equal(crawl(), expected)
+    measured(f"http end-to-end {name} (pages)", crawl, n_items=PAGES_PER_QUERY, setup=reset_state)
+
+
+def test_end_to_end_pipeline(measured, server):
+    with Pipeline() as pipeline:
+        expected = main.get_common_supergroups_of_two_spacegroups(*FIXTURE_QUERY)
+        reset_state()
+        assert results_equal(pipeline.crawl(*FIXTURE_QUERY), expected)
+        measured("http end-to-end pipeline (pages)", lambda: pipeline.crawl(*FIXTURE_QUERY), n_items=PAGES_PER_QUERY,
+                 setup=reset_state)
+
+
+def test_selenium(measured, server, request):
+    if not request.config.getoption("bench_selenium"):
+        pytest.skip("Pass --bench-selenium to benchmark the Selenium path")
+    try:
+        from driver_pool import create_driver
+        driver = create_driver()
+    except Exception as error:
+        pytest.skip(f"No browser could be started: {repr(error).splitlines()[0]}")
+
+    supergroup_url = fetch.absolute_url("/cgi-bin/cryst/programs/nph-show_all_super?super=230&sub=213&ind=4")
+    try:
+        def extract_table():
+            driver.get(fetch.absolute_url(fetch.COMMONSUPER_PATH))
+            return new_scrape_method.get_supergroup_table(driver)
+
+        assert extract_table()
+        measured("selenium get_supergroup_table", extract_table)
+        measured("selenium get_supergroup_info", lambda: main.get_supergroup_info(supergroup_url, driver), setup=reset_state)
+    finally:
+        driver.quit()
+
+
+def test_regressions_are_reported(tmp_path):
+    baseline = tmp_path / "baseline.json"
+    baseline.write_text('[{"name": "stage", "min": 1.0, "median": 1.0, "items_per_second": 1.0}]')
+    assert benchmark.compare([{"name": "stage", "min": 1.1}], str(baseline), 0.2) == []
+    assert benchmark.compare([{"name": "stage", "min": 1.3}, {"name": "new", "min": 9.0}], str(baseline), 0.2) == ["stage"]
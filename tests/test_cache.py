@@ -0,0 +1,82 @@
+import sqlite3
+import time
+
+import pytest
+
+import fetch
+from benchmark import FIXTURE_QUERY
+from cache import ResponseCache, make_cache_key, normalize_url
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return ResponseCache(str(tmp_path / "cache.sqlite"), ttl=None, max_bytes=None)
+
+
+def _stored_size(cache):
+    with sqlite3.connect(cache.path) as connection:
+        return connection.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+
+def test_equivalent_urls_share_a_key():
+    url = "https://www.cryst.ehu.es/cgi-bin/cryst/programs/nph-show_all_super?ind=4&sub=213&super=230"
+    assert normalize_url("HTTPS://WWW.Cryst.ehu.es/cgi-bin/cryst/programs/nph-show_all_super?super=230&sub=213&ind=4#top") == url
+    assert make_cache_key(url) == make_cache_key(url.replace("ind=4&sub=213&super=230", "super=230&ind=4&sub=213"))
+
+
+def test_post_key_depends_on_the_form_fields_not_their_order():
+    url = fetch.absolute_url(fetch.COMMONSUPER_PATH)
+    data = fetch.common_supergroup_form_data(*FIXTURE_QUERY)
+    assert make_cache_key(url, data) == make_cache_key(url, dict(reversed(list(data.items()))))
+    assert make_cache_key(url, data) != make_cache_key(url, dict(data, maxik="4"))
+    assert make_cache_key(url, data) != make_cache_key(url)
+
+
+def test_expired_entries_are_misses(tmp_path):
+    cache = ResponseCache(str(tmp_path / "cache.sqlite"), ttl=0.05)
+    cache.set("key", b"page", "https://www.cryst.ehu.es/")
+    assert cache.get("key") == (b"page", "https://www.cryst.ehu.es/")
+    time.sleep(0.1)
+    assert cache.get("key") is None
+    assert cache.stats() == {"entries": 0, "bytes": 0}
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    cache = ResponseCache(str(tmp_path / "cache.sqlite"), ttl=None, max_bytes=25)
+    for key in ("a", "b"):
+        cache.set(key, b"0123456789", key)
+        time.sleep(0.01)
+    cache.get("a")
+    time.sleep(0.01)
+    cache.set("c", b"0123456789", "c")
+    assert cache.get("b") is None
+    assert cache.get("a") is not None and cache.get("c") is not None
+    assert cache.stats() == {"entries": 2, "bytes": 20}
+
+
+def test_total_size_follows_every_change(cache):
+    cache.set("a", b"x" * 10, "a")
+    cache.set("b", b"x" * 5, "b")
+    cache.set("a", b"x" * 3, "a")
+    assert cache.stats()["bytes"] == _stored_size(cache) == 8
+    cache.clear()
+    assert cache.stats()["bytes"] == _stored_size(cache) == 0
+
+
+def test_total_size_of_an_existing_cache_is_computed_once(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    ResponseCache(path).set("a", b"x" * 10, "a")
+    with sqlite3.connect(path) as connection:
+        connection.execute("DROP TABLE cache_meta")
+    cache = ResponseCache(path)
+    cache.set("b", b"x" * 5, "b")
+    assert cache.stats() == {"entries": 2, "bytes": 15}
+
+
+def test_cached_pages_are_not_fetched_again(stub_server, tmp_path):
+    fetch.set_cache(ResponseCache(str(tmp_path / "cache.sqlite")))
+    page = fetch.submit_common_supergroup_form(*FIXTURE_QUERY)
+    assert fetch.submit_common_supergroup_form(*FIXTURE_QUERY) == page
+    assert stub_server.n_requests == 1
+    fetch.submit_common_supergroup_form(*FIXTURE_QUERY[:4], 4)
+    assert stub_server.n_requests == 2
@@ -0,0 +1,113 @@
+import os
+
+import pytest
+
+import batch
+import canonical
+import fetch
+import main
+import new_scrape_method
+from benchmark import FIXTURE_QUERY
+from cache import ResponseCache
+from group_index import GroupIndex, solve_common_supergroups
+from lxml_parsers import results_equal
+
+TABLE_PAGE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "supergroup_webpage.html")
+SWAPPED_QUERY = FIXTURE_QUERY[2:4] + FIXTURE_QUERY[:2] + FIXTURE_QUERY[4:]
+
+
+@pytest.fixture
+def table():
+    with open(TABLE_PAGE, "rb") as file:
+        return new_scrape_method.parse_supergroup_table(file.read())
+
+
+def test_canonical_pair_puts_smaller_group_first():
+    assert canonical.canonical_pair((214, 2, 213, 2, 4)) == ((213, 2, 214, 2, 4), True)
+    assert canonical.canonical_pair((213, 4, 213, 2, 4)) == ((213, 2, 213, 4, 4), True)
+    assert canonical.canonical_pair((213, 2, 214, 2, 4)) == ((213, 2, 214, 2, 4), False)
+
+
+def test_mirror_swaps_columns_and_keeps_row_order(table):
+    entry = dict(table[0], **{'G > H1 Supergroup Info': ["h1 rows"]})
+    mirrored = canonical.mirror_result([entry] + table[1:])
+    assert [row['N'] for row in mirrored] == [row['N'] for row in table]
+    assert (mirrored[0]['i1'], mirrored[0]['i2']) == (table[0]['i2'], table[0]['i1'])
+    assert mirrored[0]['G > H2'] == table[0]['G > H1']
+    assert mirrored[0]['G > H2 Supergroup Info'] == ["h1 rows"] and 'G > H1 Supergroup Info' not in mirrored[0]
+    assert canonical.mirror_result(canonical.mirror_result(table)) == table
+
+
+def test_mirror_accepts_cells_that_are_not_integers(table):
+    rows = [dict(table[0], ITA="", i1="?")]
+    assert canonical.mirror_result(rows)[0]['i2'] == "?"
+
+
+@pytest.mark.parametrize("k_index", [1, 2, 4, 8, 16])
+def test_derived_result_matches_solver(tmp_path, table, k_index):
+    index = GroupIndex(str(tmp_path / "index.sqlite"))
+    index.record_supergroup_table(213, 2, 214, 2, table)
+    index.mark_crawled(213, 16)
+    index.mark_crawled(214, 16)
+    query = (213, 2, 214, 2, 16)
+    result = solve_common_supergroups(*query, index=index)
+    assert canonical.derive_result(result, query, (213, 2, 214, 2, k_index)) == solve_common_supergroups(
+        213, 2, 214, 2, k_index, index=index)
+    swapped = canonical.derive_result(result, query, (214, 2, 213, 2, k_index))
+    assert canonical.mirror_result(swapped) == solve_common_supergroups(213, 2, 214, 2, k_index, index=index)
+
+
+@pytest.mark.parametrize("bad_cells", [{'ik1': ''}, {'ik2': ' '}, {'ik1': '1/2'}, {'ik2': None}])
+def test_smaller_k_index_skips_rows_without_an_index(tmp_path, table, bad_cells):
+    # A row whose ik cannot be read is not recorded in the index either, so the derivation still matches the solver
+    table = table[:2] + [dict(table[0], **bad_cells)] + table[2:]
+    index = GroupIndex(str(tmp_path / "index.sqlite"))
+    index.record_supergroup_table(213, 2, 214, 2, table)
+    index.mark_crawled(213, 16)
+    index.mark_crawled(214, 16)
+    derived = canonical.derive_result(table, (213, 2, 214, 2, 16), (213, 2, 214, 2, 8))
+    assert derived == solve_common_supergroups(213, 2, 214, 2, 8, index=index)
+    assert len(derived) == sum(int(entry['ik1']) <= 8 and int(entry['ik2']) <= 8 for entry in table if entry is not table[2])
+
+
+def test_plan_queries_groups_swapped_and_smaller_queries():
+    pairs = [(214, 2, 213, 2, 4), (213, 2, 214, 2, 8), (213, 2, 214, 2, 2), (1, 1, 2, 1, 2)]
+    assert canonical.plan_queries(pairs) == {
+        (213, 2, 214, 2, 8): [(214, 2, 213, 2, 4), (213, 2, 214, 2, 8), (213, 2, 214, 2, 2)],
+        (1, 1, 2, 1, 2): [(1, 1, 2, 1, 2)],
+    }
+
+
+@pytest.mark.parametrize("call", [
+    lambda query: query(214, 2, 213, 2, 4, ("H2",)),
+    lambda query: query(214, 2, 213, 2, 4, branches=("H2",)),
+])
+def test_symmetric_query_mirrors_branches(call):
+    calls = []
+
+    @canonical.symmetric_query
+    def query(spg_1, z_1, spg_2, z_2, k_index, branches=("H1", "H2"), verbose=False):
+        calls.append(((spg_1, z_1, spg_2, z_2, k_index), branches))
+        return []
+
+    call(query)
+    assert calls == [((213, 2, 214, 2, 4), ("H1",))]
+
+
+def test_batch_runs_swapped_and_smaller_queries_once(stub_server):
+    pairs = [FIXTURE_QUERY, SWAPPED_QUERY, FIXTURE_QUERY[:4] + (1,)]
+    results = {pair: result for pair, result, error in batch.run_batch(pairs, workers=2)}
+    assert stub_server.n_requests == 22
+    assert results[SWAPPED_QUERY] == canonical.mirror_result(results[FIXTURE_QUERY])
+    assert results[FIXTURE_QUERY[:4] + (1,)] == canonical.restrict_k_index(results[FIXTURE_QUERY], 1)
+
+
+def test_swapped_query_reuses_the_cached_pages(stub_server, tmp_path):
+    fetch.set_cache(ResponseCache(str(tmp_path / "cache.sqlite")))
+    depth = new_scrape_method.DEPTH_SUPERGROUP_INFO
+    result = main.get_common_supergroups_of_two_spacegroups(*FIXTURE_QUERY, depth=depth, branches=("H1",))
+    n_requests = stub_server.n_requests
+    swapped = main.get_common_supergroups_of_two_spacegroups(*SWAPPED_QUERY, depth=depth, branches=("H2",))
+    # The swapped query posts the same form, and its H2 pages are the H1 pages of the canonical one
+    assert stub_server.n_requests == n_requests
+    assert results_equal(swapped, canonical.mirror_result(result))
@@ -0,0 +1,71 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+import fetch
+import main
+import new_scrape_method
+from benchmark import FIXTURE_QUERY
+from cache import ResponseCache
+from group_index import GroupIndex, set_group_index
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY_MODULES = ("selenium", "bs4", "numpy", "requests", "lxml", "pyarrow")
+
+# Runs cli.main in a fresh interpreter against the given server, then prints the heavy modules it imported
+SCRIPT = """
+import json, sys
+import fetch
+fetch.BASE_URL = sys.argv[1]
+import cli
+try:
+    cli.main(sys.argv[2:])
+except SystemExit as exit:
+    if exit.code:
+        raise
+print(json.dumps(sorted(name for name in {modules} if name in sys.modules)))
+""".format(modules=HEAVY_MODULES)
+
+
+def imported_modules(base_url, *argv):
+    process = subprocess.run([sys.executable, "-c", SCRIPT, base_url, *argv], cwd=ROOT, capture_output=True, text=True,
+                             check=True)
+    return json.loads(process.stdout.splitlines()[-1])
+
+
+def test_help_and_cache_commands_import_nothing(tmp_path):
+    assert imported_modules(fetch.BASE_URL, "--help") == []
+    assert imported_modules(fetch.BASE_URL, "query", "--help") == []
+    assert imported_modules(fetch.BASE_URL, "cache", "stats", "--cache", str(tmp_path / "cache.sqlite")) == []
+
+
+def test_offline_query_imports_nothing(stub_server, tmp_path):
+    index = GroupIndex(str(tmp_path / "index.sqlite"))
+    set_group_index(index)
+    main.get_common_supergroups_of_two_spacegroups(*FIXTURE_QUERY, depth=new_scrape_method.DEPTH_TABLE)
+    index.mark_crawled(FIXTURE_QUERY[0], 16)
+    index.mark_crawled(FIXTURE_QUERY[2], 16)
+    n_requests = stub_server.n_requests
+
+    query = [str(value) for value in FIXTURE_QUERY]
+    assert imported_modules(stub_server.url, "query", *query, "--offline", "--index", index.path, "--no-cache") == []
+    assert stub_server.n_requests == n_requests
+
+
+@pytest.mark.parametrize("depth, numpy", [("0", False), ("1", True)])
+def test_cached_query_does_not_load_selenium_or_requests(stub_server, tmp_path, depth, numpy):
+    cache_path = str(tmp_path / "cache.sqlite")
+    fetch.set_cache(ResponseCache(cache_path))
+    main.get_common_supergroups_of_two_spacegroups(*FIXTURE_QUERY, depth=int(depth))
+    n_requests = stub_server.n_requests
+
+    query = [str(value) for value in FIXTURE_QUERY]
+    modules = imported_modules(stub_server.url, "query", *query, "--depth", depth, "--cache", cache_path)
+    assert stub_server.n_requests == n_requests
+    assert "selenium" not in modules and "requests" not in modules
+    assert "bs4" in modules
+    # numpy only holds the transformation matrices of the supergroup pages
+    assert ("numpy" in modules) == numpy
@@ -0,0 +1,77 @@
+import pytest
+
+import main
+import new_scrape_method
+from benchmark import FIXTURE_QUERY
+from group_index import GroupIndex, set_group_index
+from memo import clear_memos
+from models import LazyList
+
+INFO_KEYS = ('G > H1 Supergroup Info', 'G > H2 Supergroup Info')
+
+
+@pytest.mark.parametrize("depth, n_requests", [
+    (new_scrape_method.DEPTH_TABLE, 1),
+    (new_scrape_method.DEPTH_SUPERGROUP_INFO, 13),
+    (new_scrape_method.DEPTH_WYCKOFF_SPLITTING_INFO, 14),
+    (new_scrape_method.FULL_DEPTH, 22),
+])
+def test_depth_bounds_requests(stub_server, depth, n_requests):
+    rows = main.get_common_supergroups_of_two_spacegroups(*FIXTURE_QUERY, depth=depth)
+    assert stub_server.n_requests == n_requests
+    assert all((key in entry) == (depth > new_scrape_method.DEPTH_TABLE) for entry in rows for key in INFO_KEYS)
+    supergroup = rows[0][INFO_KEYS[0]][0] if depth > new_scrape_method.DEPTH_TABLE else None
+    if depth == new_scrape_method.DEPTH_SUPERGROUP_INFO:
+        assert supergroup["Wyckoff splitting info"] is None
+    if depth == new_scrape_method.FULL_DEPTH:
+        assert supergroup["Wyckoff splitting info"][0]["Wyckoff Position Splitting Info"]
+
+
+def test_branches_select_links(stub_server):
+    rows = main.get_common_supergroups_of_two_spacegroups(*FIXTURE_QUERY, depth=new_scrape_method.DEPTH_SUPERGROUP_INFO,
+                                                          branches=("H1",))
+    assert all(INFO_KEYS[0] in entry and INFO_KEYS[1] not in entry for entry in rows)
+    with pytest.raises(ValueError):
+        main.get_common_supergroups_of_two_spacegroups(*FIXTURE_QUERY, branches=("H3",))
+
+
+def test_lazy_pages_are_fetched_on_access(stub_server):
+    rows = main.get_common_supergroups_of_two_spacegroups(*FIXTURE_QUERY, lazy=True)
+    assert stub_server.n_requests == 1
+    supergroups = rows[0][INFO_KEYS[0]]
+    assert isinstance(supergroups, LazyList) and not supergroups.loaded
+    assert supergroups[0]["Supergroup number"]
+    assert stub_server.n_requests == 2
+
+
+def test_offline_table_matches_scraped_table(stub_server, tmp_path):
+    index = GroupIndex(str(tmp_path / "index.sqlite"))
+    set_group_index(index)
+    scraped = main.get_common_supergroups_of_two_spacegroups(*FIXTURE_QUERY, depth=new_scrape_method.DEPTH_TABLE)
+    spg_1, _, spg_2, _, _ = FIXTURE_QUERY
+    index.mark_crawled(spg_1, 16)
+    index.mark_crawled(spg_2, 16)
+    clear_memos()
+    n_requests = stub_server.n_requests
+    offline = main.get_common_supergroups_of_two_spacegroups(*FIXTURE_QUERY, offline=True, depth=new_scrape_method.DEPTH_TABLE)
+    assert stub_server.n_requests == n_requests
+    assert offline == [entry for entry in scraped if int(entry['ik1']) <= FIXTURE_QUERY[4] and int(entry['ik2']) <= FIXTURE_QUERY[4]]
+
+
+@pytest.mark.parametrize("scrape", [main.get_common_supergroups_of_two_spacegroups,
+                                    new_scrape_method.get_common_supergroups_of_two_spacegroups])
+def test_offline_queries_stay_offline(stub_server, tmp_path, scrape):
+    index = GroupIndex(str(tmp_path / "index.sqlite"))
+    set_group_index(index)
+    scraped = scrape(*FIXTURE_QUERY, depth=new_scrape_method.DEPTH_TABLE)
+    spg_1, _, spg_2, _, _ = FIXTURE_QUERY
+    index.mark_crawled(spg_1, 16)
+    index.mark_crawled(spg_2, 16)
+    clear_memos()
+    n_requests = stub_server.n_requests
+    offline = scrape(*FIXTURE_QUERY, offline=True)
+    assert stub_server.n_requests == n_requests
+    assert offline and all(key not in entry for entry in offline for key in INFO_KEYS)
+    # A depth given explicitly fetches the pages missing from the index
+    scrape(*FIXTURE_QUERY, offline=True, depth=new_scrape_method.DEPTH_SUPERGROUP_INFO)
+    assert stub_server.n_requests > n_requests
@@ -0,0 +1,126 @@
+import threading
+import time
+
+import pytest
+from selenium.common.exceptions import WebDriverException
+
+from driver_pool import DriverPool
+
+
+class FakeDriver:
+    """
+    Stands in for a Chrome WebDriver: answers the health check until it is made unresponsive.
+    """
+
+    def __init__(self, number):
+        self.number = number
+        self.responsive = True
+        self.quit_called = False
+
+    def execute_script(self, script, *args):
+        if not self.responsive:
+            raise WebDriverException("chrome not reachable")
+        return 1
+
+    def quit(self):
+        self.quit_called = True
+
+
+class FakeFactory:
+    def __init__(self, fail=False):
+        self.drivers = []
+        self.fail = fail
+
+    def __call__(self):
+        if self.fail:
+            raise WebDriverException("cannot start chrome")
+        self.drivers.append(FakeDriver(len(self.drivers)))
+        return self.drivers[-1]
+
+
+def test_drivers_are_reused_between_leases():
+    factory = FakeFactory()
+    pool = DriverPool(size=2, factory=factory)
+    for _ in range(3):
+        with pool.lease() as driver:
+            assert driver is factory.drivers[0]
+    assert pool.stats() == {"size": 2, "alive": 1, "idle": 1, "leased": 0}
+
+
+def test_pool_starts_up_to_size_drivers():
+    factory = FakeFactory()
+    pool = DriverPool(size=2, factory=factory)
+    first, second = pool.acquire(), pool.acquire()
+    assert first is not second and len(factory.drivers) == 2
+    with pytest.raises(TimeoutError):
+        pool.acquire(timeout=0.05)
+    pool.release(first)
+    assert pool.acquire(timeout=0.05) is first
+
+
+def test_waiting_lease_gets_the_released_driver():
+    pool = DriverPool(size=1, factory=FakeFactory())
+    driver = pool.acquire()
+    leased = []
+    thread = threading.Thread(target=lambda: leased.append(pool.acquire(timeout=5)))
+    thread.start()
+    time.sleep(0.05)
+    assert not leased
+    pool.release(driver)
+    thread.join()
+    assert leased == [driver]
+
+
+def test_drivers_are_recycled_after_max_uses():
+    factory = FakeFactory()
+    pool = DriverPool(size=1, max_uses=2, factory=factory)
+    for _ in range(3):
+        with pool.lease():
+            pass
+    assert len(factory.drivers) == 2
+    assert factory.drivers[0].quit_called and not factory.drivers[1].quit_called
+
+
+def test_unresponsive_driver_is_replaced():
+    factory = FakeFactory()
+    pool = DriverPool(size=1, factory=factory)
+    with pool.lease() as driver:
+        pass
+    driver.responsive = False
+    with pool.lease() as replacement:
+        assert replacement is factory.drivers[1]
+    assert driver.quit_called
+    assert pool.stats()["alive"] == 1
+
+
+def test_driver_failing_a_lease_is_replaced():
+    factory = FakeFactory()
+    pool = DriverPool(size=1, factory=factory)
+    with pytest.raises(WebDriverException):
+        with pool.lease():
+            raise WebDriverException("tab crashed")
+    assert factory.drivers[0].quit_called
+    with pool.lease() as driver:
+        assert driver is factory.drivers[1]
+
+
+def test_failed_start_frees_its_slot():
+    factory = FakeFactory(fail=True)
+    pool = DriverPool(size=1, factory=factory)
+    with pytest.raises(WebDriverException):
+        pool.acquire()
+    factory.fail = False
+    assert pool.acquire(timeout=0.05) is factory.drivers[0]
+
+
+def test_close_quits_idle_drivers_then_leased_ones():
+    factory = FakeFactory()
+    pool = DriverPool(size=2, factory=factory)
+    idle, leased = pool.acquire(), pool.acquire()
+    pool.release(idle)
+    pool.close()
+    assert idle.quit_called and not leased.quit_called
+    pool.release(leased)
+    assert leased.quit_called
+    with pytest.raises(RuntimeError, match="closed"):
+        pool.acquire()
@@ -0,0 +1,38 @@
+from urllib.parse import urlsplit
+
+import pytest
+from bs4 import BeautifulSoup
+
+import fetch
+import main
+import new_scrape_method
+from benchmark import FIXTURE_QUERY, load_fixture
+
+
+def test_form_data_has_the_fields_of_the_commonsuper_form():
+    form = BeautifulSoup(load_fixture("target_webpage.html"), "html.parser").find("form")
+    url, fields = new_scrape_method.get_form_request(form, fetch.absolute_url(fetch.COMMONSUPER_FORM_PATH))
+    assert urlsplit(url).path == fetch.COMMONSUPER_PATH
+    assert fields is not None and sorted(fetch.common_supergroup_form_data(*FIXTURE_QUERY)) == sorted(fields)
+
+
+@pytest.mark.parametrize("module", [main, new_scrape_method])
+def test_query_posts_the_form_once(stub_server, module):
+    rows = module.get_common_supergroups_of_two_spacegroups(*FIXTURE_QUERY, depth=new_scrape_method.DEPTH_TABLE)
+    assert stub_server.requests == [("POST", fetch.COMMONSUPER_PATH, {
+        "client": "commonsuper", "G1": "213", "ZG1": "2", "G2": "214", "ZG2": "2", "maxik": "2", "submit": "Show supergroups"})]
+    assert rows == new_scrape_method.parse_supergroup_table(load_fixture("supergroup_webpage.html"),
+                                                            base_url=fetch.absolute_url(fetch.COMMONSUPER_PATH))
+
+
+def test_table_links_are_absolute():
+    rows = new_scrape_method.parse_supergroup_table(load_fixture("supergroup_webpage.html"),
+                                                    base_url="https://www.cryst.ehu.es/cgi-bin/cryst/programs/paths/nph-commonsuper")
+    assert len(rows) == 6
+    assert rows[0]["ITA"] == "230" and (rows[0]["i1"], rows[0]["ik1"], rows[0]["i2"], rows[0]["ik2"]) == ("4", "2", "2", "1")
+    assert rows[0]["G > H1"] == ("https://www.cryst.ehu.es/cgi-bin/cryst/programs/nph-show_all_super"
+                                 "?super=230&sub=213&ind=4&super_nor=en&subgr_nor=en")
+
+
+def test_page_without_table_has_no_rows():
+    assert new_scrape_method.parse_supergroup_table("<html><body>No common supergroups</body></html>") == []
@@ -0,0 +1,56 @@
+from bs4 import BeautifulSoup
+
+import fetch
+import main
+import new_scrape_method
+from benchmark import POSITION_SPLITTING_PATH, synthetic_wyckoff_splitting_page
+
+WYCKOFF_PATH = "/cgi-bin/cryst/programs/nph-allwpsplit"
+WYCKOFF_URL = "https://www.cryst.ehu.es/cgi-bin/cryst/programs/nph-allwpsplit?super=230&sub=213"
+
+
+def test_fields_are_those_a_browser_sends():
+    controls = [
+        ("input", "super", "hidden", "230", False),
+        ("input", "what", "radio", "a", False),
+        ("input", "what", "radio", "b", True),
+        ("input", "box", "checkbox", "on", False),
+        ("select", "maxik", None, "4", False),
+        ("textarea", "notes", None, "text", False),
+        ("input", "reset", "reset", "Reset", False),
+        ("input", None, "text", "no name", False),
+        ("input", "submit", "submit", "Relations", False),
+        ("input", "other", "submit", "Other", False),
+    ]
+    assert new_scrape_method.collect_form_fields(controls) == {
+        "super": "230", "what": "b", "maxik": "4", "notes": "text", "submit": "Relations"}
+
+
+def test_get_form_puts_fields_in_the_query_string():
+    form = BeautifulSoup('<form action="nph-wp?x=1"><input name="super" value="230"><input name="sub" value="213"></form>',
+                         "html.parser").form
+    assert new_scrape_method.get_form_request(form, WYCKOFF_URL) == (
+        "https://www.cryst.ehu.es/cgi-bin/cryst/programs/nph-wp?super=230&sub=213", None)
+
+
+def test_position_splitting_forms_are_read_from_the_page():
+    rows = new_scrape_method.parse_wyckoff_splitting_info(synthetic_wyckoff_splitting_page(3), webpage=WYCKOFF_URL)
+    assert [(row["Wyckoff position splitting url"], row["Wyckoff position splitting form"]) for row in rows] == [
+        ("https://www.cryst.ehu.es" + POSITION_SPLITTING_PATH, {"super": "230", "sub": "213", "wp": str(wp)}) for wp in (1, 2, 3)]
+    assert all(row["Wyckoff Position Splitting Info"] is None for row in rows)
+
+
+def test_browser_and_html_forms_agree():
+    form = BeautifulSoup(synthetic_wyckoff_splitting_page(1), "html.parser").form
+    controls = [[element.name, element.get("name"), element.get("type"), element.get("value"), False]
+                for element in form.find_all("input")]
+    browser_form = {"action": form["action"], "method": form["method"], "controls": controls}
+    assert main.get_form_request(browser_form, WYCKOFF_URL) == new_scrape_method.get_form_request(form, WYCKOFF_URL)
+
+
+def test_every_form_is_submitted_directly(stub_server):
+    rows = new_scrape_method.get_wyckoff_splitting_info(fetch.absolute_url(WYCKOFF_PATH + "?super=230&sub=213"))
+    submitted = sorted((request[2]["wp"], request[:2]) for request in stub_server.requests if request[1] == POSITION_SPLITTING_PATH)
+    assert submitted == [(str(wp), ("POST", POSITION_SPLITTING_PATH)) for wp in range(1, 9)]
+    assert stub_server.n_requests == 9
+    assert all(row["Wyckoff Position Splitting Info"][0]["subgroup_name"] == "4a" for row in rows)
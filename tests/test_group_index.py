@@ -0,0 +1,84 @@
+import os
+import sqlite3
+
+import pytest
+
+import new_scrape_method
+from group_index import GroupIndex, solve_common_supergroups
+
+TABLE_PAGE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "supergroup_webpage.html")
+
+
+@pytest.fixture
+def table():
+    with open(TABLE_PAGE, "rb") as file:
+        return new_scrape_method.parse_supergroup_table(file.read())
+
+
+@pytest.fixture
+def index(tmp_path, table):
+    index = GroupIndex(str(tmp_path / "index.sqlite"))
+    index.record_supergroup_table(213, 2, 214, 2, table)
+    return index
+
+
+def test_solver_needs_crawled_groups(index):
+    with pytest.raises(LookupError):
+        solve_common_supergroups(213, 2, 214, 2, 16, index=index)
+
+
+def test_solver_reproduces_scraped_table(index, table):
+    index.mark_crawled(213, 16)
+    index.mark_crawled(214, 16)
+    assert solve_common_supergroups(213, 2, 214, 2, 16, index=index) == table
+
+
+@pytest.mark.parametrize("k_index", [1, 2, 4, 8])
+def test_solver_bounds_k_index(index, table, k_index):
+    index.mark_crawled(213, 16)
+    index.mark_crawled(214, 16)
+    rows = solve_common_supergroups(213, 2, 214, 2, k_index, index=index)
+    expected = [entry for entry in table if int(entry['ik1']) <= k_index and int(entry['ik2']) <= k_index]
+    assert [(entry['ITA'], entry['i1'], entry['i2']) for entry in rows] == [
+        (entry['ITA'], entry['i1'], entry['i2']) for entry in expected]
+    assert [entry['N'] for entry in rows] == [str(n) for n in range(1, len(rows) + 1)]
+
+
+def test_relations_with_the_same_index_are_kept(tmp_path):
+    index = GroupIndex(str(tmp_path / "index.sqlite"))
+    # G = 221 has two relations of index 2 with H1 = 200 and with H2 = 215, with different Z ratios
+    rows = [
+        {'N': '1', 'HM Symbol': 'Pm-3m', 'PG': 'm-3m', 'ZG': '1', 'ITA': '221', 'i1': '2', 'it1': '2', 'ik1': '1',
+         'i2': '2', 'it2': '2', 'ik2': '1', 'G > H1': 'https://example.org/a', 'G > H2': 'https://example.org/c'},
+        {'N': '2', 'HM Symbol': 'Pm-3m', 'PG': 'm-3m', 'ZG': '2', 'ITA': '221', 'i1': '2', 'it1': '1', 'ik1': '2',
+         'i2': '2', 'it2': '2', 'ik2': '1', 'G > H1': 'https://example.org/b', 'G > H2': 'https://example.org/c'},
+    ]
+    index.record_supergroup_table(200, 1, 215, 1, rows)
+    assert [(relation["it"], relation["ik"], relation["url"]) for relation in index.supergroups_of(200)] == [
+        (1, 2, "https://example.org/b"), (2, 1, "https://example.org/a")]
+    index.mark_crawled(200, 2)
+    index.mark_crawled(215, 2)
+    solved = solve_common_supergroups(200, 1, 215, 1, 2, index=index)
+    assert [(row['ZG'], row['it1'], row['G > H1']) for row in solved] == [
+        ('2', '1', 'https://example.org/b'), ('1', '2', 'https://example.org/a')]
+
+
+def test_old_relations_table_is_migrated(tmp_path):
+    path = str(tmp_path / "index.sqlite")
+    connection = sqlite3.connect(path)
+    connection.execute("CREATE TABLE relations (super INTEGER NOT NULL, sub INTEGER NOT NULL, ind INTEGER NOT NULL,"
+                       " it INTEGER NOT NULL, ik INTEGER NOT NULL, z_ratio TEXT NOT NULL, url TEXT,"
+                       " PRIMARY KEY (super, sub, ind))")
+    connection.execute("INSERT INTO relations VALUES (221, 200, 2, 2, 1, '1', NULL)")
+    connection.execute("CREATE TABLE crawled_groups (sub INTEGER PRIMARY KEY, k_index INTEGER NOT NULL, updated_at REAL NOT NULL)")
+    connection.execute("INSERT INTO crawled_groups VALUES (200, 2, 0)")
+    connection.commit()
+    connection.close()
+
+    index = GroupIndex(path)
+    assert index.supergroups_of(200) == [{"super": 221, "ind": 2, "it": 2, "ik": 1, "z_ratio": 1, "url": None}]
+    # Relations may have been lost, so the group is crawled again
+    assert index.crawled_k_index(200) is None
+    index.record_supergroup_table(200, 1, 200, 1, [
+        {'ZG': '2', 'ITA': '221', 'i1': '2', 'it1': '1', 'ik1': '2', 'i2': '2', 'it2': '1', 'ik2': '2'}])
+    assert index.stats()["relations"] == 2
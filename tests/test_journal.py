@@ -0,0 +1,27 @@
+import pickle
+
+from journal import Journal
+
+PAIRS = [(213, 2, 214, 2, 2), (144, 1, 145, 1, 3), (1, 1, 2, 1, 2)]
+
+
+def test_completed_results_are_read_one_at_a_time(tmp_path, monkeypatch):
+    journal = Journal(str(tmp_path / "journal.sqlite"))
+    for i, pair in enumerate(PAIRS):
+        journal.record_pair(pair, [{"N": str(i)}])
+    journal.record_failure((3, 1, 4, 1, 2), RuntimeError("server down"))
+
+    n_loaded = []
+    loads = pickle.loads
+    monkeypatch.setattr(pickle, "loads", lambda data: n_loaded.append(1) or loads(data))
+    results = journal.completed_results()
+    assert next(results) == (PAIRS[0], [{"N": "0"}])
+    assert len(n_loaded) == 1
+    # The journal can be written to while its results are read
+    journal.mark_stale(PAIRS[1])
+    assert dict(results) == {PAIRS[1]: [{"N": "1"}], PAIRS[2]: [{"N": "2"}]}
+    assert dict(journal.completed_results()) == {PAIRS[0]: [{"N": "0"}], PAIRS[2]: [{"N": "2"}]}
+
+
+def test_new_journal_has_no_results(tmp_path):
+    assert list(Journal(str(tmp_path / "journal.sqlite")).completed_results()) == []
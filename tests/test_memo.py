@@ -0,0 +1,52 @@
+import main
+from benchmark import FIXTURE_QUERY
+from journal import Journal
+from memo import MemoCache, clear_memos, memo_stats, set_persistent_store
+from new_scrape_method import get_supergroup_info
+
+SUPERGROUP_URL = "/cgi-bin/cryst/programs/nph-show_all_super?super=230&sub=213&ind=4&super_nor=en&subgr_nor=en"
+
+
+def _counts(name):
+    stats = memo_stats()[name]
+    return stats["hits"], stats["store_hits"], stats["misses"]
+
+
+def test_each_page_is_parsed_once_per_url(stub_server):
+    main.get_common_supergroups_of_two_spacegroups(*FIXTURE_QUERY)
+    # 12 distinct supergroup pages, all linking to the same Wyckoff splitting page
+    assert _counts("supergroup_info") == (0, 0, 12)
+    assert _counts("wyckoff_splitting_info") == (11, 0, 1)
+    main.get_common_supergroups_of_two_spacegroups(*FIXTURE_QUERY)
+    assert _counts("supergroup_info") == (12, 0, 12)
+    # Only the table is fetched again
+    assert stub_server.n_requests == 23
+
+
+def test_equivalent_urls_share_an_entry(stub_server):
+    url = stub_server.url + SUPERGROUP_URL
+    result = get_supergroup_info(url)
+    reordered = url.replace("super=230&sub=213&ind=4", "ind=4&sub=213&super=230").replace("http://", "HTTP://") + "#rows"
+    assert get_supergroup_info(reordered) is result
+    assert _counts("supergroup_info") == (1, 0, 1)
+
+
+def test_least_recently_used_results_are_dropped():
+    memo = MemoCache("test", maxsize=2)
+    memo.set("a", 1)
+    memo.set("b", 2)
+    memo.get("a")
+    memo.set("c", 3)
+    assert memo.get("b") is None and memo.get("a") == 1 and memo.get("c") == 3
+    assert memo.stats() == {"hits": 3, "store_hits": 0, "misses": 1, "size": 2, "maxsize": 2}
+
+
+def test_results_are_read_back_from_the_journal(stub_server, tmp_path):
+    set_persistent_store(Journal(str(tmp_path / "journal.sqlite")))
+    url = stub_server.url + SUPERGROUP_URL
+    result = get_supergroup_info(url)
+    clear_memos()
+    n_requests = stub_server.n_requests
+    assert get_supergroup_info(url)[0]["Supergroup number"] == result[0]["Supergroup number"]
+    assert stub_server.n_requests == n_requests
+    assert _counts("supergroup_info") == (0, 1, 0)
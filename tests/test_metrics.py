@@ -0,0 +1,122 @@
+import json
+import logging
+import urllib.error
+import urllib.request
+
+import pytest
+
+import main
+import metrics
+from benchmark import FIXTURE_QUERY
+from metrics import FETCH_BYTES, FETCH_SECONDS, PARSE_SECONDS, STAGE_SECONDS
+
+
+@pytest.fixture(autouse=True)
+def cleared_metrics():
+    metrics.clear_metrics()
+    yield
+    metrics.clear_metrics()
+
+
+@pytest.fixture
+def histogram():
+    histogram = metrics.Histogram("test_seconds", "Test histogram", ("stage",), buckets=(0.1, 1.0))
+    yield histogram
+    metrics._METRICS.remove(histogram)
+
+
+@pytest.fixture
+def events():
+    records = []
+    handler = logging.Handler()
+    handler.emit = lambda record: records.append(json.loads(record.getMessage()))
+    previous_level = metrics.logger.level
+    metrics.logger.addHandler(handler)
+    metrics.logger.setLevel(logging.INFO)
+    yield records
+    metrics.logger.removeHandler(handler)
+    metrics.logger.setLevel(previous_level)
+
+
+def test_histogram_buckets_are_cumulative(histogram):
+    for value in (0.05, 0.5, 5.0):
+        histogram.observe(value, stage="a")
+    histogram.observe(0.5, stage="b")
+    assert histogram.samples()[:5] == [
+        ("test_seconds_bucket", {"stage": "a", "le": "0.1"}, 1),
+        ("test_seconds_bucket", {"stage": "a", "le": "1.0"}, 2),
+        ("test_seconds_bucket", {"stage": "a", "le": "+Inf"}, 3),
+        ("test_seconds_sum", {"stage": "a"}, 5.55),
+        ("test_seconds_count", {"stage": "a"}, 3),
+    ]
+    assert histogram.total() == pytest.approx(6.05)
+
+
+def test_query_is_recorded(stub_server):
+    main.get_common_supergroups_of_two_spacegroups(*FIXTURE_QUERY)
+    breakdown = metrics.time_breakdown()
+    assert breakdown["requests"] == stub_server.n_requests == 22
+    assert breakdown["retries"] == 0
+    assert breakdown["network_seconds"] > 0 and breakdown["parse_seconds"] > 0
+    assert FETCH_BYTES.total() > 0
+    methods = {labels["method"]: value for name, labels, value in FETCH_SECONDS.samples() if name.endswith("_count")}
+    assert methods == {"GET": 13, "POST": 9}
+    stages = {labels["stage"]: value for name, labels, value in STAGE_SECONDS.samples() if name.endswith("_count")}
+    # supergroup_info is memoized, so each of the 12 pages is parsed once
+    assert stages["supergroup_table"] == 1 and stages["supergroup_info"] == 12
+    parsers = {labels["parser"] for name, labels, _ in PARSE_SECONDS.samples()}
+    assert {"supergroup_table", "supergroup_info", "wyckoff_splitting_info"} <= parsers
+
+
+def test_stages_are_logged(events):
+    with metrics.stage("outer", url="https://example.org"):
+        pass
+    with pytest.raises(KeyError):
+        with metrics.stage("failing"):
+            raise KeyError("x")
+    assert [(event["event"], event["stage"], event["error"]) for event in events] == [
+        ("stage", "outer", None), ("stage", "failing", "KeyError('x')")]
+    assert events[0]["url"] == "https://example.org"
+    assert {labels["stage"] for _, labels, _ in STAGE_SECONDS.samples()} == {"outer", "failing"}
+
+
+def test_prometheus_text_format(histogram):
+    histogram.observe(0.5, stage='quoted "name"\n')
+    text = metrics.render_prometheus()
+    assert text.endswith("\n")
+    assert "# HELP test_seconds Test histogram\n# TYPE test_seconds histogram\n" in text
+    assert 'test_seconds_bucket{stage="quoted \\"name\\"\\n",le="1.0"} 1\n' in text
+    assert 'test_seconds_count{stage="quoted \\"name\\"\\n"} 1\n' in text
+    for name in ("bilbao_memo_entries", "bilbao_throttle_rate", "bilbao_circuit_open"):
+        assert f"# TYPE {name} gauge\n" in text
+    for line in text.splitlines():
+        assert line.startswith("# ") or len(line.rsplit(" ", 1)) == 2
+
+
+def test_memo_gauges_follow_the_query(stub_server):
+    main.get_common_supergroups_of_two_spacegroups(*FIXTURE_QUERY)
+    text = metrics.render_prometheus()
+    assert 'bilbao_memo_entries{memo="supergroup_info"} 12\n' in text
+    assert 'bilbao_memo_hits{memo="wyckoff_splitting_info"} 11\n' in text
+    assert f'bilbao_circuit_open{{host="{stub_server.url.split("//")[1]}"}} 0\n' in text
+
+
+def test_prometheus_file_and_endpoint(tmp_path, histogram):
+    histogram.observe(0.5, stage="a")
+    path = tmp_path / "bilbao.prom"
+    metrics.write_prometheus(str(path))
+    assert path.read_text() == metrics.render_prometheus()
+    assert [file.name for file in tmp_path.iterdir()] == ["bilbao.prom"]
+
+    server = metrics.start_metrics_server(0, host="127.0.0.1")
+    try:
+        base_url = f"http://127.0.0.1:{server.server_address[1]}"
+        with urllib.request.urlopen(base_url + "/metrics") as response:
+            assert response.headers["Content-Type"].startswith("text/plain; version=0.0.4")
+            assert 'test_seconds_count{stage="a"} 1' in response.read().decode("utf-8")
+        with pytest.raises(urllib.error.HTTPError) as error:
+            urllib.request.urlopen(base_url + "/other")
+        assert error.value.code == 404
+    finally:
+        server.shutdown()
+        server.server_close()
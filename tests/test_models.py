@@ -0,0 +1,70 @@
+import gc
+
+import numpy as np
+import pytest
+
+import main
+import models
+import symmetry
+from benchmark import FIXTURE_QUERY
+
+
+def test_shared_arrays_are_reused_then_forgotten():
+    matrix = np.arange(9, dtype=float).reshape(3, 3) + 1000
+    first = models.shared_array(matrix)
+    second = models.shared_array(matrix.copy())
+    assert first is second
+    assert not first.flags.writeable
+    n_arrays = models.shared_array_count()
+
+    del first, second
+    gc.collect()
+    assert models.shared_array_count() == n_arrays - 1
+
+
+def test_affine_operations_are_exact():
+    numerators, denominators, valid = symmetry.parse_affine_operations(
+        ["(-y+1/4,  -x+3/4,  z+3/4  )", "(x,y,z,)", "(x-y, 1/3, -z+1/6)", "(-y+1/4,  -x+3/4,  z+3/4  )"])
+    assert numerators[0].tolist() == [[0, -4, 0, 1], [-4, 0, 0, 3], [0, 0, 4, 3]] and denominators[0] == 4
+    assert numerators[1].tolist() == [[1, 0, 0, 0], [0, 1, 0, 0], [0, 0, 1, 0]] and denominators[1] == 1
+    assert numerators[2].tolist() == [[6, -6, 0, 0], [0, 0, 0, 2], [0, 0, -6, 1]] and denominators[2] == 6
+    assert (numerators[3] == numerators[0]).all() and valid.all()
+
+
+@pytest.mark.parametrize("text", ["(x,y)", "(x,y,w)", "(x,,z)", "(x,y,1/)"])
+def test_invalid_triplets_are_rejected_or_masked(text):
+    with pytest.raises(ValueError):
+        symmetry.parse_affine_operations([text])
+    numerators, denominators, valid = symmetry.parse_affine_operations(["(x,y,z)", text], strict=False)
+    assert valid.tolist() == [True, False]
+    assert not numerators[1].any() and denominators[1] == 1
+
+
+def test_affine_operations_rows():
+    operations = symmetry.AffineOperations.from_texts([["(x,y,z)", "(-x,-y,-z)"], None, ["(x+1/2,y+1/2,z+1/2)", "(x,?,z)"]])
+    assert len(operations) == 3
+    assert operations.row_indices().tolist() == [0, 0, 2, 2]
+    assert operations.valid_rows().tolist() == [True, True, False]
+    assert operations.to_float()[2, :, 3].tolist() == [0.5, 0.5, 0.5]
+    assert [len(denominators) for _, denominators in operations] == [2, 0, 2]
+
+
+def test_compact_results_encode_operations(stub_server):
+    result = main.get_common_supergroups_of_two_spacegroups(*FIXTURE_QUERY)
+    supergroup = result[0]['G > H1 Supergroup Info'][0]
+    supergroup["Coset representatives"] = supergroup["Coset representatives"] + ["(x, y, not a coordinate)"]
+    compact = models.compact_results(result)
+
+    encoded = models.encode_operations(compact)
+    broken = compact[0].supergroups_h1[0]
+    # The row with an odd cell keeps its strings, the others are encoded
+    assert broken.coset_operations is None and broken.coset_representatives[-1] == "(x, y, not a coordinate)"
+    assert encoded["coset_representatives"].valid_rows().tolist() == [
+        supergroup is not broken for supergroup in encoded["supergroups"]]
+    other = compact[0].supergroups_h2[0]
+    numerators, denominators = other.coset_operations
+    assert len(numerators) == len(other.coset_representatives)
+    assert (numerators[2] / denominators[2]).tolist() == [[0, -1, 0, 0.25], [-1, 0, 0, 0.75], [0, 0, 1, 0.75]]
+    splitting = other.wyckoff_splittings[0].position_splittings[0]
+    assert splitting.representative == "(x+1/2,y,z)"
+    assert splitting.operations[0][2].tolist() == [[2, 0, 0, 1], [0, 2, 0, 0], [0, 0, 2, 0]]
@@ -0,0 +1,21 @@
+import pytest
+
+import benchmark
+import lxml_parsers
+import new_scrape_method
+
+
+def test_parser_backends_agree_on_saved_pages():
+    assert lxml_parsers.check_parser_parity() == []
+
+
+@pytest.mark.parametrize("path, name", [
+    ("/cgi-bin/cryst/programs/nph-allwpsplit", "parse_wyckoff_splitting_info"),
+    (benchmark.POSITION_SPLITTING_PATH, "parse_wyckoff_position_splitting_info"),
+])
+def test_parser_backends_agree_on_synthetic_pages(path, name):
+    html = benchmark.build_pages(n_rows=50)[path]
+    bs4_result = getattr(new_scrape_method, name + "_bs4")(html, "https://www.cryst.ehu.es/")
+    lxml_result = getattr(lxml_parsers, name)(html, "https://www.cryst.ehu.es/")
+    assert bs4_result
+    assert lxml_parsers.results_equal(bs4_result, lxml_result)
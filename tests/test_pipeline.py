@@ -0,0 +1,33 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import lxml_parsers
+import main
+import pipeline
+from benchmark import FIXTURE_QUERY, StubServer, build_pages
+from memo import clear_memos
+from metrics import PARSE_SECONDS
+
+
+def test_pipeline_matches_sequential_scraper(stub_server):
+    expected = main.get_common_supergroups_of_two_spacegroups(*FIXTURE_QUERY)
+    n_requests = stub_server.n_requests
+    clear_memos()
+    parse_seconds = PARSE_SECONDS.total()
+
+    with pipeline.Pipeline(parse_workers=2) as crawler:
+        assert crawler._parsers._mp_context.get_start_method() == pipeline.START_METHOD
+        result = crawler.crawl(*FIXTURE_QUERY)
+
+    assert lxml_parsers.results_equal(expected, result)
+    assert stub_server.n_requests - n_requests == n_requests
+    # The parse times measured in the parse processes are recorded here
+    assert PARSE_SECONDS.total() > parse_seconds
+
+
+def test_concurrent_crawls_fetch_each_page_once():
+    with StubServer(build_pages(), latency=0.02) as server, pipeline.Pipeline(parse_workers=2) as crawler:
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            results = list(executor.map(lambda _: crawler.crawl(*FIXTURE_QUERY), range(3)))
+        assert server.n_requests == 22
+        assert crawler._in_flight == {}
+    assert all(lxml_parsers.results_equal(result, results[0]) for result in results[1:])
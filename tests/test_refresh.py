@@ -0,0 +1,90 @@
+import threading
+import time
+
+import pytest
+
+import batch
+import fetch
+import refresh
+from benchmark import FIXTURE_QUERY
+from cache import ResponseCache
+from group_index import GroupIndex, set_group_index
+from journal import Journal
+from memo import clear_memos
+
+WYCKOFF_PATH = "/cgi-bin/cryst/programs/nph-allwpsplit"
+SUPERGROUP_PATH = "/cgi-bin/cryst/programs/nph-show_all_super"
+
+
+@pytest.fixture
+def crawled(stub_server, tmp_path):
+    fetch.set_cache(ResponseCache(str(tmp_path / "cache.sqlite")))
+    journal = Journal(str(tmp_path / "journal.sqlite"))
+    index = GroupIndex(str(tmp_path / "index.sqlite"))
+    set_group_index(index)
+    assert [error for _, _, error in batch.run_batch([FIXTURE_QUERY], workers=1, journal=journal)] == [None]
+    clear_memos()
+    return journal, index
+
+
+def test_unchanged_pages_are_not_parsed_again(crawled):
+    journal, index = crawled
+    summary = refresh.refresh(journal=journal, index=index)
+    assert summary["checked_requests"] == 22
+    assert summary["changed_pages"] == [] and summary["stale_pairs"] == []
+
+
+def test_changed_page_marks_its_queries_stale(crawled, stub_server):
+    journal, index = crawled
+    stub_server.pages[WYCKOFF_PATH] = stub_server.pages[WYCKOFF_PATH].replace(b"</body>", b"<!-- v2 --></body>")
+    summary = refresh.refresh(journal=journal, index=index)
+    # The Wyckoff splitting page and the 12 supergroup pages linking to it
+    assert len(summary["changed_pages"]) == 13
+    assert summary["stale_pairs"] == [FIXTURE_QUERY]
+    assert not journal.completed_pairs()
+    assert refresh.refresh(journal=journal, index=index)["changed_pages"] == []
+
+
+def test_pages_are_revalidated_concurrently(crawled, monkeypatch):
+    journal, index = crawled
+    lock = threading.Lock()
+    in_flight = []
+    most_in_flight = []
+
+    def revalidate_page(url, data=None, verbose=False):
+        if SUPERGROUP_PATH not in url:
+            return False
+        with lock:
+            in_flight.append(url)
+            most_in_flight.append(len(in_flight))
+        time.sleep(0.02)
+        with lock:
+            in_flight.remove(url)
+        return False
+
+    monkeypatch.setattr(refresh, "revalidate_page", revalidate_page)
+    refresh.refresh(journal=journal, index=index, workers=4)
+    # The supergroup pages have a single request each, so this only holds if pages are revalidated together
+    assert len(most_in_flight) == 12
+    assert max(most_in_flight) == 4
+
+
+def test_derived_queries_revalidate_the_query_they_came_from(stub_server, tmp_path):
+    fetch.set_cache(ResponseCache(str(tmp_path / "cache.sqlite")))
+    journal = Journal(str(tmp_path / "journal.sqlite"))
+    spg_1, z_1, spg_2, z_2, k_index = FIXTURE_QUERY
+    pairs = [(spg_2, z_2, spg_1, z_1, k_index), (spg_1, z_1, spg_2, z_2, k_index - 1), FIXTURE_QUERY]
+    assert [error for _, _, error in batch.run_batch(pairs, workers=1, journal=journal)] == [None] * 3
+    clear_memos()
+
+    for _ in range(2):
+        del stub_server.requests[:]
+        summary = refresh.refresh(journal=journal)
+        assert summary["stale_pairs"] == []
+        # The table of the canonical query only, which the other two were derived from
+        assert [request[2] for request in stub_server.requests if request[1] == fetch.COMMONSUPER_PATH] == [
+            fetch.common_supergroup_form_data(*FIXTURE_QUERY)]
+    assert len(journal.completed_pairs()) == 3
+
+    stub_server.pages[fetch.COMMONSUPER_PATH] += b"<!-- v2 -->"
+    assert sorted(refresh.refresh(journal=journal)["stale_pairs"]) == sorted(pairs)
@@ -0,0 +1,109 @@
+from urllib.parse import urljoin, urlsplit
+
+import pytest
+from bs4 import BeautifulSoup
+
+import fetch
+import main
+import new_scrape_method
+from benchmark import build_pages
+from lxml_parsers import results_equal
+
+SUPERGROUP_URL = "/cgi-bin/cryst/programs/nph-show_all_super?super=230&sub=213&ind=4&super_nor=en&subgr_nor=en"
+SUPERGROUP_KEYS = ("Supergroup number", "Transformation matrix", "Initial vector", "Coset representatives", "Wyckoff splitting url")
+
+
+class FakeBrowser:
+    """
+    Stands in for a Chrome WebDriver on the stub server pages. Its execute_script runs the
+    table script of main.get_table_cells on the page with BeautifulSoup, and every
+    WebDriver call is counted.
+    """
+
+    def __init__(self, pages):
+        self.pages = pages
+        self.calls = []
+        self.current_url = None
+
+    def get(self, url):
+        self.calls.append("get")
+        self.current_url = url
+
+    def execute_script(self, script, selector, direct):
+        assert script == main._TABLE_SCRIPT
+        self.calls.append("execute_script")
+        table = BeautifulSoup(self.pages[urlsplit(self.current_url).path], "html.parser").select_one(selector)
+        if table is None:
+            return None
+        if direct:
+            rows = [[cell for cell in row.find_all("td", recursive=False)] for row in new_scrape_method.get_table_rows(table)]
+        else:
+            rows = [row.find_all("td") for row in table.find_all("tr")]
+        return [[self._cell(cell) for cell in cells] for cells in rows]
+
+    def _cell(self, cell):
+        return {
+            "text": cell.get_text(),
+            "hrefs": [urljoin(self.current_url, link["href"]) for link in cell.find_all("a", href=True)],
+            "forms": [{"action": urljoin(self.current_url, form.get("action", "")), "method": form.get("method", "get"),
+                       "controls": [[control.name, control.get("name"), control.get("type", "text"), control.get("value"),
+                                     control.has_attr("checked")] for control in form.find_all(["input", "select", "textarea"])]}
+                      for form in cell.find_all("form")],
+        }
+
+    def __getattr__(self, name):
+        raise AssertionError(f"Unexpected WebDriver call {name}")
+
+
+@pytest.fixture
+def browser():
+    return FakeBrowser(build_pages())
+
+
+def test_table_is_read_in_one_call(stub_server, browser):
+    browser.get(fetch.absolute_url(fetch.COMMONSUPER_PATH))
+    rows = main.get_supergroup_table(browser, depth=new_scrape_method.DEPTH_TABLE)
+    assert browser.calls == ["get", "execute_script"]
+    assert rows == new_scrape_method.parse_supergroup_table(browser.pages[fetch.COMMONSUPER_PATH], base_url=browser.current_url)
+
+
+def test_each_page_is_read_in_one_call(stub_server, browser):
+    url = stub_server.url + SUPERGROUP_URL
+    rows = main.get_supergroup_info(url, browser)
+    # The supergroup page and its Wyckoff splitting page; the position splitting forms are posted over HTTP
+    assert browser.calls == ["get", "execute_script"] * 2
+    expected = new_scrape_method.get_supergroup_info(url)
+    assert results_equal([{key: row[key] for key in SUPERGROUP_KEYS} for row in rows],
+                         [{key: row[key] for key in SUPERGROUP_KEYS} for row in expected])
+    splitting = rows[0]["Wyckoff splitting info"]
+    assert results_equal([row["Wyckoff Position Splitting Info"] for row in splitting],
+                         [row["Wyckoff Position Splitting Info"] for row in expected[0]["Wyckoff splitting info"]])
+
+
+def test_missing_table_is_reported(stub_server, browser):
+    browser.pages["/missing"] = "<html><body></body></html>"
+    with pytest.raises(ValueError, match="Supergroup table not found"):
+        main.get_supergroup_info(stub_server.url + "/missing", browser)
+
+
+@pytest.mark.parametrize("depth, branches", [
+    (new_scrape_method.DEPTH_SUPERGROUP_INFO, ("H1",)),
+    (new_scrape_method.DEPTH_WYCKOFF_SPLITTING_INFO, ("H2",)),
+    (new_scrape_method.FULL_DEPTH, new_scrape_method.BRANCHES),
+])
+def test_depth_and_branches_match_http(stub_server, browser, depth, branches):
+    url = fetch.absolute_url(fetch.COMMONSUPER_PATH)
+    browser.get(url)
+    rows = main.get_supergroup_table(browser, depth=depth, branches=branches)
+    # The position splitting forms are only posted at full depth
+    assert stub_server.n_requests == (8 if depth == new_scrape_method.FULL_DEPTH else 0)
+    expected = new_scrape_method.expand_common_supergroups(
+        new_scrape_method.parse_supergroup_table(browser.pages[fetch.COMMONSUPER_PATH], base_url=url), depth=depth, branches=branches)
+    assert results_equal(rows, expected)
+    assert all(key in entry for entry in rows for key in
+               [f'G > {branch} Supergroup Info' for branch in branches if entry[f'G > {branch}']])
+    assert not any(f'G > {branch} Supergroup Info' in entry for entry in rows for branch in set(new_scrape_method.BRANCHES) - set(branches))
+    # Pages linked several times are read once
+    n_pages = len({main.normalize_url(entry[f'G > {branch}']) for entry in rows for branch in branches if entry[f'G > {branch}']})
+    n_pages += depth >= new_scrape_method.DEPTH_WYCKOFF_SPLITTING_INFO
+    assert browser.calls.count("get") == 1 + n_pages
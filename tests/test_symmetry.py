@@ -0,0 +1,51 @@
+from fractions import Fraction
+
+import numpy as np
+import pytest
+
+import symmetry
+
+IDENTITY = "[ 1 0 0 ] [ 0]\n[ 0 1 0 ] [ 1/2]\n[ 0 0 1 ] [ 0]"
+WITH_PARAMETERS = "[ 0 -1 0 ] [ t]\n[ 1 0 0 ] [ 2t+1/4]\n[ 0 0 1 ] [ -t-0.75]"
+
+
+@pytest.mark.parametrize("token, value", [
+    ("-1", Fraction(-1)), ("1/2", Fraction(1, 2)), ("0.25", Fraction(1, 4)),
+    ("t", Fraction(0)), ("2t+1/4", Fraction(1, 4)), ("-t-0.75", Fraction(-3, 4)),
+])
+def test_entries_are_exact(token, value):
+    assert symmetry.parse_entry(token) == value
+
+
+def test_matrices_are_parsed_in_one_batch():
+    matrices = symmetry.parse_transformation_matrices([IDENTITY, WITH_PARAMETERS, IDENTITY])
+    assert matrices.shape == (3, 3, 4)
+    assert matrices[0].tolist() == [[1, 0, 0, 0], [0, 1, 0, 0.5], [0, 0, 1, 0]]
+    assert matrices[1].tolist() == [[0, -1, 0, 0], [1, 0, 0, 0.25], [0, 0, 1, -0.75]]
+    assert (matrices[2] == matrices[0]).all()
+    transformation_matrix, initial_vector = symmetry.parse_transformation_matrix(WITH_PARAMETERS)
+    assert (transformation_matrix == matrices[1, :, :3]).all() and (initial_vector == matrices[1, :, 3]).all()
+
+
+def test_exact_matrices_share_a_denominator():
+    numerators, denominators = symmetry.parse_transformation_matrices([IDENTITY, WITH_PARAMETERS], exact=True)
+    assert denominators.tolist() == [2, 4]
+    assert numerators[1].tolist() == [[0, -4, 0, 0], [4, 0, 0, 1], [0, 0, 4, -3]]
+    assert (numerators / denominators[:, None, None] == symmetry.parse_transformation_matrices([IDENTITY, WITH_PARAMETERS])).all()
+
+
+@pytest.mark.parametrize("texts", [
+    ["[ 1 0 0 ] [ 0]\n[ 0 1 0 ] [ 0]\n[ 0 0 1 ]"],
+    [IDENTITY + " [ 0]"],
+    # 11 and 13 entries add up to two matrices, but neither is one
+    ["[ 1 0 0 ] [ 0]\n[ 0 1 0 ] [ 0]\n[ 0 0 1 ]", IDENTITY + " [ 0]"],
+])
+def test_wrong_number_of_entries_is_rejected(texts):
+    with pytest.raises(ValueError, match="12 entries"):
+        symmetry.parse_transformation_matrices(texts)
+
+
+def test_no_matrices():
+    assert symmetry.parse_transformation_matrices([]).shape == (0, 3, 4)
+    numerators, denominators = symmetry.parse_transformation_matrices([], exact=True)
+    assert numerators.shape == (0, 3, 4) and denominators.dtype == np.int64
@@ -0,0 +1,110 @@
+import time
+
+import pytest
+import requests
+
+import fetch
+from throttle import CircuitBreaker, CircuitOpenError, HostPolicy, set_host_policy
+
+URL = "http://breaker.test/page"
+RESET_TIMEOUT = 0.05
+
+
+class FakeResponse:
+    def __init__(self, status_code=200, content=b"ok"):
+        self.status_code = status_code
+        self.content = content
+        self.headers = {}
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(f"status {self.status_code}")
+
+
+class FakeSession:
+    """
+    Answers each GET with the next outcome: a response, or an exception to raise.
+    """
+
+    def __init__(self, *outcomes):
+        self.outcomes = list(outcomes)
+        self.n_requests = 0
+
+    def get(self, url, headers=None, timeout=None):
+        self.n_requests += 1
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+
+@pytest.fixture
+def policy(monkeypatch):
+    monkeypatch.setattr(fetch, "retry_delay", lambda attempt: 0)
+    policy = HostPolicy(rate=1000, burst=1000, failure_threshold=3, reset_timeout=RESET_TIMEOUT)
+    set_host_policy(URL, policy)
+    yield policy
+    set_host_policy(URL, None)
+
+
+def _open(breaker):
+    for _ in range(breaker.failure_threshold):
+        breaker.before_request("breaker.test")
+        breaker.record_failure()
+
+
+def test_breaker_opens_after_consecutive_failures():
+    breaker = CircuitBreaker(failure_threshold=3, reset_timeout=60)
+    breaker.record_failure()
+    breaker.record_success()
+    _open(breaker)
+    assert breaker.state == CircuitBreaker.OPEN
+    with pytest.raises(CircuitOpenError, match="breaker.test"):
+        breaker.before_request("breaker.test")
+
+
+def test_half_open_breaker_lets_one_trial_through():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=RESET_TIMEOUT)
+    _open(breaker)
+    time.sleep(RESET_TIMEOUT)
+    breaker.before_request("breaker.test")
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    with pytest.raises(CircuitOpenError, match="trial"):
+        breaker.before_request("breaker.test")
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    breaker.before_request("breaker.test")
+
+
+def test_failed_trial_reopens_breaker():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=RESET_TIMEOUT)
+    _open(breaker)
+    time.sleep(RESET_TIMEOUT)
+    breaker.before_request("breaker.test")
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.before_request("breaker.test")
+
+
+def test_transient_errors_are_retried(policy):
+    session = FakeSession(requests.ConnectionError("reset"), FakeResponse(503), FakeResponse(200, b"page"))
+    assert fetch.request_with_retries(session, URL).content == b"page"
+    assert session.n_requests == 3
+    assert policy.breaker.state == CircuitBreaker.CLOSED and policy.breaker.failures == 0
+
+
+def test_non_transient_error_ends_the_trial(policy):
+    _open(policy.breaker)
+    time.sleep(RESET_TIMEOUT)
+    session = FakeSession(requests.exceptions.ChunkedEncodingError("broken body"), FakeResponse(200, b"page"))
+    with pytest.raises(requests.exceptions.ChunkedEncodingError):
+        fetch.request_with_retries(session, URL)
+    # Not retried, and the failed trial reopened the circuit instead of leaving it stuck half-open
+    assert session.n_requests == 1
+    assert policy.breaker.state == CircuitBreaker.OPEN
+    with pytest.raises(CircuitOpenError, match="Circuit open for breaker.test"):
+        fetch.request_with_retries(session, URL)
+    time.sleep(RESET_TIMEOUT)
+    assert fetch.request_with_retries(session, URL).content == b"page"
+    assert policy.breaker.state == CircuitBreaker.CLOSED
@@ -0,0 +1,79 @@
+import threading
+import time
+
+import batch
+import work_queue
+from benchmark import FIXTURE_QUERY
+from journal import pair_key
+from work_queue import WorkQueue
+
+OTHER_QUERY = (144, 1, 145, 1, 3)
+PAGE = ("supergroup_info", "https://www.cryst.ehu.es/page")
+
+
+def test_threads_of_one_worker_wait_for_each_other(tmp_path):
+    queue = WorkQueue(str(tmp_path / "queue.sqlite"))
+    assert queue.claim(*PAGE) is None
+    results = []
+    thread = threading.Thread(target=lambda: results.append(queue.claim(*PAGE, poll_interval=0.01)))
+    thread.start()
+    time.sleep(0.1)
+    # The other thread holds no claim of its own, it waits for the page instead of fetching it
+    assert results == []
+    queue.save(*PAGE, ["rows"])
+    thread.join()
+    assert results == [["rows"]]
+
+
+def test_heartbeat_renews_the_leases_of_every_thread(tmp_path):
+    queue = WorkQueue(str(tmp_path / "queue.sqlite"), lease_seconds=0.2)
+    queue.add_pairs([FIXTURE_QUERY])
+    thread = threading.Thread(target=queue.claim_pair)
+    thread.start()
+    thread.join()
+    time.sleep(0.1)
+    queue.heartbeat()
+    time.sleep(0.15)
+    assert WorkQueue(queue.path).claim_pair() is None
+
+
+def test_expired_lease_is_taken_over(tmp_path):
+    dead = WorkQueue(str(tmp_path / "queue.sqlite"), lease_seconds=0.05)
+    alive = WorkQueue(dead.path)
+    dead.add_pairs([FIXTURE_QUERY])
+    assert dead.claim_pair() == FIXTURE_QUERY
+    assert alive.claim_pair() is None
+    time.sleep(0.1)
+    assert alive.claim_pair() == FIXTURE_QUERY
+
+
+def test_query_killing_its_workers_ends_failed(tmp_path, monkeypatch):
+    monkeypatch.setattr(work_queue, "MAX_ATTEMPTS", 2)
+    path = str(tmp_path / "queue.sqlite")
+    WorkQueue(path).add_pairs([FIXTURE_QUERY])
+    for _ in range(2):
+        assert WorkQueue(path, lease_seconds=0.01).claim_pair() == FIXTURE_QUERY
+        time.sleep(0.05)
+    queue = WorkQueue(path)
+    assert queue.claim_pair() is None
+    assert queue.unfinished_pairs() == 0
+    assert pair_key(FIXTURE_QUERY) in queue.failed_pairs()
+
+
+def test_failed_query_is_retried_up_to_max_attempts(tmp_path):
+    queue = WorkQueue(str(tmp_path / "queue.sqlite"))
+    queue.add_pairs([FIXTURE_QUERY])
+    for _ in range(work_queue.MAX_ATTEMPTS):
+        assert queue.claim_pair() == FIXTURE_QUERY
+        queue.fail_pair(FIXTURE_QUERY, RuntimeError("boom"))
+    assert queue.claim_pair() is None
+    assert "boom" in queue.failed_pairs()[pair_key(FIXTURE_QUERY)]
+
+
+def test_batch_threads_fetch_each_page_once(stub_server, tmp_path):
+    queue = WorkQueue(str(tmp_path / "queue.sqlite"))
+    results = list(batch.run_batch([FIXTURE_QUERY, OTHER_QUERY], workers=4, work_queue=queue))
+    assert sorted(pair for pair, _, error in results if error is None) == sorted([FIXTURE_QUERY, OTHER_QUERY])
+    # Two tables, then the 12 supergroup pages and the Wyckoff splitting page with its 8 forms once
+    assert stub_server.n_requests == 2 + 12 + 1 + 8
+    assert queue.stats()["tasks"]["pair"] == {"done": 2}
@@ -0,0 +1,333 @@
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+
+VERBOSE=False
+
+# Requests per second allowed to a host at the start, and the bounds the rate adapts within
+DEFAULT_RATE = 4.0
+MIN_RATE = 0.2
+MAX_RATE = 20.0
+# Number of requests that may be sent back to back before the rate applies
+BURST = 4
+
+# Responses slower than this (smoothed, in seconds) are taken as a sign the server is struggling
+TARGET_LATENCY = 2.0
+LATENCY_SMOOTHING = 0.2
+# Additive increase per fast response, multiplicative decrease on 429/5xx or slow responses
+RATE_INCREASE = 0.1
+RATE_DECREASE = 0.5
+# The rate is decreased at most once per this many seconds, so a burst of concurrent
+# failures only counts once
+DECREASE_COOLDOWN = 1.0
+
+# Consecutive failures that open the circuit of a host, and seconds before it is tried again
+FAILURE_THRESHOLD = 5
+RESET_TIMEOUT = 30.0
+
+# Exponential backoff between retries: BACKOFF_BASE * 2**attempt seconds with full jitter, at most BACKOFF_MAX
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 30.0
+
+_POLICIES = {}
+_POLICIES_LOCK = threading.Lock()
+
+#################################################################################################################################
+
+
+class CircuitOpenError(RuntimeError):
+    """
+    Raised instead of sending a request to a host whose circuit breaker is open.
+    """
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket: acquire() blocks until a request may be sent at the current rate.
+
+    Args:
+        rate (float): Tokens added per second.
+        burst (int): The maximum number of tokens stored.
+    """
+
+    def __init__(self, rate=DEFAULT_RATE, burst=BURST):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self):
+        """
+        Takes a token, sleeping until one is available.
+
+        Returns:
+            float: The number of seconds waited.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            # Tokens may go negative: each waiting caller reserves its own slot in the future
+            self._tokens -= 1
+            wait = max(-self._tokens / self.rate if self._tokens < 0 else 0.0, self._paused_until - now)
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    def set_rate(self, rate):
+        with self._lock:
+            self._refill(time.monotonic())
+            self.rate = rate
+
+    def pause(self, seconds):
+        """
+        Holds every request back for the given number of seconds (e.g. after a Retry-After header).
+        """
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+
+class CircuitBreaker:
+    """
+    Stops sending requests to a host after failure_threshold consecutive failures.
+
+    The circuit stays open for reset_timeout seconds; a single trial request is then let
+    through (half-open), and its outcome closes or reopens the circuit.
+
+    Args:
+        failure_threshold (int, optional): Consecutive failures that open the circuit.
+        reset_timeout (float, optional): Seconds the circuit stays open.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold=FAILURE_THRESHOLD, reset_timeout=RESET_TIMEOUT):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def before_request(self, host=""):
+        """
+        Checks that a request may be sent.
+
+        Raises:
+            CircuitOpenError: If the circuit is open, or half-open with a trial already in flight.
+        """
+        with self._lock:
+            if self.state == self.OPEN:
+                if time.monotonic() - self._opened_at < self.reset_timeout:
+                    raise CircuitOpenError(f"Circuit open for {host} after {self.failures} consecutive failures")
+                self.state = self.HALF_OPEN
+                self._trial_in_flight = False
+            if self.state == self.HALF_OPEN:
+                if self._trial_in_flight:
+                    raise CircuitOpenError(f"Circuit half-open for {host}, waiting for the trial request")
+                self._trial_in_flight = True
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._trial_in_flight = False
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                self.state = self.OPEN
+                self._opened_at = time.monotonic()
+
+
+class HostPolicy:
+    """
+    Rate limit and circuit breaker of one host.
+
+    The rate follows additive increase / multiplicative decrease: it grows by RATE_INCREASE
+    after every response faster than target_latency and is multiplied by RATE_DECREASE after a
+    429 or 5xx response, a timeout, or when the smoothed latency exceeds target_latency.
+
+    Args:
+        rate (float, optional): The initial requests per second.
+        min_rate (float, optional): The lowest rate the policy adapts down to.
+        max_rate (float, optional): The highest rate the policy adapts up to.
+        burst (int, optional): The number of requests that may be sent back to back.
+        target_latency (float, optional): The smoothed latency above which the rate is decreased.
+        failure_threshold (int, optional): Consecutive failures that open the circuit.
+        reset_timeout (float, optional): Seconds the circuit stays open.
+    """
+
+    def __init__(self, rate=DEFAULT_RATE, min_rate=MIN_RATE, max_rate=MAX_RATE, burst=BURST, target_latency=TARGET_LATENCY,
+                 failure_threshold=FAILURE_THRESHOLD, reset_timeout=RESET_TIMEOUT):
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.target_latency = target_latency
+        self.bucket = TokenBucket(rate=rate, burst=burst)
+        self.breaker = CircuitBreaker(failure_threshold=failure_threshold, reset_timeout=reset_timeout)
+        self.latency = None
+        self._last_decrease = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self, host=""):
+        """
+        Waits for the rate limit, after checking the circuit breaker.
+
+        Returns:
+            float: The number of seconds waited.
+        """
+        self.breaker.before_request(host)
+        return self.bucket.acquire()
+
+    def record_success(self, latency):
+        """
+        Records a response from the server, adapting the rate to its latency.
+
+        Args:
+            latency (float): The response time in seconds.
+        """
+        self.breaker.record_success()
+        with self._lock:
+            self.latency = latency if self.latency is None else (
+                LATENCY_SMOOTHING * latency + (1 - LATENCY_SMOOTHING) * self.latency)
+            if self.latency > self.target_latency:
+                self._decrease()
+            else:
+                self.bucket.set_rate(min(self.max_rate, self.bucket.rate + RATE_INCREASE))
+
+    def record_throttled(self, retry_after=None):
+        """
+        Records a 429 or 5xx response, or a timeout: the rate is decreased and the failure
+        counted by the circuit breaker.
+
+        Args:
+            retry_after (float, optional): Seconds the server asked to wait before the next request.
+        """
+        self.breaker.record_failure()
+        with self._lock:
+            self._decrease()
+        if retry_after:
+            self.bucket.pause(retry_after)
+
+    def record_failure(self):
+        """
+        Records a request that failed without a usable response (e.g. a broken or undecodable
+        body, or too many redirects): the failure is counted by the circuit breaker, and ends
+        its trial request, but the rate is kept.
+        """
+        self.breaker.record_failure()
+
+    def _decrease(self):
+        now = time.monotonic()
+        if now - self._last_decrease >= DECREASE_COOLDOWN:
+            self._last_decrease = now
+            self.bucket.set_rate(max(self.min_rate, self.bucket.rate * RATE_DECREASE))
+
+    def stats(self):
+        """
+        Returns the current state of the policy.
+
+        Returns:
+            dict: With the keys "rate", "latency", "circuit" and "failures".
+        """
+        return {"rate": self.bucket.rate, "latency": self.latency, "circuit": self.breaker.state,
+                "failures": self.breaker.failures}
+
+
+def host_of(url):
+    """
+    Returns the lowercased host (and port) of a URL, the key policies are stored under.
+    """
+    return urlsplit(url).netloc.lower()
+
+
+def get_host_policy(url):
+    """
+    Returns the policy of the host of a URL, creating it with the default settings on first use.
+
+    Args:
+        url (str): Any URL of the host.
+
+    Returns:
+        HostPolicy: The policy shared by every request to the host in this process.
+    """
+    host = host_of(url)
+    with _POLICIES_LOCK:
+        if host not in _POLICIES:
+            _POLICIES[host] = HostPolicy()
+        return _POLICIES[host]
+
+
+def set_host_policy(url, policy):
+    """
+    Replaces the policy of the host of a URL, e.g. to allow a higher rate to a local server.
+
+    Args:
+        url (str): Any URL of the host.
+        policy (HostPolicy or None): The new policy. None restores the default on next use.
+    """
+    host = host_of(url)
+    with _POLICIES_LOCK:
+        if policy is None:
+            _POLICIES.pop(host, None)
+        else:
+            _POLICIES[host] = policy
+
+
+def throttle_stats():
+    """
+    Returns the state of the policy of every host contacted so far.
+
+    Returns:
+        dict: The stats of each policy keyed by host.
+    """
+    with _POLICIES_LOCK:
+        policies = dict(_POLICIES)
+    return {host: policy.stats() for host, policy in policies.items()}
+
+
+def retry_delay(attempt, base=BACKOFF_BASE, maximum=BACKOFF_MAX):
+    """
+    Returns the delay before a retry: exponential in the attempt number, with full jitter.
+
+    Args:
+        attempt (int): The number of attempts already made (0 for the first retry).
+
+    Returns:
+        float: The delay in seconds.
+    """
+    return random.uniform(0, min(maximum, base * 2 ** attempt))
+
+
+def parse_retry_after(value):
+    """
+    Parses a Retry-After header, given either in seconds or as an HTTP date.
+
+    Args:
+        value (str or None): The header value.
+
+    Returns:
+        float or None: The number of seconds to wait, or None if the header is missing or invalid.
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
@@ -0,0 +1,440 @@
+import argparse
+import itertools
+import os
+import pickle
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from journal import pair_key, parse_pair_key
+
+VERBOSE=False
+
+QUEUE_PATH = os.environ.get("BILBAO_QUEUE_PATH", "work_queue.sqlite")
+
+# Seconds a claimed task stays leased without a heartbeat before another worker may take it over
+LEASE_SECONDS = 120
+# Seconds between two heartbeats of a worker, well below LEASE_SECONDS
+HEARTBEAT_INTERVAL = 30
+# Seconds between two checks while waiting for a task leased by another worker
+POLL_INTERVAL = 1.0
+# Number of times a failed query is claimed again before it is left as failed
+MAX_ATTEMPTS = 3
+
+# Kind of the query tasks; sub-page tasks use the name of their memo (e.g. "supergroup_info")
+PAIR = "pair"
+
+#################################################################################################################################
+
+
+def new_worker_id():
+    """
+    Returns a name identifying a worker across hosts: its host name, process id and a random suffix.
+    """
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+class WorkQueue:
+    """
+    Queue of queries and sub-pages shared by batch workers on several hosts through a SQLite
+    database on a shared disk.
+
+    Two kinds of tasks are held:
+        - queries, added with add_pairs and pulled by the workers with claim_pair;
+        - sub-pages (supergroup and Wyckoff splitting pages), claimed by the memos (see
+          memo.MemoCache.claim) when the queue is set as the "queue" persistent store. A page
+          claimed by another worker is waited for and then read from the queue instead of
+          being fetched again.
+
+    A claimed task is leased to its worker for lease_seconds. The worker renews the leases of
+    all its tasks with heartbeat (see heartbeats); the tasks of a worker that stopped sending
+    heartbeats are taken over by the others once their lease expires. Tasks are keyed by query
+    or normalized URL, so adding the same query twice or claiming a page already claimed does
+    not duplicate work. Each thread using the queue leases under its own owner name (see
+    owner), so threads of one worker wait for each other's pages like separate workers do.
+
+    The database uses the rollback journal rather than WAL, which needs shared memory and does
+    not work on network file systems. Every claim is a single IMMEDIATE transaction.
+
+    Args:
+        path (str, optional): The path of the SQLite database. Defaults to QUEUE_PATH.
+        worker (str, optional): The name of this worker. Defaults to new_worker_id().
+        lease_seconds (float, optional): The duration of a lease. Defaults to LEASE_SECONDS.
+    """
+
+    def __init__(self, path=QUEUE_PATH, worker=None, lease_seconds=LEASE_SECONDS):
+        self.path = path
+        self.worker = worker or new_worker_id()
+        self.lease_seconds = lease_seconds
+        self._lock = threading.Lock()
+        self._connection = None
+        self._pid = None
+        self._local = threading.local()
+        self._thread_numbers = itertools.count(1)
+
+    def _connect(self):
+        # Connections cannot be shared with forked worker processes, so reopen after a fork
+        if self._connection is None or self._pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=60, check_same_thread=False, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=DELETE")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS tasks ("
+                " kind TEXT NOT NULL,"
+                " task_key TEXT NOT NULL,"
+                " status TEXT NOT NULL,"
+                " owner TEXT,"
+                " lease_expires REAL,"
+                " attempts INTEGER NOT NULL DEFAULT 0,"
+                " result BLOB,"
+                " error TEXT,"
+                " updated_at REAL NOT NULL,"
+                " PRIMARY KEY (kind, task_key))"
+            )
+            connection.execute("CREATE INDEX IF NOT EXISTS tasks_status ON tasks (kind, status)")
+            connection.execute("CREATE INDEX IF NOT EXISTS tasks_owner ON tasks (owner)")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS workers ("
+                " worker TEXT PRIMARY KEY,"
+                " started_at REAL NOT NULL,"
+                " heartbeat_at REAL NOT NULL)"
+            )
+            self._connection = connection
+            self._pid = os.getpid()
+        return self._connection
+
+    def __getstate__(self):
+        # Only the path is sent to worker processes; each of them is a worker of its own
+        return {"path": self.path, "lease_seconds": self.lease_seconds}
+
+    def __setstate__(self, state):
+        self.__init__(state["path"], lease_seconds=state["lease_seconds"])
+
+    @property
+    def owner(self):
+        """
+        The owner of the leases taken by the calling thread: the worker name followed by a
+        number of the thread.
+        """
+        owner = getattr(self._local, "owner", None)
+        if owner is None:
+            owner = self._local.owner = f"{self.worker}/{next(self._thread_numbers)}"
+        return owner
+
+    def _owned_by_worker(self):
+        # SQL condition and parameters matching the leases of every thread of this worker
+        prefix = f"{self.worker}/"
+        return "substr(owner, 1, ?) = ?", (len(prefix), prefix)
+
+    def _execute(self, query, parameters=()):
+        with self._lock:
+            return self._connect().execute(query, parameters).fetchall()
+
+    @contextmanager
+    def _transaction(self):
+        # Takes the write lock of the database up front, so two workers never claim the same task
+        with self._lock:
+            connection = self._connect()
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                yield connection
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+            connection.execute("COMMIT")
+
+    def _lease(self, connection, kind, key, now):
+        connection.execute(
+            "INSERT INTO tasks (kind, task_key, status, owner, lease_expires, attempts, updated_at) VALUES (?, ?, 'leased', ?, ?, 1, ?)"
+            " ON CONFLICT (kind, task_key) DO UPDATE SET status = 'leased', owner = excluded.owner,"
+            " lease_expires = excluded.lease_expires, attempts = attempts + 1, updated_at = excluded.updated_at",
+            (kind, key, self.owner, now + self.lease_seconds, now),
+        )
+
+    def add_pairs(self, pairs):
+        """
+        Adds queries to the queue. Queries already in the queue, whatever their status, are ignored.
+
+        Args:
+            pairs (iterable): The (spg_1, z_1, spg_2, z_2, k_index) queries.
+
+        Returns:
+            int: The number of queries added.
+        """
+        now = time.time()
+        with self._transaction() as connection:
+            before = connection.total_changes
+            connection.executemany(
+                "INSERT OR IGNORE INTO tasks (kind, task_key, status, updated_at) VALUES (?, ?, 'pending', ?)",
+                [(PAIR, pair_key(pair), now) for pair in pairs],
+            )
+            return connection.total_changes - before
+
+    def claim_pair(self):
+        """
+        Leases the next query that is pending or whose lease expired.
+
+        A query whose lease expired after MAX_ATTEMPTS attempts is marked failed instead, so a
+        query that kills its worker is not retried forever.
+
+        Returns:
+            tuple or None: The (spg_1, z_1, spg_2, z_2, k_index) query, or None if there is none to claim.
+        """
+        now = time.time()
+        with self._transaction() as connection:
+            connection.execute(
+                "UPDATE tasks SET status = 'failed', error = 'Lease of ' || owner || ' expired', owner = NULL,"
+                " lease_expires = NULL, updated_at = ? WHERE kind = ? AND status = 'leased' AND lease_expires < ? AND attempts >= ?",
+                (now, PAIR, now, MAX_ATTEMPTS),
+            )
+            row = connection.execute(
+                "SELECT task_key FROM tasks WHERE kind = ? AND (status = 'pending' OR (status = 'leased' AND lease_expires < ?))"
+                " ORDER BY rowid LIMIT 1",
+                (PAIR, now),
+            ).fetchone()
+            if row is None:
+                return None
+            self._lease(connection, PAIR, row[0], now)
+        return parse_pair_key(row[0])
+
+    def complete_pair(self, pair, result):
+        """
+        Marks a query as completed and stores its result.
+
+        Args:
+            pair (tuple): The (spg_1, z_1, spg_2, z_2, k_index) query.
+            result (list): The common supergroups of the query.
+        """
+        self._execute(
+            "UPDATE tasks SET status = 'done', owner = NULL, lease_expires = NULL, result = ?, error = NULL, updated_at = ?"
+            " WHERE kind = ? AND task_key = ?",
+            (sqlite3.Binary(pickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL)), time.time(), PAIR, pair_key(pair)),
+        )
+
+    def fail_pair(self, pair, error):
+        """
+        Records a failed attempt at a query. It is claimed again until it failed MAX_ATTEMPTS times.
+
+        Args:
+            pair (tuple): The (spg_1, z_1, spg_2, z_2, k_index) query.
+            error (Exception): The exception raised by the query.
+        """
+        self._execute(
+            "UPDATE tasks SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, owner = NULL,"
+            " lease_expires = NULL, error = ?, updated_at = ? WHERE kind = ? AND task_key = ?",
+            (MAX_ATTEMPTS, repr(error), time.time(), PAIR, pair_key(pair)),
+        )
+
+    def unfinished_pairs(self):
+        """
+        Returns the number of queries pending or leased, by this or another worker.
+        """
+        return self._execute("SELECT COUNT(*) FROM tasks WHERE kind = ? AND status IN ('pending', 'leased')", (PAIR,))[0][0]
+
+    def completed_results(self):
+        """
+        Yields every completed query with its stored result, whichever worker completed it,
+        reading and unpickling one row at a time (see journal.Journal.completed_results).
+
+        The rows are read through a connection of their own. In rollback-journal mode it holds
+        a read lock until the iteration ends, during which workers cannot write to the queue.
+
+        Yields:
+            tuple: The (pair, result) of each completed query.
+        """
+        with self._lock:
+            # Creates the tables of a new queue
+            self._connect()
+        connection = sqlite3.connect(self.path, timeout=60)
+        try:
+            for key, result in connection.execute("SELECT task_key, result FROM tasks WHERE kind = ? AND status = 'done'",
+                                                  (PAIR,)):
+                yield parse_pair_key(key), pickle.loads(result)
+        finally:
+            connection.close()
+
+    def failed_pairs(self):
+        """
+        Returns the last error message of every query that failed MAX_ATTEMPTS times.
+
+        Returns:
+            dict: The error messages keyed by pair_key.
+        """
+        return dict(self._execute("SELECT task_key, error FROM tasks WHERE kind = ? AND status = 'failed'", (PAIR,)))
+
+    def load(self, name, key):
+        """
+        Returns the parsed result of a sub-page completed by any worker.
+
+        Args:
+            name (str): The name of the memo the result belongs to (e.g. "supergroup_info").
+            key (str): The normalized URL of the page.
+
+        Returns:
+            The parsed result, or None if the page is not completed.
+        """
+        rows = self._execute("SELECT result FROM tasks WHERE kind = ? AND task_key = ? AND status = 'done'", (name, key))
+        return pickle.loads(rows[0][0]) if rows else None
+
+    def save(self, name, key, value):
+        """
+        Stores the parsed result of a sub-page and marks it completed.
+
+        Args:
+            name (str): The name of the memo the result belongs to (e.g. "supergroup_info").
+            key (str): The normalized URL of the page.
+            value: The parsed result.
+        """
+        self._execute(
+            "INSERT INTO tasks (kind, task_key, status, result, updated_at) VALUES (?, ?, 'done', ?, ?)"
+            " ON CONFLICT (kind, task_key) DO UPDATE SET status = 'done', owner = NULL, lease_expires = NULL,"
+            " result = excluded.result, updated_at = excluded.updated_at",
+            (name, key, sqlite3.Binary(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)), time.time()),
+        )
+
+    def claim(self, name, key, poll_interval=POLL_INTERVAL):
+        """
+        Claims a sub-page before computing it, so that no two workers fetch the same page.
+
+        If another worker holds a live lease on the page, waits until it is completed and
+        returns its result. The page is claimed when it is new, released, or its lease expired.
+
+        Args:
+            name (str): The name of the memo the result belongs to (e.g. "supergroup_info").
+            key (str): The normalized URL of the page.
+            poll_interval (float, optional): Seconds between two checks while waiting.
+
+        Returns:
+            The result computed by another worker, or None if this worker now holds the claim.
+        """
+        while True:
+            now = time.time()
+            with self._transaction() as connection:
+                row = connection.execute("SELECT status, owner, lease_expires, result FROM tasks WHERE kind = ? AND task_key = ?",
+                                         (name, key)).fetchone()
+                if row is not None and row[0] == 'done':
+                    return pickle.loads(row[3])
+                if row is None or row[0] != 'leased' or row[1] == self.owner or row[2] < now:
+                    self._lease(connection, name, key, now)
+                    return None
+            time.sleep(poll_interval)
+
+    def release(self, name, key):
+        """
+        Gives up the claim of a sub-page whose computation failed, so another worker can retry it.
+
+        Args:
+            name (str): The name of the memo the result belongs to (e.g. "supergroup_info").
+            key (str): The normalized URL of the page.
+        """
+        self._execute(
+            "UPDATE tasks SET status = 'pending', owner = NULL, lease_expires = NULL, updated_at = ?"
+            " WHERE kind = ? AND task_key = ? AND owner = ? AND status = 'leased'",
+            (time.time(), name, key, self.owner),
+        )
+
+    def heartbeat(self):
+        """
+        Records that this worker is alive and renews the leases of all its tasks.
+        """
+        now = time.time()
+        owned, parameters = self._owned_by_worker()
+        with self._transaction() as connection:
+            connection.execute(
+                "INSERT INTO workers (worker, started_at, heartbeat_at) VALUES (?, ?, ?)"
+                " ON CONFLICT (worker) DO UPDATE SET heartbeat_at = excluded.heartbeat_at",
+                (self.worker, now, now),
+            )
+            connection.execute(f"UPDATE tasks SET lease_expires = ? WHERE {owned} AND status = 'leased'",
+                               (now + self.lease_seconds,) + parameters)
+
+    def leave(self):
+        """
+        Releases every task still leased by this worker and removes it from the live workers.
+        """
+        owned, parameters = self._owned_by_worker()
+        with self._transaction() as connection:
+            connection.execute(
+                "UPDATE tasks SET status = 'pending', owner = NULL, lease_expires = NULL, updated_at = ?"
+                f" WHERE {owned} AND status = 'leased'",
+                (time.time(),) + parameters,
+            )
+            connection.execute("DELETE FROM workers WHERE worker = ?", (self.worker,))
+
+    @contextmanager
+    def heartbeats(self, interval=HEARTBEAT_INTERVAL):
+        """
+        Context manager sending a heartbeat every interval seconds from a background thread,
+        and releasing the tasks of this worker when the block exits.
+
+        Args:
+            interval (float, optional): Seconds between two heartbeats. Defaults to HEARTBEAT_INTERVAL.
+        """
+        stopped = threading.Event()
+
+        def beat():
+            while not stopped.wait(interval):
+                self.heartbeat()
+
+        self.heartbeat()
+        thread = threading.Thread(target=beat, daemon=True)
+        thread.start()
+        try:
+            yield self
+        finally:
+            stopped.set()
+            thread.join()
+            self.leave()
+
+    def stats(self):
+        """
+        Returns the number of tasks of each kind and status, and the workers alive.
+
+        Returns:
+            dict: With the keys "tasks" ({kind: {status: count}}) and "workers" (the names of the
+                  workers whose last heartbeat is more recent than a lease).
+        """
+        tasks = {}
+        for kind, status, count in self._execute("SELECT kind, status, COUNT(*) FROM tasks GROUP BY kind, status"):
+            tasks.setdefault(kind, {})[status] = count
+        workers = [row[0] for row in self._execute("SELECT worker FROM workers WHERE heartbeat_at >= ? ORDER BY worker",
+                                                   (time.time() - self.lease_seconds,))]
+        return {"tasks": tasks, "workers": workers}
+
+
+def main():
+    """
+    Command line entry point: shows the state of a work queue or exports its results.
+
+    Workers are started with `python batch.py --queue PATH` on every host.
+    """
+    parser = argparse.ArgumentParser(description="Inspect a work queue shared by batch workers.")
+    parser.add_argument("command", choices=("stats", "export"))
+    parser.add_argument("--queue", default=QUEUE_PATH, help="SQLite work queue on a disk shared by the workers")
+    parser.add_argument("--output", help="File the completed results are exported to (.jsonl, or .parquet with pyarrow)")
+    args = parser.parse_args()
+
+    work_queue = WorkQueue(args.queue)
+    if args.command == "stats":
+        stats = work_queue.stats()
+        for kind, counts in sorted(stats["tasks"].items()):
+            print(kind, counts)
+        print(len(stats["workers"]), "workers alive:", *stats["workers"])
+        for key, error in work_queue.failed_pairs().items():
+            print("Failed", key, error)
+        return
+
+    if not args.output:
+        parser.error("export needs --output")
+    from writers import open_sink
+
+    with open_sink(args.output) as sink:
+        for pair, result in work_queue.completed_results():
+            sink.write(pair, result)
+
+
+if __name__ == "__main__":
+
+    main()
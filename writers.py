@@ -0,0 +1,253 @@
+import json
+import os
+
+from models import LazyList, expand_results
+
+VERBOSE=False
+
+# Number of flat records buffered before a Parquet row group is written
+ROW_GROUP_SIZE = 10000
+
+QUERY_COLUMNS = ("spg_1", "z_1", "spg_2", "z_2", "k_index")
+TABLE_COLUMNS = {
+    'N': 'n',
+    'HM Symbol': 'hm_symbol',
+    'PG': 'pg',
+    'ZG': 'zg',
+    'ITA': 'ita',
+    'i1': 'i1',
+    'it1': 'it1',
+    'ik1': 'ik1',
+    'i2': 'i2',
+    'it2': 'it2',
+    'ik2': 'ik2',
+}
+BRANCHES = (('H1', 'G > H1', 'G > H1 Supergroup Info'), ('H2', 'G > H2', 'G > H2 Supergroup Info'))
+MATRIX_COLUMNS = tuple(f"tm_{i}{j}" for i in range(3) for j in range(3))
+VECTOR_COLUMNS = tuple(f"iv_{i}" for i in range(3))
+
+#################################################################################################################################
+
+
+def to_jsonable(value):
+    """
+    Converts a scraped result into plain JSON types (numpy arrays and scalars become lists and numbers).
+
+    Args:
+        value: The value to convert.
+
+    Returns:
+        The value with only dicts, lists, strings, numbers, booleans and None.
+    """
+    if isinstance(value, dict):
+        return {str(key): to_jsonable(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple, LazyList)):
+        return [to_jsonable(item) for item in value]
+    # numpy arrays and scalars, checked without importing numpy for results that hold none
+    if hasattr(value, "tolist"):
+        return value.tolist()
+    return value
+
+
+def flatten_result(pair, result):
+    """
+    Flattens the result of one query into records with one level of scalar fields.
+
+    There is one record per Wyckoff splitting row of every supergroup listed under the
+    'G > H1' and 'G > H2' branches of every common supergroup. Supergroups without
+    Wyckoff splitting rows, and common supergroups that were not expanded, still produce
+    one record with the missing fields set to None.
+
+    The transformation matrix is stored in the fixed columns tm_00 ... tm_22 and the
+    initial vector in iv_0 ... iv_2.
+
+    Args:
+        pair (tuple): The (spg_1, z_1, spg_2, z_2, k_index) query.
+        result (list): The common supergroups returned for the query, as dictionaries or
+            models.CommonSupergroup objects.
+
+    Yields:
+        dict: The flat records.
+    """
+    query = dict(zip(QUERY_COLUMNS, (int(value) for value in pair)))
+    for entry in expand_results(result):
+        common = dict(query)
+        for key, column in TABLE_COLUMNS.items():
+            common[column] = entry.get(key)
+
+        expanded = False
+        for branch, url_key, info_key in BRANCHES:
+            supergroups = entry.get(info_key)
+            if not supergroups:
+                continue
+            expanded = True
+            for supergroup in supergroups:
+                record = dict(common)
+                record["branch"] = branch
+                record["supergroup_url"] = entry.get(url_key)
+                record.update(_flatten_supergroup(supergroup))
+                wyckoff_rows = supergroup.get("Wyckoff splitting info") or [None]
+                for wyckoff_row in wyckoff_rows:
+                    yield dict(record, **_flatten_wyckoff(wyckoff_row))
+
+        if not expanded:
+            record = dict(common, branch=None, supergroup_url=None)
+            record.update(_flatten_supergroup(None))
+            record.update(_flatten_wyckoff(None))
+            yield record
+
+
+def _flatten_supergroup(supergroup):
+    import numpy as np
+
+    if supergroup is None:
+        fields = {"supergroup_number": None}
+        fields.update(dict.fromkeys(MATRIX_COLUMNS))
+        fields.update(dict.fromkeys(VECTOR_COLUMNS))
+        fields["coset_representatives"] = None
+        return fields
+
+    fields = {"supergroup_number": supergroup.get("Supergroup number")}
+    matrix = np.asarray(supergroup.get("Transformation matrix"), dtype=float).reshape(9)
+    vector = np.asarray(supergroup.get("Initial vector"), dtype=float).reshape(3)
+    fields.update(zip(MATRIX_COLUMNS, matrix.tolist()))
+    fields.update(zip(VECTOR_COLUMNS, vector.tolist()))
+    cosets = supergroup.get("Coset representatives")
+    fields["coset_representatives"] = ";".join(cosets) if cosets else None
+    return fields
+
+
+def _flatten_wyckoff(wyckoff_row):
+    if wyckoff_row is None:
+        return {"wyckoff_number": None, "wyckoff_group": None, "wyckoff_subgroup": None, "wyckoff_position_splitting": None}
+
+    subgroup = wyckoff_row.get("Wyckoff Subgroup")
+    position_splitting = wyckoff_row.get("Wyckoff Position Splitting Info")
+    return {
+        "wyckoff_number": wyckoff_row.get("Wyckoff number"),
+        "wyckoff_group": wyckoff_row.get("Wyckoff Group"),
+        "wyckoff_subgroup": " ".join(subgroup) if subgroup else None,
+        "wyckoff_position_splitting": json.dumps(to_jsonable(position_splitting)) if position_splitting is not None else None,
+    }
+
+
+class JsonlSink:
+    """
+    Streams flat result records to a JSON Lines file, one record per line.
+
+    Args:
+        path (str): The path of the output file.
+        append (bool, optional): Whether to append to an existing file (e.g. when resuming a batch).
+    """
+
+    def __init__(self, path, append=False):
+        self.path = path
+        # Whether the records already in the file are kept
+        self.appending = append
+        self._file = open(path, "a" if append else "w", encoding="utf-8")
+
+    def write(self, pair, result):
+        """
+        Writes the records of one completed query and flushes them to disk.
+
+        Args:
+            pair (tuple): The (spg_1, z_1, spg_2, z_2, k_index) query.
+            result (list): The common supergroups returned for the query.
+        """
+        for record in flatten_result(pair, result):
+            self._file.write(json.dumps(record))
+            self._file.write("\n")
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class ParquetSink:
+    """
+    Streams flat result records to a Parquet file, writing a row group every ROW_GROUP_SIZE records.
+
+    Requires pyarrow. Parquet files cannot be appended to: the file is always rewritten, so a
+    resumed batch writes the results of its previous runs again first (see batch.main).
+
+    Args:
+        path (str): The path of the output file.
+        row_group_size (int, optional): The number of records buffered per row group.
+    """
+
+    def __init__(self, path, row_group_size=ROW_GROUP_SIZE):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError as error:
+            raise ImportError("Writing Parquet files requires pyarrow (pip install pyarrow)") from error
+
+        self._pyarrow = pyarrow
+        self.path = path
+        self.row_group_size = row_group_size
+        self.appending = False
+        self._buffer = []
+
+        string = pyarrow.string()
+        fields = [pyarrow.field(column, pyarrow.int32()) for column in QUERY_COLUMNS]
+        fields += [pyarrow.field(column, string) for column in TABLE_COLUMNS.values()]
+        fields += [pyarrow.field("branch", string), pyarrow.field("supergroup_url", string), pyarrow.field("supergroup_number", string)]
+        fields += [pyarrow.field(column, pyarrow.float64()) for column in MATRIX_COLUMNS + VECTOR_COLUMNS]
+        fields += [pyarrow.field(column, string) for column in ("coset_representatives", "wyckoff_number", "wyckoff_group",
+                                                                "wyckoff_subgroup", "wyckoff_position_splitting")]
+        self.schema = pyarrow.schema(fields)
+        self._writer = pyarrow.parquet.ParquetWriter(path, self.schema)
+
+    def write(self, pair, result):
+        """
+        Buffers the records of one completed query, writing a row group once enough are buffered.
+
+        Args:
+            pair (tuple): The (spg_1, z_1, spg_2, z_2, k_index) query.
+            result (list): The common supergroups returned for the query.
+        """
+        self._buffer.extend(flatten_result(pair, result))
+        if len(self._buffer) >= self.row_group_size:
+            self.flush()
+
+    def flush(self):
+        """
+        Writes the buffered records as a row group.
+        """
+        if self._buffer:
+            table = self._pyarrow.Table.from_pylist(self._buffer, schema=self.schema)
+            self._writer.write_table(table)
+            self._buffer = []
+
+    def close(self):
+        self.flush()
+        self._writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def open_sink(path, append=False):
+    """
+    Opens the sink matching the extension of path: .parquet for Parquet, anything else for JSON Lines.
+
+    Args:
+        path (str): The path of the output file.
+        append (bool, optional): Whether to append to an existing JSON Lines file. Parquet
+            files are always rewritten; the appending attribute of the sink tells which happened.
+
+    Returns:
+        JsonlSink or ParquetSink: The opened sink.
+    """
+    if os.path.splitext(path)[1].lower() in (".parquet", ".pq"):
+        return ParquetSink(path)
+    return JsonlSink(path, append=append)